@@ -2,6 +2,8 @@ from google import genai
 from google.genai import types
 from google.adk.tools import ToolContext
 import os
+from functools import lru_cache
+from . import config
 
 # GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
 # SCORE_THRESHOLD = int(os.getenv("SCORE_THRESHOLD", 45))
@@ -10,18 +12,21 @@ import os
 # GENAI_MODEL = os.getenv("GENAI_MODEL", "gemini-2.0-flash")
 
 
-client = genai.Client(
-    vertexai=True
-)
+@lru_cache(maxsize=None)
+def get_client():
+    # Created on the first image request so importing the agent does not
+    # resolve credentials or open connections.
+    return genai.Client(
+        vertexai=True
+    )
 
 
 async def generate_images(imagen_prompt: str, tool_context: ToolContext):
 
     try:
 
-        response = client.models.generate_images(
-            # model="imagen-3.0-generate-002",
-            model="imagen-4.0-generate-preview-06-06",
+        response = get_client().models.generate_images(
+            model=config.IMAGEN_MODEL,
             prompt=imagen_prompt,
             config=types.GenerateImagesConfig(
                 number_of_images=1,
@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict, deque
+
+import config
+
+# Lower value is served first.
+PRIORITY_TEXT = 0
+PRIORITY_IMAGE = 1
+
+IMAGE_KEYWORDS = ("image", "diagram", "photo", "picture", "illustrat", "draw", "sketch")
+
+
+def classify_priority(query: str) -> int:
+    """Image generation prompts are the most expensive requests and yield to text."""
+    lowered = (query or "").lower()
+    if "generate" in lowered or "create" in lowered or "draw" in lowered:
+        if any(keyword in lowered for keyword in IMAGE_KEYWORDS):
+            return PRIORITY_IMAGE
+    return PRIORITY_TEXT
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until the next token is available."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Global and per-user rate limits in front of the agent, with a bounded priority queue.
+
+    A request first spends a token from its user's bucket (or is rejected
+    right away), then takes a global token. When the global bucket is empty it
+    waits in the queue, text before image generation, for at most
+    `max_wait_seconds`. A full queue is rejected immediately.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = config.ADMISSION_GLOBAL_RATE,
+        global_burst: float = config.ADMISSION_GLOBAL_BURST,
+        user_rate: float = config.ADMISSION_USER_RATE,
+        user_burst: float = config.ADMISSION_USER_BURST,
+        max_queue: int = config.ADMISSION_MAX_QUEUE,
+        max_wait_seconds: float = config.ADMISSION_MAX_WAIT_SECONDS,
+        max_tracked_users: int = 10000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.user_buckets = OrderedDict()
+        self.max_tracked_users = max_tracked_users
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._queue = []  # heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+        self._dispatcher = None
+
+        self.admitted = 0
+        self.rejected = {"user_rate": 0, "queue_full": 0, "queue_timeout": 0}
+        self.max_queue_depth_seen = 0
+        self.wait_seconds = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def _user_bucket(self, user_id: str) -> TokenBucket:
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self.user_buckets[user_id] = bucket
+            if len(self.user_buckets) > self.max_tracked_users:
+                self.user_buckets.popitem(last=False)
+        else:
+            self.user_buckets.move_to_end(user_id)
+        return bucket
+
+    async def acquire(self, user_id: str, priority: int = PRIORITY_TEXT) -> float:
+        """Waits for admission and returns the seconds spent queued, or raises AdmissionRejected."""
+        user_bucket = self._user_bucket(user_id)
+        if not user_bucket.try_acquire():
+            self.rejected["user_rate"] += 1
+            raise AdmissionRejected("Too many requests for this user.", user_bucket.wait_time())
+
+        if not self._queue and self.global_bucket.try_acquire():
+            self._record_admission(0.0)
+            return 0.0
+
+        if len(self._queue) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            retry_after = (len(self._queue) + 1) / self.global_bucket.rate
+            raise AdmissionRejected("Server is busy, please retry later.", retry_after)
+
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(self._queue, entry)
+        self.max_queue_depth_seen = max(self.max_queue_depth_seen, len(self._queue))
+        self._ensure_dispatcher()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if future.done():
+                # Admitted in the same tick the wait expired.
+                waited = time.monotonic() - start
+                self._record_admission(waited)
+                return waited
+            future.cancel()
+            self._remove(entry)
+            self.rejected["queue_timeout"] += 1
+            raise AdmissionRejected("Server is busy, please retry later.", self.max_wait_seconds)
+        except asyncio.CancelledError:
+            future.cancel()
+            self._remove(entry)
+            raise
+        waited = time.monotonic() - start
+        self._record_admission(waited)
+        return waited
+
+    def _remove(self, entry):
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+
+    def _record_admission(self, waited: float):
+        self.admitted += 1
+        self.wait_seconds.append(waited)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self):
+        """Hands global tokens to queued requests in priority order as they refill."""
+        while self._queue:
+            wait = self.global_bucket.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.global_bucket.try_acquire()
+            future.set_result(None)
+
+    def get_stats(self) -> dict:
+        waits = sorted(self.wait_seconds)
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4)
+
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth_seen": self.max_queue_depth_seen,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_seconds_p50": percentile(0.50),
+            "wait_seconds_p95": percentile(0.95),
+            "wait_seconds_max": round(waits[-1], 4) if waits else 0.0,
+        }
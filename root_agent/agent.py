@@ -1,14 +1,7 @@
-from google.adk.agents import Agent
-from google.adk.tools import agent_tool
-from rag_agent import rag_agent_ncert, rag_agent_kts
-from search_agent import search_agent_tool
-from imagen_agent import imagen_agent_tool
-
-root_agent = Agent(
-    name="RootAgent",
-    model="gemini-2.5-flash",
-    description="Agent to interact with the user and answer their questions.",
-    instruction='''
+from functools import lru_cache
+
+# The RAG tools (and the numbering after them) come from corpora.json; see root_instruction().
+ROOT_INSTRUCTION = '''
     # ROLE
     You are a smart dispatcher agent. If the user asks you to explain a image do it with your inherent ability or using search_agent_tool. Your primary function is to analyze the user's request and route it to the most appropriate tool. You must use one of the available tools to answer the user. 
 
@@ -16,22 +9,80 @@ root_agent = Agent(
     1.  **search_agent_tool**: Use this for simple, direct fact-finding queries. This includes questions asking for specific data points, definitions, dates, or quick lookups.
         -   Examples: "who is the ceo of google", "what is the capital of nepal", "latest stock price of AAPL".
 
-    2.  **rag_agent_ncert**: Use this for complex questions that require explanation, reasoning, synthesis of information, or a detailed response. This agent first finds relevant information from NCERT Textbooks and then thinks about it to provide a comprehensive answer.
-        -   Examples: "generate a few mcq questions from the chapter glimpses of india in ncert textbooks of class10 english part1", "generate a few mcq questions from the chapter glimpses of india in ncert textbooks of class10 english part2".
-
-    3.  **rag_agent_kts**: Use this for complex questions that require explanation, reasoning, synthesis of information, or a detailed response. This agent first finds relevant information from KTS Textbooks and then thinks about it to provide a comprehensive answer.
-        -   Examples: "generate a few mcq questions from the chapter glimpses of india in kts textbooks of class10 english part1", "generate a few mcq questions from the chapter glimpses of india in kts textbooks of class10 english part2".
-
-    4.  **imagen_agent_tool**: Use this tool to generate illustrative diagrams based on user inputs.
+{rag_tools}
+    {imagen_number}.  **imagen_agent_tool**: Use this tool to generate illustrative diagrams based on user inputs.
         -   Examples: "generate a image to explain the concept of photosynthesis", "generate a diagram to explain the workings of a steam engine",  "generate a photo to explain the workings of refrigerator", "generate a image to explain the concept of photosynthesis".
 
     # INSTRUCTIONS
     1.  Read the user's query carefully.
-    2.  Based on the query's nature, choose between `search_agent_tool` for simple facts and `rag_agent_ncert` or `rag_agent_kts` for Textbook related questions or `imagen_agent_tool` for image generation.
+    2.  Based on the query's nature, choose between `search_agent_tool` for simple facts and {rag_names} for Textbook related questions or `imagen_agent_tool` for image generation.
     3.  Invoke the chosen agent with the user's query.
     4.  Directly return the output of the invoked tool to the user.
-    ''',
-    # tools=[agent_tool.AgentTool(agent=search_agent_tool), agent_tool.AgentTool(agent=rag_agent_ncert),agent_tool.AgentTool(agent=rag_agent_kts), agent_tool.AgentTool(agent=imagen_agent)],
-    tools=[agent_tool.AgentTool(agent=search_agent_tool), agent_tool.AgentTool(agent=rag_agent_ncert),agent_tool.AgentTool(agent=rag_agent_kts), agent_tool.AgentTool(agent=imagen_agent_tool)],
-    # tools=[agent_tool.AgentTool(agent=search_agent_tool), agent_tool.AgentTool(agent=rag_agent_ncert),agent_tool.AgentTool(agent=rag_agent_kts), generate_images],
-)
+    '''
+
+RAG_TOOL_INSTRUCTION = '''    {number}.  **{agent}**: Use this for complex questions that require explanation, reasoning, synthesis of information, or a detailed response. This agent first finds relevant information from {description} and then thinks about it to provide a comprehensive answer.
+        -   Examples: {examples}.
+'''
+
+
+def root_instruction() -> str:
+    """ROOT_INSTRUCTION with one entry per textbook corpus of the registry."""
+    from corpus_registry import corpora
+
+    rag_tools = "\n".join(
+        RAG_TOOL_INSTRUCTION.format(
+            number=i + 2,
+            agent=corpus.agent_name,
+            description=corpus.description,
+            examples=", ".join(f'"{example}"' for example in corpus.examples),
+        )
+        for i, corpus in enumerate(corpora.corpora)
+    )
+    rag_names = " or ".join(f"`{corpus.agent_name}`" for corpus in corpora.corpora)
+    return ROOT_INSTRUCTION.format(rag_tools=rag_tools, imagen_number=len(corpora.corpora) + 2, rag_names=rag_names)
+
+
+@lru_cache(maxsize=None)
+def get_root_agent():
+    """Builds the agent tree on first use so importing this module stays cheap."""
+    from google.adk.agents import Agent
+    from google.adk.tools import agent_tool
+    from rag_agent import get_rag_agents
+    from search_agent import get_search_agent_tool
+    from imagen_agent import get_imagen_agent_tool
+    from media_store import resolve_media_references
+    from model_registry import registry, select_model
+    from resilient_adk import ResilientGemini
+    from context_cache import apply_context_cache, record_cache_usage
+    from usage_accounting import start_model_call, record_model_usage
+    from rag_prefetch import start_prefetch, settle_prefetch
+    from chapter_store import answer_from_chapter_store
+
+    search_agent_tool = get_search_agent_tool()
+    rag_agents = get_rag_agents()
+    imagen_agent_tool = get_imagen_agent_tool()
+
+    return Agent(
+        name="RootAgent",
+        model=ResilientGemini(model=registry.model_for("root")),
+        description="Agent to interact with the user and answer their questions.",
+        instruction=root_instruction(),
+        # tools=[agent_tool.AgentTool(agent=search_agent_tool), agent_tool.AgentTool(agent=rag_agent_ncert),agent_tool.AgentTool(agent=rag_agent_kts), agent_tool.AgentTool(agent=imagen_agent)],
+        # Sub-agent runs are not retried as a whole: their leaf calls (search,
+        # retrieval, model) are, and only the read-only lookups are hedged.
+        tools=[agent_tool.AgentTool(agent=search_agent_tool), *[agent_tool.AgentTool(agent=rag_agent) for rag_agent in rag_agents], agent_tool.AgentTool(agent=imagen_agent_tool)],
+        # tools=[agent_tool.AgentTool(agent=search_agent_tool), agent_tool.AgentTool(agent=rag_agent_ncert),agent_tool.AgentTool(agent=rag_agent_kts), generate_images],
+        # Requests the precomputed chapter store covers are answered before
+        # any model call. Likely retrievals start next, in parallel with the
+        # routing call. The context cache depends on the model select_model
+        # picked; the usage timer starts last so it only measures the model call.
+        before_model_callback=[answer_from_chapter_store, start_prefetch, resolve_media_references, select_model, apply_context_cache, start_model_call],
+        after_model_callback=[record_cache_usage, record_model_usage, settle_prefetch],
+    )
+
+
+def __getattr__(name):
+    # Keeps `from agent import root_agent` (and `adk web`) working.
+    if name == "root_agent":
+        return get_root_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
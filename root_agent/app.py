@@ -16,43 +16,40 @@ warnings.filterwarnings("ignore")
 # Make sure 'agent.py' containing 'root_agent' is in the same directory
 from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
+from google.adk.artifacts import InMemoryArtifactService
 from google.genai import types # For creating message Content/Parts
+from media_store import save_upload
+from artifact_store import artifact_store
+from image_jobs import jobs as image_jobs, IMAGE_JOB_KEY
 
 
-async def get_agent_response_async(runner: Runner, user_id: str, session_id: str, query: str, audio_bytes = None, image = None) -> str:
+async def get_agent_response_async(runner: Runner, user_id: str, session_id: str, query: str, audio_bytes = None, image = None, image_job_id: Optional[str] = None) -> str:
     """
     Sends a query to the ADK agent and retrieves its final response.
     This function is adapted from your original `call_agent_async`.
+    Images the agent generates are collected under the image job `image_job_id`.
     """
     st.session_state.messages.append({"role": "user", "content": query})
     st.session_state.chat_history.append({"role": "user", "content": query})
 
+    # Uploads are stored once as artifacts; the session only keeps a reference
+    # that the root agent resolves back to bytes for the turn that needs them.
     if audio_bytes:
-        # audio_content = types.FileData(
-        #                     mime_type='audio/mpeg', # Or 'image/png', etc.
-        #                     file_uri=path_audio
-        #                 )
-        print(type(audio_bytes))
-        audio_content = types.Blob(
-            mime_type='audio/wav',
-            data=audio_bytes,
-        )
+        audio_ref = await save_upload(runner.artifact_service, runner.app_name, user_id, session_id, audio_bytes, 'audio/wav')
         # Prepare the user's message in ADK format
-        content = types.Content(role='user',parts=[types.Part(inline_data=audio_content)])
+        content = types.Content(role='user',parts=[audio_ref])
     elif image:
-        image_content = types.Blob(
-            mime_type='image/png', # Or 'image/png', etc.
-            data=image
-        )
+        image_ref = await save_upload(runner.artifact_service, runner.app_name, user_id, session_id, image, 'image/png')
         # Prepare the user's message in ADK format
-        content = types.Content(role='user',parts=[types.Part(text=query), types.Part(inline_data=image_content)])
+        content = types.Content(role='user',parts=[types.Part(text=query), image_ref])
     else:
         content = types.Content(role='user', parts=[types.Part(text=query)])
 
     final_response_text = "Agent did not produce a final response."
 
     # Key Concept: run_async executes the agent logic and yields Events.
-    async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
+    state_delta = {IMAGE_JOB_KEY: image_job_id} if image_job_id else None
+    async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content, state_delta=state_delta):
         print("This is event")
         print(event)
         # print(event.content.parts[0].inline_data)
@@ -123,7 +120,8 @@ def main():
             st.session_state.runner = Runner(
                 agent=root_agent,
                 app_name=st.session_state.app_name,
-                session_service=st.session_state.session_service
+                session_service=st.session_state.session_service,
+                artifact_service=InMemoryArtifactService()
             )
             st.success("ADK Agent initialized successfully!")
         except ImportError:
@@ -194,6 +192,7 @@ def main():
         # Get agent response asynchronously
         with st.spinner("Agent thinking..."):
             if "runner" in st.session_state:
+                image_job_id = str(uuid.uuid4())
                 response = asyncio.run(
                     get_agent_response_async(
                         st.session_state.runner,
@@ -202,18 +201,15 @@ def main():
                         prompt,
                         audio_bytes,
                         png_bytes,
+                        image_job_id,
                     )
                 )
-                target_image = "generated_image_0.png"
-                available = os.listdir(os.getcwd())
-                print(available)
-                if target_image in available:
-                    image_to_display = target_image
-                    st.image(target_image, caption="Generated by Imagen 3")
-                    try:
-                        os.remove(target_image)  # Clean up the image after displaying
-                    except Exception as e:
-                        print(f"An error occured while removing: {e}")
+                # Show the images this turn generated that are ready by now.
+                job = image_jobs.get(image_job_id)
+                for variant in job.variants if job else []:
+                    entry = artifact_store.get(variant["artifact_id"]) if variant["status"] == "ready" else None
+                    if entry:
+                        st.image(entry[0], caption="Generated by Imagen 3")
             else:
                 response = "Agent not initialized. Please check for errors above."
 
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image, features
+
+import config
+
+# Formats images can be converted to on request, keyed by the `format` query
+# value. AVIF needs a Pillow build with libavif; it is left out otherwise.
+IMAGE_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+if features.check("avif"):
+    IMAGE_FORMATS["avif"] = "image/avif"
+
+
+def artifact_url(artifact_id: str) -> str:
+    return f"/artifacts/{artifact_id}"
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parses a single `bytes=` range into inclusive (start, end).
+
+    Returns None when the whole body should be sent (no header, or several
+    ranges, which the server may ignore). Raises ValueError when the range
+    cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            # Suffix range: the last N bytes.
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError("empty suffix range")
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError(f"invalid range {header!r}")
+    if start >= size or end < start:
+        raise ValueError(f"range {header!r} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+def _convert(data: bytes, image_format: str, width: Optional[int]) -> bytes:
+    img = Image.open(io.BytesIO(data))
+    if width and width < img.width:
+        img.thumbnail((width, round(img.height * width / img.width)))
+    if image_format == "jpeg" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    out = io.BytesIO()
+    img.save(out, format=image_format.upper(), quality=config.ARTIFACT_IMAGE_QUALITY)
+    return out.getvalue()
+
+
+class ArtifactStore:
+    """Content-addressed, size-bounded in-memory store for artifacts served over HTTP.
+
+    An artifact's id is the sha256 of its bytes, so a URL always names the
+    same content and can be cached forever. Converted and resized variants
+    are generated once and kept in the same LRU budget as the originals.
+    An evicted original with an uploaded copy (see add_source) is read back
+    from the object store, so its URL keeps working.
+    """
+
+    def __init__(self, max_bytes: int = config.ARTIFACT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (artifact_id, format, width) -> (bytes, mime_type)
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._converting = {}
+        self.sources = OrderedDict()  # artifact_id -> (blob name in the upload object store, mime_type)
+        self.stats = {
+            "puts": 0, "hits": 0, "misses": 0, "variant_hits": 0, "conversions": 0, "evictions": 0, "source_reads": 0,
+        }
+
+    def _store(self, key, data: bytes, mime_type: str):
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            self.entries[key] = (data, mime_type)
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, data: bytes, mime_type: str) -> str:
+        """Stores `data` and returns its artifact id."""
+        artifact_id = hashlib.sha256(data).hexdigest()
+        self.stats["puts"] += 1
+        self._store((artifact_id, None, None), data, mime_type)
+        return artifact_id
+
+    def add_source(self, artifact_id: str, blob_name: str, mime_type: str):
+        """Records the upload_queue blob holding a copy of the artifact."""
+        with self._lock:
+            self.sources[artifact_id] = (blob_name, mime_type)
+            self.sources.move_to_end(artifact_id)
+            while len(self.sources) > config.ARTIFACT_MAX_SOURCES:
+                self.sources.popitem(last=False)
+
+    def get(self, artifact_id: str) -> Optional[Tuple[bytes, str]]:
+        entry = self._lookup((artifact_id, None, None))
+        self.stats["hits" if entry else "misses"] += 1
+        return entry
+
+    async def load(self, artifact_id: str) -> Optional[Tuple[bytes, str]]:
+        """Like get, but reads an evicted artifact back from its uploaded copy."""
+        entry = self.get(artifact_id)
+        source = self.sources.get(artifact_id)
+        if entry is not None or source is None:
+            return entry
+        from upload_queue import upload_queue
+
+        blob_name, mime_type = source
+        data = await upload_queue.read(blob_name)
+        if data is None or hashlib.sha256(data).hexdigest() != artifact_id:
+            return None
+        self.stats["source_reads"] += 1
+        self._store((artifact_id, None, None), data, mime_type)
+        return data, mime_type
+
+    async def get_variant(self, artifact_id: str, image_format: str, width: Optional[int] = None) -> Optional[Tuple[bytes, str]]:
+        """Returns the artifact converted to `image_format` and at most `width` pixels wide."""
+        key = (artifact_id, image_format, width)
+        entry = self._lookup(key)
+        if entry is not None:
+            self.stats["variant_hits"] += 1
+            return entry
+        original = await self.load(artifact_id)
+        if original is None:
+            return None
+        # Concurrent requests for the same variant share one conversion.
+        task = self._converting.get(key)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(_convert, original[0], image_format, width))
+            self._converting[key] = task
+            task.add_done_callback(lambda _: self._converting.pop(key, None))
+            self.stats["conversions"] += 1
+        data = await asyncio.shield(task)
+        entry = (data, IMAGE_FORMATS[image_format])
+        self._store(key, *entry)
+        return entry
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["entries"] = len(self.entries)
+        stats["total_bytes"] = self.total_bytes
+        return stats
+
+
+artifact_store = ArtifactStore()
@@ -0,0 +1,84 @@
+"""Shows the tail-latency effect of retries and hedging against a fake upstream.
+
+The fake upstream answers most calls quickly, a few very slowly and fails a
+few with a transient error, like google_search and RAG retrieval do.
+Run from the root_agent directory:
+    python -m benchmarks.hedging --calls 400
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from resilience import Policy, ResilientCaller
+
+
+class FakeUpstream:
+    def __init__(self, fast_ms: float, slow_ms: float, slow_ratio: float, error_ratio: float, seed: int):
+        self.fast_ms = fast_ms
+        self.slow_ms = slow_ms
+        self.slow_ratio = slow_ratio
+        self.error_ratio = error_ratio
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        roll = self.random.random()
+        if roll < self.error_ratio:
+            await asyncio.sleep(self.fast_ms / 1000)
+            raise ConnectionError("injected transient failure")
+        slow = roll < self.error_ratio + self.slow_ratio
+        base = self.slow_ms if slow else self.fast_ms
+        await asyncio.sleep(self.random.uniform(0.8, 1.2) * base / 1000)
+        return "ok"
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+async def run(label: str, policy: Policy, args) -> None:
+    upstream = FakeUpstream(args.fast_ms, args.slow_ms, args.slow_ratio, args.error_ratio, args.seed)
+    caller = ResilientCaller({"default": policy}, retry_budget_ratio=0.2, hedge_budget_ratio=0.1)
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await caller.call("default", upstream)
+            except ConnectionError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(args.calls)))
+    print(
+        f"{label:22} p50={statistics.median(latencies):7.1f}ms p95={percentile(latencies, 0.95):7.1f}ms "
+        f"p99={percentile(latencies, 0.99):7.1f}ms errors={errors / args.calls:6.2%} "
+        f"extra_load={upstream.calls / args.calls - 1:6.2%}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--fast-ms", type=float, default=50)
+    parser.add_argument("--slow-ms", type=float, default=1000)
+    parser.add_argument("--slow-ratio", type=float, default=0.04)
+    parser.add_argument("--error-ratio", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    await run("no retry, no hedge", Policy(max_attempts=1), args)
+    await run("retry", Policy(max_attempts=3, base_delay=0.02), args)
+    await run("retry + hedge at p95", Policy(max_attempts=3, base_delay=0.02, hedge=True), args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
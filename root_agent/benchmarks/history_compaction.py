@@ -0,0 +1,90 @@
+"""Measures what session history compaction saves on a long synthetic session.
+
+Run from the root_agent directory:
+    python -m benchmarks.history_compaction --turns 40
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from session_compaction import CompactingSessionService, estimate_tokens
+
+APP_NAME = "compaction_benchmark"
+USER_ID = "bench_user"
+
+
+def make_turn(i: int, image_bytes: bytes) -> list[Event]:
+    """One turn shaped like a real RootAgent turn: image upload, RAG call, answer."""
+    invocation_id = f"inv-{i}"
+    user = Event(
+        author="user",
+        invocation_id=invocation_id,
+        content=types.Content(role="user", parts=[
+            types.Part(text=f"Question {i}: explain the chapter shown in this picture."),
+            types.Part(inline_data=types.Blob(mime_type="image/png", data=image_bytes)),
+        ]),
+    )
+    call = Event(
+        author="RootAgent",
+        invocation_id=invocation_id,
+        content=types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(
+            id=f"call-{i}", name="rag_agent_ncert", args={"request": f"question {i}"},
+        ))]),
+    )
+    result = Event(
+        author="RootAgent",
+        invocation_id=invocation_id,
+        content=types.Content(role="user", parts=[types.Part(function_response=types.FunctionResponse(
+            id=f"call-{i}", name="rag_agent_ncert", response={"result": "retrieved chunk text " * 400},
+        ))]),
+    )
+    answer = Event(
+        author="RootAgent",
+        invocation_id=invocation_id,
+        content=types.Content(role="model", parts=[types.Part(text=f"Answer {i}: " + "explanation " * 60)]),
+    )
+    return [user, call, result, answer]
+
+
+async def run(service, turns: int, image_bytes: bytes) -> dict:
+    session = await service.create_session(app_name=APP_NAME, user_id=USER_ID)
+    lookup_seconds = 0.0
+    for i in range(turns):
+        start = time.perf_counter()
+        # The runner fetches the whole session at the start of every turn.
+        session = await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session.id)
+        lookup_seconds += time.perf_counter() - start
+        for event in make_turn(i, image_bytes):
+            await service.append_event(session, event)
+    session = await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session.id)
+    return {
+        "events_in_history": len(session.events),
+        "estimated_prompt_tokens": estimate_tokens(session.events),
+        "session_lookup_seconds": round(lookup_seconds, 4),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--image-kb", type=int, default=200)
+    args = parser.parse_args()
+
+    image_bytes = os.urandom(args.image_kb * 1024)
+    baseline = await run(InMemorySessionService(), args.turns, image_bytes)
+    compacting_service = CompactingSessionService()
+    compacted = await run(compacting_service, args.turns, image_bytes)
+
+    print(f"{'':28}{'baseline':>14}{'compacted':>14}")
+    for key in baseline:
+        print(f"{key:28}{baseline[key]:>14}{compacted[key]:>14}")
+    print("compaction stats:", compacting_service.get_stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,503 @@
+"""Load test of the FastAPI handlers with fake model, Imagen, retrieval and TTS backends.
+
+Replays a mix of text questions, image and audio uploads, image-generation
+prompts and speech synthesis at a Poisson arrival rate, then reports
+p50/p95/p99 latency, throughput and error rate per workload plus the
+server's memory growth. The real agent tree runs with all its callbacks,
+AgentTools and ResilientGemini models; only the HTTP transport of the genai
+client is fake (it answers like the Gemini API after a sleep, routing
+questions to the search, RAG and Imagen sub-agents), as are the RAG
+retrieval call and the TTS client. What is measured is everything above
+the network: admission, sessions, ADK plumbing, artifacts, uploads.
+
+The server runs in-process by default; `--server local` starts it in a
+separate uvicorn process instead (memory is then read from that process).
+main.py only has the text /chat route, so other workloads are skipped for it.
+Run from the root_agent directory:
+    python -m benchmarks.load_test --target fastapi_endpoint --rate 20 --duration 30
+    python -m benchmarks.load_test --target main --rate 50 --duration 30 --server local
+    python -m benchmarks.load_test --output before.json    # later: --compare before.json
+"""
+import argparse
+import asyncio
+import gc
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# Set before any module of the app reads config: uploads go to a scratch
+# directory and nothing talks to a real backend. The genai client uses the
+# Gemini API with a dummy key; its transport is replaced by the fake below.
+# The Gemini API has no built-in RAG retrieval tool, so the RAG agents
+# retrieve on the client (from the fake retrieval) and compress the passages.
+os.environ.setdefault("UPLOAD_BACKEND", "local")
+os.environ.setdefault("CONTEXT_CACHE_BACKEND", "off")
+os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "false"
+os.environ.setdefault("GOOGLE_API_KEY", "load-test")
+os.environ.setdefault("RAG_COMPRESSION", "true")
+
+WORKLOADS = ("text", "image", "audio", "imagegen", "tts")
+TARGET_WORKLOADS = {
+    "fastapi_endpoint": WORKLOADS,
+    "main": ("text",),
+}
+DEFAULT_MIX = "text=60,image=10,audio=10,imagegen=10,tts=10"
+
+QUESTIONS = [
+    "what is the name of chapter 3 of class 6 NCERT english textbook?",
+    "explain photosynthesis in simple words",
+    "who is the ceo of google",
+    "generate a few mcq questions from the chapter glimpses of india",
+]
+IMAGE_PROMPTS = [
+    "generate a image to explain the concept of photosynthesis",
+    "generate a diagram to explain the workings of a steam engine",
+]
+# The RootAgent tool the fake model calls for a question; others are answered directly.
+ROUTES = {
+    "what is the name of chapter 3 of class 6 NCERT english textbook?": "rag_agent_ncert",
+    "who is the ceo of google": "google_search_agent",
+    "generate a few mcq questions from the chapter glimpses of india": "rag_agent_ncert",
+    **{prompt: "imagen_agent_tool" for prompt in IMAGE_PROMPTS},
+}
+ANSWER = "This is a synthetic answer used by the load test. " * 10
+PASSAGES = ["A synthetic textbook passage used by the load test. " * 8] * 5
+
+
+# --- Fake backends ---
+
+def sample_png(size: int = 256) -> bytes:
+    from PIL import Image
+
+    img = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def sample_wav(seconds: float = 2.0, sample_rate: int = 16000) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(os.urandom(int(seconds * sample_rate) * 2))
+    return out.getvalue()
+
+
+def jittered(ms: float, rng: random.Random) -> float:
+    return rng.uniform(0.7, 1.3) * ms / 1000
+
+
+def fake_model_reply(body: dict) -> dict:
+    """The part a model would answer a generateContent request with.
+
+    RootAgent calls the sub-agent ROUTES names for the question, the Imagen
+    agent calls generate_images, and every call that follows a tool result
+    (or has no tool to call) answers with text.
+    """
+    contents = body.get("contents") or [{}]
+    declared = {d["name"] for tool in body.get("tools") or [] for d in tool.get("functionDeclarations") or []}
+    last = contents[-1].get("parts") or []
+    if any("functionResponse" in part for part in last):
+        return {"text": ANSWER}
+    text = " ".join(part.get("text", "") for part in last)
+    if "generate_images" in declared:
+        return {"functionCall": {"name": "generate_images", "args": {"imagen_prompt": text}}}
+    route = ROUTES.get(text)
+    if route in declared:
+        return {"functionCall": {"name": route, "args": {"request": text}}}
+    return {"text": ANSWER}
+
+
+def fake_genai_transport(model_ms: float, image_ms: float, rng: random.Random, png: bytes):
+    """An httpx transport for the genai client that answers like the Gemini API, after a sleep."""
+    import base64
+    import httpx
+    import genai_clients
+
+    class FakeGenaiTransport(genai_clients.CountingAsyncTransport):
+        async def handle_async_request(self, request):
+            path = request.url.path
+            body = json.loads(await request.aread() or b"{}")
+            if path.endswith(":predict"):
+                await asyncio.sleep(jittered(image_ms, rng))
+                image = {"bytesBase64Encoded": base64.b64encode(png).decode(), "mimeType": "image/png"}
+                return httpx.Response(200, json={"predictions": [image]})
+            if not path.endswith(("GenerateContent", "generateContent")):
+                # models.get and the like, e.g. from the startup warm-up.
+                return httpx.Response(200, json={"name": path.rsplit("/", 1)[-1]})
+            await asyncio.sleep(jittered(model_ms, rng))
+            prompt_tokens = len(json.dumps(body.get("contents", []))) // 4
+            response = {
+                "candidates": [{"content": {"role": "model", "parts": [fake_model_reply(body)]}, "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": 120, "totalTokenCount": prompt_tokens + 120},
+            }
+            if path.endswith(":streamGenerateContent"):
+                return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=b"data: " + json.dumps(response).encode() + b"\r\n\r\n")
+            return httpx.Response(200, json=response)
+
+    return FakeGenaiTransport
+
+
+def install_fake_backends(args) -> None:
+    """Points the genai transport, Imagen, RAG retrieval and TTS at the fakes; the agent tree stays real."""
+    import genai_clients
+    import tts
+    from corpus_registry import corpora
+    from rag_agent import _retrieval_tool_class
+    from tools import image_generation_tool
+
+    rng = random.Random(args.seed)
+    genai_clients.CountingAsyncTransport = fake_genai_transport(args.model_ms, args.image_ms, rng, sample_png())
+    genai_clients._client.cache_clear()
+    # Imagen goes through the same (Gemini API) client as the agents.
+    image_generation_tool.get_client = lambda: genai_clients.get_client(vertexai=False)
+
+    async def fake_retrieve(self, query, store):
+        await asyncio.sleep(jittered(args.rag_ms, rng))
+        return list(PASSAGES)
+
+    _retrieval_tool_class()._retrieve = fake_retrieve
+    for corpus in corpora.corpora:
+        # No file listing: every retrieval searches the whole (fake) corpus.
+        corpus._files = []
+
+    class FakeTTS:
+        def synthesize_speech(self, input, voice, audio_config):
+            time.sleep(jittered(args.tts_ms, rng))
+            return SimpleNamespace(audio_content=b"\xff\xf3" * (len(input.text) * 40))
+
+    fake_tts = FakeTTS()
+    tts.get_client = lambda: fake_tts
+
+
+def load_app(target: str, args):
+    install_fake_backends(args)
+    if target == "fastapi_endpoint":
+        import fastapi_endpoint
+
+        return fastapi_endpoint.app
+    import main
+
+    return main.app
+
+
+# --- Load generator ---
+
+def parse_mix(mix: str, target: str) -> dict:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise SystemExit(f"Unknown workload '{name}', use any of {', '.join(WORKLOADS)}")
+        weights[name] = float(weight or 1)
+    skipped = [name for name in weights if name not in TARGET_WORKLOADS[target]]
+    if skipped:
+        print(f"{target} has no route for: {', '.join(skipped)} (skipped)")
+    weights = {name: w for name, w in weights.items() if name in TARGET_WORKLOADS[target] and w > 0}
+    if not weights:
+        raise SystemExit("Nothing left to send; check --mix")
+    return weights
+
+
+def build_request(target: str, workload: str, user_id: str, session_id: str, rng: random.Random, media: dict) -> dict:
+    """httpx request arguments for one workload."""
+    if target == "main":
+        return {"method": "POST", "url": "/chat", "json": {"query": rng.choice(QUESTIONS), "user_id": user_id, "session_id": session_id}}
+    form = {"user_id": user_id, "session_id": session_id}
+    if workload == "text":
+        return {"method": "POST", "url": "/chat", "data": {**form, "query": rng.choice(QUESTIONS)}}
+    if workload == "image":
+        return {"method": "POST", "url": "/chat", "data": {**form, "query": "explain this picture"},
+                "files": {"image_file": ("photo.png", media["png"], "image/png")}}
+    if workload == "audio":
+        return {"method": "POST", "url": "/chat", "data": form,
+                "files": {"audio_file": ("question.wav", media["wav"], "audio/wav")}}
+    if workload == "imagegen":
+        return {"method": "POST", "url": "/chat", "data": {**form, "query": rng.choice(IMAGE_PROMPTS)}}
+    return {"method": "POST", "url": "/synthesize_speech", "data": {"text": "The name of chapter 3 is Nurturing Nature."}}
+
+
+def rss_bytes(pid: int = None) -> int:
+    """Resident set size of a process (Linux /proc), or the peak RSS of this one elsewhere."""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemorySampler:
+    def __init__(self, pid: int = None, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self.samples.append(rss_bytes(self.pid))
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.samples.append(rss_bytes(self.pid))
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        self.samples.append(rss_bytes(self.pid))
+        mb = 1024 * 1024
+        return {
+            "rss_start_mb": round(self.samples[0] / mb, 1),
+            "rss_end_mb": round(self.samples[-1] / mb, 1),
+            "rss_peak_mb": round(max(self.samples) / mb, 1),
+            "rss_growth_mb": round((self.samples[-1] - self.samples[0]) / mb, 1),
+        }
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    def stats(rows):
+        latencies = [r["ms"] for r in rows if r["ok"]]
+        errors = sum(1 for r in rows if not r["ok"] and r["status"] != 429)
+        return {
+            "requests": len(rows),
+            "ok": len(latencies),
+            "rejected_429": sum(1 for r in rows if r["status"] == 429),
+            "errors": errors,
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+        }
+
+    by_workload = {}
+    for row in results:
+        by_workload.setdefault(row["workload"], []).append(row)
+    return {"total": stats(results), **{name: stats(rows) for name, rows in sorted(by_workload.items())}}
+
+
+async def generate_load(client, target: str, weights: dict, args, duration: float, record: bool) -> list:
+    """Open-loop arrivals: requests are sent on schedule whether or not earlier ones finished."""
+    rng = random.Random(args.seed)
+    media = {"png": sample_png(), "wav": sample_wav()}
+    names, cumulative = list(weights), []
+    total = 0.0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+    sessions = [(f"load_user_{i}", f"load_session_{i}") for i in range(args.users)]
+    results, tasks, errors_seen = [], set(), {}
+    in_flight = 0
+
+    async def one(workload: str, request: dict):
+        nonlocal in_flight
+        in_flight += 1
+        start = time.perf_counter()
+        status, ok = None, False
+        try:
+            response = await client.request(**request, timeout=args.request_timeout)
+            status, ok = response.status_code, response.status_code == 200
+            if not ok:
+                detail = response.text[:120]
+                errors_seen[f"{workload} {status}: {detail}"] = errors_seen.get(f"{workload} {status}: {detail}", 0) + 1
+        except Exception as e:
+            errors_seen[f"{workload} {type(e).__name__}: {e}"[:160]] = errors_seen.get(f"{workload} {type(e).__name__}: {e}"[:160], 0) + 1
+        finally:
+            in_flight -= 1
+        if record:
+            results.append({"workload": workload, "status": status, "ok": ok, "ms": (time.perf_counter() - start) * 1000})
+
+    start = time.perf_counter()
+    next_at = start
+    dropped = 0
+    while next_at - start < duration:
+        next_at += rng.expovariate(args.rate)
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        if in_flight >= args.max_in_flight:
+            # The generator itself would become the bottleneck; count it instead.
+            dropped += 1
+            continue
+        roll = rng.random() * total
+        workload = next((name for name, c in zip(names, cumulative) if roll < c), names[-1])
+        user_id, session_id = rng.choice(sessions)
+        task = asyncio.ensure_future(one(workload, build_request(target, workload, user_id, session_id, rng, media)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    if record and dropped:
+        print(f"generator dropped {dropped} arrivals at --max-in-flight {args.max_in_flight}")
+    if record and errors_seen:
+        print("errors:")
+        for message, count in sorted(errors_seen.items(), key=lambda item: -item[1])[:10]:
+            print(f"  {count:>5} x {message}")
+    return results
+
+
+def start_local_server(target: str, args):
+    port = args.port
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.load_test", "--serve", "--target", target, "--port", str(port),
+         "--model-ms", str(args.model_ms), "--image-ms", str(args.image_ms), "--tts-ms", str(args.tts_ms),
+         "--rag-ms", str(args.rag_ms),
+         "--seed", str(args.seed)],
+        cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def wait_until_up(client, target: str, timeout: float = 120.0):
+    path = "/health" if target == "fastapi_endpoint" else "/"
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get(path)).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.25)
+    raise SystemExit("The local server did not come up")
+
+
+async def run(args) -> dict:
+    import httpx
+
+    weights = parse_mix(args.mix, args.target)
+    server = None
+    if args.server == "local":
+        server, base_url = start_local_server(args.target, args)
+        client = httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=args.max_in_flight))
+        await wait_until_up(client, args.target)
+        pid = server.pid
+    else:
+        app = load_app(args.target, args)
+        if args.target == "main":
+            import main
+
+            await main.startup_event()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest")
+        pid = None
+
+    try:
+        if args.warmup > 0:
+            await generate_load(client, args.target, weights, args, args.warmup, record=False)
+        gc.collect()
+        memory = MemorySampler(pid)
+        memory.start()
+        objects_before = len(gc.get_objects()) if pid is None else None
+        started = time.perf_counter()
+        results = await generate_load(client, args.target, weights, args, args.duration, record=True)
+        elapsed = time.perf_counter() - started
+        gc.collect()
+        report = {
+            "target": args.target,
+            "server": args.server,
+            "rate_rps": args.rate,
+            "duration_s": round(elapsed, 1),
+            "latency": summarize(results, elapsed),
+            "memory": await memory.stop(),
+        }
+        if objects_before is not None:
+            report["memory"]["gc_objects_growth"] = len(gc.get_objects()) - objects_before
+        if results:
+            report["memory"]["rss_growth_kb_per_request"] = round(report["memory"]["rss_growth_mb"] * 1024 / len(results), 2)
+        return report
+    finally:
+        await client.aclose()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"\n{report['target']} ({report['server']}) at {report['rate_rps']} req/s for {report['duration_s']}s")
+    print(f"{'workload':<10} {'reqs':>6} {'ok':>6} {'429':>5} {'err%':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, row in report["latency"].items():
+        line = (f"{name:<10} {row['requests']:>6} {row['ok']:>6} {row['rejected_429']:>5} {row['error_rate']:>6.1%} "
+                f"{row['throughput_rps']:>7.1f} {row['p50_ms'] or 0:>8.1f} {row['p95_ms'] or 0:>8.1f} {row['p99_ms'] or 0:>8.1f}")
+        before = (baseline or {}).get("latency", {}).get(name)
+        if before and before.get("p95_ms") and row["p95_ms"]:
+            line += f"   p95 {row['p95_ms'] / before['p95_ms'] - 1:+.0%} vs baseline"
+        print(line)
+    print("memory: " + ", ".join(f"{k}={v}" for k, v in report["memory"].items()))
+
+
+def serve(args):
+    import uvicorn
+
+    os.chdir(tempfile.mkdtemp(prefix="load_test_"))
+    uvicorn.run(load_app(args.target, args), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=sorted(TARGET_WORKLOADS), default="fastapi_endpoint")
+    parser.add_argument("--server", choices=("inprocess", "local"), default="inprocess")
+    parser.add_argument("--rate", type=float, default=20.0, help="arrivals per second (Poisson)")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before the baseline memory sample")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="workload weights, e.g. text=80,tts=20")
+    parser.add_argument("--users", type=int, default=50, help="distinct users, one session each")
+    parser.add_argument("--admission", choices=("open", "config"), default="open",
+                        help="open: lift the rate limits to measure handler capacity; config: the configured limits")
+    parser.add_argument("--max-in-flight", type=int, default=500)
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--model-ms", type=float, default=400.0, help="fake model latency per call")
+    parser.add_argument("--image-ms", type=float, default=1500.0, help="fake Imagen latency per image")
+    parser.add_argument("--tts-ms", type=float, default=300.0, help="fake TTS latency per call")
+    parser.add_argument("--rag-ms", type=float, default=200.0, help="fake RAG retrieval latency per call")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", help="a JSON report to compare p95 latencies against")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.admission == "open" and not args.serve:
+        # Inherited by the --server local process as well.
+        for name in ("ADMISSION_GLOBAL_RATE", "ADMISSION_GLOBAL_BURST", "ADMISSION_USER_RATE", "ADMISSION_USER_BURST"):
+            os.environ.setdefault(name, "100000")
+    if args.serve:
+        serve(args)
+        return
+    for name in ("output", "compare"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    if args.server == "inprocess":
+        # Generated images and queued uploads are written to the working directory.
+        os.chdir(tempfile.mkdtemp(prefix="load_test_"))
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Measures what reranking and compressing retrieved passages saves, and what it costs in quality.
+
+Retrieves every labelled question of retrieval_eval with its corpus'
+setting from corpora.json (or --top-k/--threshold; local TF-IDF distances
+need a looser threshold than embeddings), then compares the passages as retrieved with the
+output of rag_compression.RagCompressor: context tokens, compression ratio,
+labels still present (retention) and compressor time. With --answer-model
+both contexts are also answered by that model, comparing prompt tokens,
+latency and how many answers contain the labels.
+
+--output writes the report RAG_COMPRESSION=auto reads (RAG_COMPRESSION_REPORT):
+compression is enabled only if its drop in answer label recall is within
+RAG_COMPRESSION_MAX_QUALITY_DROP, so that report needs --answer-model.
+
+Run from the root_agent directory:
+    python -m benchmarks.rag_compression --backend local --local-dir ~/textbooks
+    python -m benchmarks.rag_compression --backend hosted --answer-model gemini-2.0-flash
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import config
+from benchmarks.retrieval_eval import DEFAULT_QUESTIONS, HostedBackend, LocalIndex, corpus_named, labels_of, load_questions, percentile
+from rag_compression import Embedder, RagCompressor, estimate_tokens, quality_drop
+
+ANSWER_PROMPT = "Answer the question using only these passages.\n\n{passages}\n\nQuestion: {question}"
+
+
+def label_recall(texts: list, labels: list) -> float:
+    """Share of the question's text labels found in the texts (source labels do not survive compression)."""
+    text_labels = [label for kind, label in labels if kind == "text"]
+    if not text_labels:
+        return 0.0
+    joined = " ".join(texts).lower()
+    return sum(1 for label in text_labels if label in joined) / len(text_labels)
+
+
+async def answer(model: str, question: str, passages: list) -> dict:
+    from genai_clients import get_client
+
+    joined = "\n\n".join(f"[{i + 1}] {p}" for i, p in enumerate(passages))
+    started = time.perf_counter()
+    response = await get_client().aio.models.generate_content(
+        model=model, contents=ANSWER_PROMPT.format(passages=joined, question=question)
+    )
+    usage = response.usage_metadata
+    return {
+        "text": response.text or "",
+        "seconds": time.perf_counter() - started,
+        "prompt_tokens": usage.prompt_token_count if usage else None,
+    }
+
+
+async def run_question(backend, compressor, question: dict, answer_model, top_k, threshold) -> dict:
+    corpus = corpus_named(question["corpus"])
+    labels = labels_of(question)
+    passages = await backend.search(
+        corpus, question["question"], top_k or corpus.similarity_top_k, threshold or corpus.vector_distance_threshold
+    )
+    full = [p["text"] for p in passages]
+    started = time.perf_counter()
+    compressed = compressor.compress(question["question"], full) if full else []
+    result = {
+        "id": question.get("id"),
+        "corpus": corpus.name,
+        "tokens_full": sum(estimate_tokens(p) for p in full),
+        "tokens_compressed": sum(estimate_tokens(p) for p in compressed),
+        "passages_full": len(full),
+        "passages_compressed": len(compressed),
+        "compress_ms": (time.perf_counter() - started) * 1000,
+        "retention_full": label_recall(full, labels),
+        "retention_compressed": label_recall(compressed, labels),
+    }
+    if answer_model and full:
+        for name, context in (("full", full), ("compressed", compressed)):
+            response = await answer(answer_model, question["question"], context)
+            result[f"answer_{name}_recall"] = label_recall([response["text"]], labels)
+            result[f"answer_{name}_seconds"] = response["seconds"]
+            result[f"answer_{name}_prompt_tokens"] = response["prompt_tokens"]
+    return result
+
+
+def mean(results: list, key: str):
+    values = [r[key] for r in results if r.get(key) is not None]
+    return round(statistics.mean(values), 4) if values else None
+
+
+def quality_of(results: list) -> dict:
+    """Mean label retention (and answer label recall) with full and compressed passages, and their drops."""
+    quality = {}
+    for name, full_key, compressed_key in (
+        ("retention", "retention_full", "retention_compressed"),
+        ("answer_recall", "answer_full_recall", "answer_compressed_recall"),
+    ):
+        full, compressed = mean(results, full_key), mean(results, compressed_key)
+        if full is None or compressed is None:
+            continue
+        quality.update({f"{name}_full": full, f"{name}_compressed": compressed, f"{name}_drop": round(full - compressed, 4)})
+    return quality
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["hosted", "local"], default="hosted")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--local-dir", default="textbooks")
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--overlap-words", type=int, default=40)
+    parser.add_argument("--top-k", type=int, help="default: the corpus' similarity_top_k")
+    parser.add_argument("--threshold", type=float, help="default: the corpus' vector_distance_threshold")
+    parser.add_argument("--token-budget", type=int, default=config.RAG_CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--max-passages", type=int, default=config.RAG_RERANK_MAX_PASSAGES)
+    parser.add_argument("--embedder", default=config.RAG_RERANK_EMBEDDER, help="onnx-minilm or none")
+    parser.add_argument("--answer-model", help="also answer with both contexts and compare the answers")
+    parser.add_argument("--output", help="write the per-question results as JSON")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    if args.backend == "hosted":
+        backend = HostedBackend(config.RAG_METADATA_FILTERS)
+    else:
+        backend = LocalIndex(args.local_dir, args.chunk_words, args.overlap_words, config.RAG_METADATA_FILTERS)
+        questions = [q for q in questions if q["corpus"] in backend.chunks]
+    if not questions:
+        raise SystemExit("No questions to run for the selected corpora")
+
+    embedder = Embedder(args.embedder)
+    embedder.load()  # Model load (or download) is not part of the per-question timing.
+    compressor = RagCompressor(embedder, token_budget=args.token_budget, max_passages=args.max_passages)
+    results = [await run_question(backend, compressor, q, args.answer_model, args.top_k, args.threshold) for q in questions]
+
+    tokens_full, tokens_compressed = sum(r["tokens_full"] for r in results), sum(r["tokens_compressed"] for r in results)
+    compress_ms = [r["compress_ms"] for r in results]
+    print(f"{args.backend} backend, {len(results)} questions, budget {args.token_budget} tokens, semantic scores: "
+          f"{args.embedder if embedder._model is not None else 'char-trigrams'}")
+    print(f"{'':<22} {'full':>10} {'compressed':>11}")
+    print(f"{'context tokens (mean)':<22} {mean(results, 'tokens_full'):>10} {mean(results, 'tokens_compressed'):>11}")
+    print(f"{'passages (mean)':<22} {mean(results, 'passages_full'):>10} {mean(results, 'passages_compressed'):>11}")
+    print(f"{'label retention':<22} {mean(results, 'retention_full'):>10} {mean(results, 'retention_compressed'):>11}")
+    if args.answer_model:
+        for label, key in (("answer label recall", "recall"), ("answer seconds", "seconds"), ("answer prompt tokens", "prompt_tokens")):
+            print(f"{label:<22} {mean(results, f'answer_full_{key}'):>10} {mean(results, f'answer_compressed_{key}'):>11}")
+    ratio = tokens_full / tokens_compressed if tokens_compressed else None
+    print(f"compression ratio {ratio:.2f}x" if ratio else "compression ratio n/a",
+          f"compressor p50 {percentile(compress_ms, 0.5):.1f}ms p95 {percentile(compress_ms, 0.95):.1f}ms")
+    quality = quality_of(results)
+    drop = quality_drop(quality)
+    if drop is None:
+        print("answer quality drop not measured (needs --answer-model); RAG_COMPRESSION=auto stays off")
+    else:
+        print(f"answer quality drop {drop} ({'within' if drop <= config.RAG_COMPRESSION_MAX_QUALITY_DROP else 'over'} "
+              f"RAG_COMPRESSION_MAX_QUALITY_DROP={config.RAG_COMPRESSION_MAX_QUALITY_DROP})")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"compression_ratio": ratio, "quality": quality, "questions": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
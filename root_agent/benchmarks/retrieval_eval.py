@@ -0,0 +1,323 @@
+"""Tunes similarity_top_k and vector_distance_threshold of the textbook retrievals.
+
+Runs a labelled question set against the corpora of corpora.json, on Vertex
+AI RAG (`--backend hosted`) or on a local TF-IDF index of the textbook text
+(`--backend local`, one sub-directory of .txt files per corpus name), and
+reports recall@k, MRR, retrieval latency and the context every setting of
+the grid adds to the RAG agent's prompt. It recommends, per corpus, the
+setting with the smallest context that still meets the recall target.
+
+Each question line is {"id", "corpus", "question"} plus the labels it must
+find: "relevant_text" (snippets a passage contains) and/or
+"relevant_sources" (parts of the file name a passage comes from). Text
+labels come from the answer, not the question: a passage that merely
+repeats the question's words must not count as relevant.
+
+By default every question is retrieved once with the loosest setting and
+the grid is applied to that ranking, which is what a stricter setting would
+return; `--live` retrieves once per setting instead, for per-setting latency.
+Local TF-IDF distances are not on the embedding scale, so on that backend
+only the top_k results carry over to the hosted corpora.
+
+Run from the root_agent directory:
+    python -m benchmarks.retrieval_eval --backend hosted --recall-target 0.9
+    python -m benchmarks.retrieval_eval --backend local --local-dir ~/textbooks
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import time
+from collections import Counter
+
+import config
+from corpus_registry import TOKEN, corpora
+
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_questions.jsonl")
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def estimate_tokens(text: str) -> int:
+    # Same estimate as session_compaction.estimate_tokens.
+    return len(text) // 4
+
+
+def corpus_named(name: str):
+    for corpus in corpora.corpora:
+        if corpus.name == name:
+            return corpus
+    raise KeyError(f"No corpus '{name}' in {config.CORPUS_REGISTRY_PATH}")
+
+
+class HostedBackend:
+    """Vertex AI RAG, narrowed by the question's metadata like the agents' retrievals."""
+
+    def __init__(self, use_filters: bool):
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        self.use_filters = use_filters
+
+    async def search(self, corpus, query: str, top_k: int, threshold: float) -> list:
+        from vertexai.preview import rag
+
+        file_ids = await asyncio.to_thread(corpora.scope_for, corpus, query) if self.use_filters else None
+        response = await asyncio.to_thread(
+            rag.retrieval_query,
+            text=query,
+            rag_resources=[rag.RagResource(rag_corpus=corpus.resource, rag_file_ids=file_ids)],
+            rag_retrieval_config=rag.RagRetrievalConfig(top_k=top_k, filter=rag.Filter(vector_distance_threshold=threshold)),
+        )
+        return [
+            {
+                "text": context.text,
+                "source": context.source_display_name or context.source_uri,
+                "distance": context.distance if context.distance else context.score,
+            }
+            for context in response.contexts.contexts
+        ]
+
+
+class LocalIndex:
+    """TF-IDF index over `<directory>/<corpus name>/*.txt`, chunked like the RAG corpora are."""
+
+    def __init__(self, directory: str, chunk_words: int, overlap_words: int, use_filters: bool):
+        self.use_filters = use_filters
+        self.chunks = {}  # corpus name -> [(file id, text, tf-idf vector, norm)]
+        self.files = {}  # corpus name -> file metadata for the filters
+        self.idf = {}
+        for corpus in corpora.corpora:
+            corpus_dir = os.path.join(os.path.expanduser(directory), corpus.name)
+            if not os.path.isdir(corpus_dir):
+                continue
+            chunks, files = [], []
+            for filename in sorted(os.listdir(corpus_dir)):
+                if not filename.endswith(".txt"):
+                    continue
+                file_id = filename[:-4]
+                metadata = corpus.file_from_name(file_id, filename)
+                if metadata:
+                    files.append(metadata)
+                with open(os.path.join(corpus_dir, filename), encoding="utf-8") as f:
+                    words = f.read().split()
+                step = max(1, chunk_words - overlap_words)
+                for start in range(0, max(1, len(words) - overlap_words), step):
+                    chunks.append((file_id, " ".join(words[start:start + chunk_words])))
+            self.files[corpus.name] = files
+            self._build(corpus.name, chunks)
+
+    def _build(self, corpus_name: str, chunks: list):
+        counts = [Counter(TOKEN.findall(text.lower())) for _, text in chunks]
+        document_frequency = Counter(term for count in counts for term in count)
+        idf = {term: math.log((1 + len(chunks)) / (1 + df)) + 1 for term, df in document_frequency.items()}
+        self.idf[corpus_name] = idf
+        self.chunks[corpus_name] = []
+        for (file_id, text), count in zip(chunks, counts):
+            vector = {term: tf * idf[term] for term, tf in count.items()}
+            norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+            self.chunks[corpus_name].append((file_id, text, vector, norm))
+
+    async def search(self, corpus, query: str, top_k: int, threshold: float) -> list:
+        if corpus.name not in self.chunks:
+            raise KeyError(f"No local text for corpus '{corpus.name}'")
+        allowed = None
+        if self.use_filters:
+            file_ids, _ = corpus.scope(corpora.extract_filters(query, corpus), self.files[corpus.name])
+            allowed = set(file_ids) if file_ids else None
+        idf = self.idf[corpus.name]
+        query_vector = {term: tf * idf.get(term, 0.0) for term, tf in Counter(TOKEN.findall(query.lower())).items()}
+        query_norm = math.sqrt(sum(v * v for v in query_vector.values())) or 1.0
+        scored = []
+        for file_id, text, vector, norm in self.chunks[corpus.name]:
+            if allowed is not None and file_id not in allowed:
+                continue
+            similarity = sum(weight * vector.get(term, 0.0) for term, weight in query_vector.items()) / (norm * query_norm)
+            scored.append({"text": text, "source": file_id, "distance": 1.0 - similarity})
+        scored.sort(key=lambda p: p["distance"])
+        return [p for p in scored if p["distance"] <= threshold][:top_k]
+
+
+def labels_of(question: dict) -> list:
+    return [("text", s.lower()) for s in question.get("relevant_text", [])] + [
+        ("source", s.lower()) for s in question.get("relevant_sources", [])
+    ]
+
+
+def load_questions(path: str) -> list:
+    """The labelled questions of a JSONL file; warns about text labels the question itself contains."""
+    with open(path) as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    for question in questions:
+        text = question["question"].lower()
+        leaked = [label for kind, label in labels_of(question) if kind == "text" and label in text]
+        if leaked:
+            print(f"Question {question.get('id')}: labels {leaked} are words of the question, which inflates recall")
+    return questions
+
+
+def score(passages: list, labels: list, top_k: int, threshold: float) -> dict:
+    """recall, reciprocal rank and context size of what a setting keeps of a ranking."""
+    kept = [p for p in passages if p["distance"] is None or p["distance"] <= threshold][:top_k]
+    found, first_hit = set(), None
+    for rank, passage in enumerate(kept, 1):
+        hits = {
+            label for label in labels
+            if label[1] in (passage["text"] if label[0] == "text" else passage["source"] or "").lower()
+        }
+        if hits and first_hit is None:
+            first_hit = rank
+        found |= hits
+    return {
+        "recall": len(found) / len(labels) if labels else 0.0,
+        "reciprocal_rank": 1.0 / first_hit if first_hit else 0.0,
+        "passages": len(kept),
+        "context_tokens": sum(estimate_tokens(p["text"]) for p in kept),
+    }
+
+
+async def evaluate(backend, questions: list, grid: list, live: bool, concurrency: int) -> dict:
+    """{corpus name: {(top_k, threshold): [per-question result]}}"""
+    loosest = (max(k for k, _ in grid), max(t for _, t in grid))
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+
+    async def timed_search(corpus, query, top_k, threshold):
+        async with semaphore:
+            started = time.perf_counter()
+            passages = await backend.search(corpus, query, top_k, threshold)
+            return passages, (time.perf_counter() - started) * 1000
+
+    async def run_question(question):
+        corpus = corpus_named(question["corpus"])
+        labels = labels_of(question)
+        per_setting = results.setdefault(corpus.name, {})
+        if live:
+            searches = await asyncio.gather(*(timed_search(corpus, question["question"], k, t) for k, t in grid))
+        else:
+            searches = [await timed_search(corpus, question["question"], *loosest)] * len(grid)
+        for (top_k, threshold), (passages, latency_ms) in zip(grid, searches):
+            per_setting.setdefault((top_k, threshold), []).append(
+                {**score(passages, labels, top_k, threshold), "latency_ms": latency_ms}
+            )
+
+    await asyncio.gather(*(run_question(q) for q in questions))
+    return results
+
+
+def summarize(per_question: list) -> dict:
+    latencies = [r["latency_ms"] for r in per_question]
+    return {
+        "questions": len(per_question),
+        "recall": round(statistics.mean(r["recall"] for r in per_question), 4),
+        "mrr": round(statistics.mean(r["reciprocal_rank"] for r in per_question), 4),
+        "passages": round(statistics.mean(r["passages"] for r in per_question), 2),
+        "context_tokens": round(statistics.mean(r["context_tokens"] for r in per_question), 1),
+        "p50_ms": round(percentile(latencies, 0.5), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+    }
+
+
+def recommend(rows: dict, recall_target: float):
+    """Cheapest setting (smallest context, then best MRR, then smallest top_k) meeting the target."""
+    eligible = [(setting, row) for setting, row in rows.items() if row["recall"] >= recall_target]
+    if not eligible:
+        return None
+    return min(eligible, key=lambda item: (item[1]["context_tokens"], -item[1]["mrr"], item[0][0]))[0]
+
+
+def print_report(corpus, rows: dict, recommended, recall_target: float):
+    current = (corpus.similarity_top_k, corpus.vector_distance_threshold)
+    print(f"\ncorpus {corpus.name} ({next(iter(rows.values()))['questions']} questions), current setting top_k={current[0]} threshold={current[1]}")
+    print(f"{'top_k':>6} {'thresh':>7} {'recall':>7} {'mrr':>6} {'passages':>9} {'ctx_tokens':>11} {'p50_ms':>8} {'p95_ms':>8}")
+    for (top_k, threshold), row in sorted(rows.items()):
+        mark = " <- recommended" if (top_k, threshold) == recommended else (" <- current" if (top_k, threshold) == current else "")
+        print(
+            f"{top_k:>6} {threshold:>7.2f} {row['recall']:>7.3f} {row['mrr']:>6.3f} {row['passages']:>9.2f} "
+            f"{row['context_tokens']:>11.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f}{mark}"
+        )
+    if recommended is None:
+        best = max(rows.items(), key=lambda item: item[1]["recall"])
+        print(f"no setting reaches recall {recall_target}; best is {best[1]['recall']} at top_k={best[0][0]} threshold={best[0][1]}")
+        return
+    row = rows[recommended]
+    if current in rows:
+        saved = rows[current]["context_tokens"] - row["context_tokens"]
+        if saved >= 0:
+            print(f"recommended saves {saved:.0f} context tokens per retrieval against the current setting")
+        else:
+            print(f"recommended costs {-saved:.0f} more context tokens per retrieval; the current setting has recall {rows[current]['recall']}")
+    print(f'corpora.json: "similarity_top_k": {recommended[0]}, "vector_distance_threshold": {recommended[1]}')
+
+
+def parse_list(value: str, cast):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["hosted", "local"], default="hosted")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS, help="labelled questions, JSON lines")
+    parser.add_argument("--corpora", default="", help="comma separated corpus names, default all")
+    parser.add_argument("--top-k", default="3,5,8,10,15")
+    parser.add_argument("--thresholds", default="0.3,0.4,0.5,0.6,0.7,0.8")
+    parser.add_argument("--recall-target", type=float, default=0.9)
+    parser.add_argument("--live", action="store_true", help="retrieve once per setting instead of slicing one loose retrieval")
+    parser.add_argument("--no-filters", action="store_true", help="search whole corpora, without the class/subject/chapter filters")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--local-dir", default="textbooks", help="local backend: <dir>/<corpus name>/*.txt")
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--overlap-words", type=int, default=40)
+    parser.add_argument("--output", help="write the full results as JSON")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    wanted = set(parse_list(args.corpora, str))
+    if wanted:
+        questions = [q for q in questions if q["corpus"] in wanted]
+    grid = [(k, t) for k in parse_list(args.top_k, int) for t in parse_list(args.thresholds, float)]
+    # The settings in use are always measured, to compare the recommendation against.
+    for corpus in corpora.corpora:
+        current = (corpus.similarity_top_k, corpus.vector_distance_threshold)
+        if None not in current and current not in grid:
+            grid.append(current)
+
+    use_filters = config.RAG_METADATA_FILTERS and not args.no_filters
+    if args.backend == "hosted":
+        backend = HostedBackend(use_filters)
+    else:
+        backend = LocalIndex(args.local_dir, args.chunk_words, args.overlap_words, use_filters)
+        questions = [q for q in questions if q["corpus"] in backend.chunks]
+    if not questions:
+        raise SystemExit("No questions to run for the selected corpora")
+
+    started = time.perf_counter()
+    results = await evaluate(backend, questions, grid, args.live, args.concurrency)
+    print(
+        f"{args.backend} backend, {len(questions)} questions, {len(grid)} settings, "
+        f"{'live' if args.live else 'sliced from one loose retrieval'}, filters {'on' if use_filters else 'off'}, "
+        f"{time.perf_counter() - started:.1f}s"
+    )
+
+    report = {}
+    for corpus_name, per_setting in results.items():
+        corpus = corpus_named(corpus_name)
+        rows = {setting: summarize(per_question) for setting, per_question in per_setting.items()}
+        recommended = recommend(rows, args.recall_target)
+        print_report(corpus, rows, recommended, args.recall_target)
+        report[corpus_name] = {
+            "recommended": {"similarity_top_k": recommended[0], "vector_distance_threshold": recommended[1]} if recommended else None,
+            "grid": [{"similarity_top_k": k, "vector_distance_threshold": t, **row} for (k, t), row in sorted(rows.items())],
+        }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"backend": args.backend, "recall_target": args.recall_target, "corpora": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""Compares chat payload serialization and compression: CPU time and bytes on the wire.
+
+Payloads are a typical text answer, the same answer with image URLs (what
+/chat sends now) and with an inline base64 PNG (what it used to send), plus
+a stream of progress events.
+Run from the root_agent directory:
+    python -m benchmarks.serialization --iterations 2000
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import time
+
+from PIL import Image
+
+from compression import available_encodings, compress
+from fastapi_endpoint import ChatResponse
+from serialization import dumps, orjson
+
+
+def sample_png(size: int = 512) -> bytes:
+    # Noise compresses about as badly as a real generated image.
+    img = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def payloads() -> dict:
+    answer = (
+        "Photosynthesis is the process by which green plants use sunlight, water and carbon dioxide "
+        "to make glucose and release oxygen. It takes place in the chloroplasts of leaf cells. "
+    ) * 12
+    session_id = "8ca24c44-420e-438c-9471-453cd1864346"
+    with_urls = ChatResponse(
+        response=answer,
+        session_id=session_id,
+        image_urls=[f"/artifacts/{'ab' * 32}", f"/artifacts/{'cd' * 32}"],
+        image_job_id="2f1c7c4e-6a55-4b4f-9d11-2a8f5f6d3e21",
+    )
+    with_base64 = {**with_urls.model_dump(), "bytes_base64": base64.b64encode(sample_png()).decode()}
+    events = [
+        {"type": "delta", "id": 7, "session_id": session_id, "text": word + " "}
+        for word in answer.split()[:200]
+    ]
+    return {
+        "text answer": ChatResponse(response=answer, session_id=session_id),
+        "answer + image urls": with_urls,
+        "answer + base64 png": with_base64,
+        "200 delta events": events,
+    }
+
+
+def stdlib_dumps(value) -> bytes:
+    if hasattr(value, "model_dump_json"):
+        return value.model_dump_json().encode()
+    if isinstance(value, list):
+        return b"\n".join(json.dumps(v).encode() for v in value)
+    return json.dumps(value).encode()
+
+
+def fast_dumps(value) -> bytes:
+    if hasattr(value, "model_dump"):
+        value = value.model_dump()
+    if isinstance(value, list):
+        return b"\n".join(dumps(v) for v in value)
+    return dumps(value)
+
+
+def time_per_call(fn, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    encodings = available_encodings()
+    print(f"serializer: {'orjson' if orjson else 'json (orjson not installed)'}; encodings: {', '.join(encodings)}\n")
+    for name, payload in payloads().items():
+        iterations = max(1, args.iterations // 20) if "base64" in name else args.iterations
+        body = fast_dumps(payload)
+        print(f"{name}: {len(body)} bytes")
+        print(f"  serialize   stdlib {time_per_call(lambda: stdlib_dumps(payload), iterations):8.1f} us"
+              f"   fast {time_per_call(lambda: fast_dumps(payload), iterations):8.1f} us")
+        for encoding in encodings:
+            compressed = compress(body, encoding)
+            cpu = time_per_call(lambda: compress(body, encoding), max(1, iterations // 10))
+            print(f"  {encoding:<5} {len(compressed):>9} bytes ({len(compressed) / len(body):6.1%})  {cpu:8.1f} us")
+        print()
+
+    png = sample_png()
+    print(f"raw png artifact: {len(png)} bytes, served as-is by /artifacts (binary types are not recompressed)")
+    for encoding in encodings:
+        compressed = compress(png, encoding)
+        cpu = time_per_call(lambda: compress(png, encoding), 20)
+        print(f"  {encoding:<5} would give {len(compressed):>9} bytes ({len(compressed) / len(png):6.1%}) for {cpu:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
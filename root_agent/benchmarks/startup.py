@@ -0,0 +1,97 @@
+"""Tracks import time and cold-start time of the FastAPI server.
+
+Cold start is measured to /health (the process answers) and to /ready (the
+startup warm-up of warmup.py is done; it needs credentials to finish).
+
+Each measurement runs in a fresh interpreter so module caches do not hide
+the cost an autoscaled container pays. Run from the root_agent directory:
+    python -m benchmarks.startup --runs 3
+"""
+import argparse
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+IMPORT_SNIPPET = """
+import json, time, warnings
+warnings.filterwarnings("ignore")
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{build}
+built = time.perf_counter()
+print(json.dumps({{"import": imported - start, "build": built - imported}}))
+"""
+
+TARGETS = {
+    "agent": "agent.get_root_agent()",
+    "fastapi_endpoint": "pass",
+}
+
+
+def measure_import(module: str, build: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module, build=build)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_cold_start(path: str, timeout: float = 120.0) -> float:
+    """Seconds from process spawn until `path` answers 200."""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fastapi_endpoint:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.05)
+        raise TimeoutError(f"{path} did not become available within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--skip-server", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    for module, build in TARGETS.items():
+        samples = [measure_import(module, build) for _ in range(args.runs)]
+        results[f"import {module}"] = statistics.median(s["import"] for s in samples)
+        if build != "pass":
+            results[f"build {module}"] = statistics.median(s["build"] for s in samples)
+    if not args.skip_server:
+        results["cold start to /health"] = statistics.median(
+            measure_cold_start("/health") for _ in range(args.runs)
+        )
+        results["cold start to /ready"] = statistics.median(
+            measure_cold_start("/ready", timeout=300.0) for _ in range(args.runs)
+        )
+
+    for name, seconds in results.items():
+        print(f"{name:32}{seconds:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
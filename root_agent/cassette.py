@@ -0,0 +1,269 @@
+import asyncio
+import enum
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import config
+from serialization import dumps
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+# Ids minted per run (ADK function call ids, image job ids, session ids) would
+# make every recorded request unique; they are masked before hashing.
+VOLATILE_ID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+BLOB_REF = "$blob"
+
+
+class CassetteMiss(Exception):
+    """Replay found no recorded interaction for a request."""
+
+
+def request_key(kind: str, payload: Any) -> str:
+    """Stable hash of a request: bytes by content, volatile ids masked, keys sorted."""
+
+    def default(value):
+        if isinstance(value, bytes):
+            return hashlib.sha256(value).hexdigest()
+        if hasattr(value, "model_dump"):
+            return value.model_dump(exclude_none=True)
+        return str(value)
+
+    canonical = json.dumps(payload, default=default, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{kind}\0{VOLATILE_ID.sub('<id>', canonical)}".encode()).hexdigest()
+
+
+def model_request_payload(llm_request) -> dict:
+    """What identifies a model call: the model, the static prefix and the conversation.
+
+    The instruction and tools enter through their context cache key, so a
+    request matches its recording whether or not the prefix was served from
+    a cache.
+    """
+    from context_cache import prefix_key_for
+
+    request_config = llm_request.config
+    return {
+        "model": llm_request.model,
+        "prefix": prefix_key_for(llm_request),
+        "contents": [content.model_dump(exclude_none=True) for content in llm_request.contents],
+        "config": request_config.model_dump(
+            exclude_none=True,
+            exclude={"system_instruction", "tools", "tool_config", "cached_content", "http_options", "labels"},
+        ) if request_config else None,
+    }
+
+
+class Cassette:
+    """Records model, retrieval, corpus file listing and image traffic to disk and plays it back.
+
+    A cassette is a directory with `interactions.jsonl` (one line per call:
+    kind, request key, response and timing) and `blobs/`, where bytes in a
+    response (images, audio) are stored once under their sha256.
+
+    Replay serves a request the first unused recording with the same key;
+    without one it falls back to the next unused recording of that kind in
+    recorded order, or raises CassetteMiss when `strict`. Responses come back
+    immediately, or after their recorded latency times `latency_scale`.
+    """
+
+    def __init__(self, directory: str, mode: str, latency_scale: float = 0.0, strict: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}', use 'record' or 'replay'")
+        self.directory = directory
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self.blob_dir = os.path.join(directory, "blobs")
+        self._lock = threading.Lock()
+        self._seq = {}
+        self._by_key = {}
+        self._by_kind = {}
+        self._used = set()
+        self.stats = {"recorded": 0, "replayed": 0, "key_matches": 0, "order_fallbacks": 0, "misses": 0, "blobs_written": 0}
+        if mode == "record":
+            os.makedirs(self.blob_dir, exist_ok=True)
+        else:
+            self._load()
+
+    # --- storage ---
+
+    def _interactions_path(self) -> str:
+        return os.path.join(self.directory, "interactions.jsonl")
+
+    def _load(self):
+        path = self._interactions_path()
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No cassette at {path}; record one with CASSETTE_MODE=record")
+        with open(path) as f:
+            interactions = [json.loads(line) for line in f if line.strip()]
+        interactions.sort(key=lambda i: (i["kind"], i["seq"]))
+        for index, interaction in enumerate(interactions):
+            interaction["index"] = index
+            self._by_key.setdefault(interaction["key"], []).append(interaction)
+            self._by_kind.setdefault(interaction["kind"], []).append(interaction)
+
+    def _encode(self, value):
+        """Pydantic objects to plain data, with bytes moved to content-addressed blobs."""
+        if hasattr(value, "model_dump"):
+            value = value.model_dump(exclude_none=True)
+        if isinstance(value, enum.Enum):
+            return value.value
+        if isinstance(value, bytes):
+            digest = hashlib.sha256(value).hexdigest()
+            path = os.path.join(self.blob_dir, digest)
+            if not os.path.exists(path):
+                with open(path + ".tmp", "wb") as f:
+                    f.write(value)
+                os.replace(path + ".tmp", path)
+                self.stats["blobs_written"] += 1
+            return {BLOB_REF: digest}
+        if isinstance(value, dict):
+            return {k: self._encode(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._encode(v) for v in value]
+        return value
+
+    def _decode(self, value):
+        if isinstance(value, dict):
+            if set(value) == {BLOB_REF}:
+                with open(os.path.join(self.blob_dir, value[BLOB_REF]), "rb") as f:
+                    return f.read()
+            return {k: self._decode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._decode(v) for v in value]
+        return value
+
+    def _next_seq(self, kind: str) -> int:
+        with self._lock:
+            seq = self._seq.get(kind, 0)
+            self._seq[kind] = seq + 1
+            return seq
+
+    def _write(self, kind: str, key: str, seq: int, responses: list, offsets: list, error: Optional[str] = None, closed: bool = False):
+        line = {
+            "kind": kind,
+            "key": key,
+            "seq": seq,
+            "offsets": [round(o, 4) for o in offsets],
+            "responses": [self._encode(r) for r in responses],
+        }
+        if error is not None:
+            line["error"] = error
+        if closed:
+            line["closed"] = True
+        with self._lock:
+            with open(self._interactions_path(), "ab") as f:
+                f.write(dumps(line) + b"\n")
+            self.stats["recorded"] += 1
+
+    def _take(self, kind: str, key: str) -> dict:
+        with self._lock:
+            for interaction in self._by_key.get(key, []):
+                if interaction["index"] not in self._used:
+                    self._used.add(interaction["index"])
+                    self.stats["key_matches"] += 1
+                    return interaction
+            if not self.strict:
+                for interaction in self._by_kind.get(kind, []):
+                    if interaction["index"] not in self._used:
+                        self._used.add(interaction["index"])
+                        self.stats["order_fallbacks"] += 1
+                        return interaction
+            self.stats["misses"] += 1
+        raise CassetteMiss(f"No recorded {kind} interaction for request {key[:12]}")
+
+    async def _pace(self, offset: float, started: float):
+        if self.latency_scale > 0:
+            await asyncio.sleep(max(0.0, started + offset * self.latency_scale - time.perf_counter()))
+
+    # --- interception points ---
+
+    async def stream(self, kind: str, payload: Any, source: AsyncIterator, decode: Callable[[Any], Any]) -> AsyncIterator:
+        """Records or replays a call that yields several responses (model calls, streaming or not).
+
+        A call its consumer closed or cancelled early (a request past its
+        deadline) is recorded up to that point; on replay it stays open after
+        its last response until the consumer closes it again.
+        """
+        key = request_key(kind, payload)
+        if self.mode == "replay":
+            interaction = self._take(kind, key)
+            started = time.perf_counter()
+            self.stats["replayed"] += 1
+            for offset, response in zip(interaction["offsets"], interaction["responses"]):
+                await self._pace(offset, started)
+                yield decode(self._decode(response))
+            if "error" in interaction:
+                raise RuntimeError(f"Recorded {kind} failure: {interaction['error']}")
+            if interaction.get("closed"):
+                await asyncio.Event().wait()
+            return
+
+        seq = self._next_seq(kind)
+        started = time.perf_counter()
+        responses, offsets, error, closed = [], [], None, False
+        try:
+            async for response in source:
+                responses.append(response)
+                offsets.append(time.perf_counter() - started)
+                yield response
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            closed = True
+            raise
+        finally:
+            await asyncio.to_thread(self._write, kind, key, seq, responses, offsets, error, closed)
+
+    def call_sync(self, kind: str, payload: Any, fetch: Callable[[], Any]):
+        """Records or replays a blocking call with a single result (listing a corpus' files)."""
+        key = request_key(kind, payload)
+        if self.mode == "replay":
+            interaction = self._take(kind, key)
+            self.stats["replayed"] += 1
+            if self.latency_scale > 0 and interaction["offsets"]:
+                time.sleep(interaction["offsets"][0] * self.latency_scale)
+            if "error" in interaction:
+                raise RuntimeError(f"Recorded {kind} failure: {interaction['error']}")
+            return self._decode(interaction["responses"][0])
+
+        seq = self._next_seq(kind)
+        started = time.perf_counter()
+        try:
+            result = fetch()
+        except Exception as e:
+            self._write(kind, key, seq, [], [], f"{type(e).__name__}: {e}")
+            raise
+        self._write(kind, key, seq, [result], [time.perf_counter() - started])
+        return result
+
+    async def call(self, kind: str, payload: Any, fetch: Callable[[], Awaitable], decode: Callable[[Any], Any] = lambda value: value):
+        """Records or replays a call with a single result (retrievals, image generation)."""
+
+        async def source():
+            yield await fetch()
+
+        # Drained to the end: the recording is written after the last result.
+        results = [result async for result in self.stream(kind, payload, source(), decode)]
+        return results[0]
+
+    def get_stats(self) -> dict:
+        return {"mode": self.mode, "directory": self.directory, "latency_scale": self.latency_scale, **self.stats}
+
+
+def load_cassette() -> Optional[Cassette]:
+    if config.CASSETTE_MODE not in CASSETTE_MODES:
+        raise ValueError(f"Unknown CASSETTE_MODE '{config.CASSETTE_MODE}', use one of {CASSETTE_MODES}")
+    if config.CASSETTE_MODE == "off":
+        return None
+    return Cassette(config.CASSETTE_DIR, config.CASSETTE_MODE, config.CASSETTE_LATENCY_SCALE, config.CASSETTE_STRICT)
+
+
+# None unless CASSETTE_MODE is "record" or "replay".
+cassette = load_cassette()
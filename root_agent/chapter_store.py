@@ -0,0 +1,169 @@
+import gzip
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+import config
+from corpus_registry import FILTER_KEYS, corpora, normalize_text
+from serialization import dumps
+
+MCQ_REQUEST = re.compile(r"\b(mcqs?|multiple choice|quiz)\b")
+TITLE_REQUEST = re.compile(
+    r"\b(name|title)\s+of\s+(the\s+)?(chapter|lesson)\b|\b(chapter|lesson)\s*\d+\s+(is\s+)?(called|named)\b"
+)
+SUMMARY_REQUEST = re.compile(r"\b(summary|summarize|summarise|gist|overview)\b|\b(chapter|lesson)\b.*\babout\b")
+MCQ_COUNT = re.compile(r"\b(\d{1,2})\s+(mcqs?|multiple choice|questions)\b")
+LETTERS = "ABCDEFGH"
+
+
+def chapter_key(chapter: dict) -> tuple:
+    return (chapter["corpus"], *(chapter.get(k) for k in FILTER_KEYS))
+
+
+class ChapterStore:
+    """Precomputed MCQ banks, summaries and titles per textbook chapter.
+
+    Built offline by precompute_chapters.py into one gzipped JSON file.
+    Chapters are found by corpus, class, subject and chapter number or
+    title, the same metadata the retrieval filters use (corpus_registry.py).
+    """
+
+    def __init__(self, chapters: list):
+        self.chapters = {}
+        self.by_title = {}  # normalized title -> [chapter]
+        for chapter in chapters:
+            self.put(chapter)
+        self.random = random.Random()
+        self._lock = threading.Lock()
+        self.stats = {"mcqs": 0, "summaries": 0, "titles": 0, "misses": 0, "ambiguous": 0, "seconds": 0.0}
+
+    @classmethod
+    def load(cls, path: str) -> "ChapterStore":
+        if not os.path.exists(path):
+            return cls([])
+        with gzip.open(path, "rb") as f:
+            return cls(json.loads(f.read())["chapters"])
+
+    def save(self, path: str):
+        data = gzip.compress(dumps({"chapters": list(self.chapters.values())}))
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def put(self, chapter: dict):
+        chapter = {**chapter, **corpora.normalize_metadata(chapter)}
+        key = chapter_key(chapter)
+        replaced = self.chapters.get(key)
+        if replaced is not None and replaced.get("title"):
+            self.by_title[normalize_text(replaced["title"])].remove(replaced)
+        self.chapters[key] = chapter
+        if chapter.get("title"):
+            self.by_title.setdefault(normalize_text(chapter["title"]), []).append(chapter)
+
+    def find(self, query: str) -> list:
+        """Chapters the question could be about: named corpus, class, subject, and a chapter number or title."""
+        text = normalize_text(query)
+        words = set(text.split())
+        named = {corpus.name for corpus in corpora.corpora if words & set(corpus.keywords)}
+        filters = corpora.extract_filters(query)
+        if "chapter" in filters:
+            candidates = list(self.chapters.values())
+        else:
+            padded = f" {text} "
+            candidates = [c for title, chapters in self.by_title.items() if f" {title} " in padded for c in chapters]
+        return [
+            c for c in candidates
+            if (not named or c["corpus"] in named) and all(c.get(k) == v for k, v in filters.items())
+        ]
+
+    def answer(self, query: str) -> Optional[str]:
+        """Answer to an MCQ, summary or chapter-name request the store covers, or None."""
+        text = normalize_text(query)
+        if MCQ_REQUEST.search(text):
+            kind = "mcqs"
+        elif TITLE_REQUEST.search(text):
+            kind = "titles"
+        elif SUMMARY_REQUEST.search(text):
+            kind = "summaries"
+        else:
+            return None
+        started = time.perf_counter()
+        chapters = self.find(query)
+        if len(chapters) != 1:
+            with self._lock:
+                self.stats["ambiguous" if chapters else "misses"] += 1
+            return None
+        chapter = chapters[0]
+        if kind == "mcqs":
+            answer = self.sample_mcqs(chapter, text)
+        elif kind == "titles":
+            answer = f"Chapter {chapter['chapter']} of the {self.book_name(chapter)} is \"{chapter['title']}\"." if chapter.get("title") else None
+        else:
+            answer = f"Summary of \"{chapter.get('title') or 'chapter ' + chapter['chapter']}\":\n\n{chapter['summary']}" if chapter.get("summary") else None
+        with self._lock:
+            self.stats[kind if answer else "misses"] += 1
+            self.stats["seconds"] += time.perf_counter() - started
+        return answer
+
+    def book_name(self, chapter: dict) -> str:
+        corpus = next((c for c in corpora.corpora if c.name == chapter["corpus"]), None)
+        board = corpus.board if corpus else chapter["corpus"].upper()
+        return f"class {chapter.get('class')} {board} {chapter.get('subject', '').replace('_', ' ')} textbook"
+
+    def sample_mcqs(self, chapter: dict, text: str) -> Optional[str]:
+        """A random draw from the chapter's bank, options shuffled, so repeated requests differ."""
+        bank = chapter.get("mcqs") or []
+        if not bank:
+            return None
+        match = MCQ_COUNT.search(text)
+        count = int(match.group(1)) if match else config.CHAPTER_STORE_DEFAULT_MCQS
+        count = max(1, min(count, config.CHAPTER_STORE_MAX_MCQS, len(bank)))
+        with self._lock:
+            picked = self.random.sample(bank, count)
+            orders = [self.random.sample(range(len(mcq["options"])), len(mcq["options"])) for mcq in picked]
+        lines, answers = [f"MCQs from \"{chapter.get('title') or 'chapter ' + chapter['chapter']}\":", ""], []
+        for number, (mcq, order) in enumerate(zip(picked, orders), 1):
+            lines.append(f"{number}. {mcq['question']}")
+            for letter, index in zip(LETTERS, order):
+                lines.append(f"   {letter}) {mcq['options'][index]}")
+            answers.append(f"{number}-{LETTERS[order.index(mcq['answer'])]}")
+            lines.append("")
+        lines.append("Answers: " + ", ".join(answers))
+        return "\n".join(lines)
+
+    def get_stats(self) -> dict:
+        served = self.stats["mcqs"] + self.stats["summaries"] + self.stats["titles"]
+        return {
+            "enabled": config.CHAPTER_STORE,
+            "chapters": len(self.chapters),
+            **self.stats,
+            "seconds": round(self.stats["seconds"], 4),
+            "avg_ms": round(self.stats["seconds"] / served * 1000, 3) if served else None,
+        }
+
+
+chapter_store = ChapterStore.load(config.CHAPTER_STORE_PATH)
+
+
+def answer_from_chapter_store(callback_context, llm_request):
+    """before_model_callback of RootAgent: answers stored MCQ, summary and chapter-name requests without a model call."""
+    from google.adk.models import LlmResponse
+    from google.genai import types
+    from media_store import parse_media_reference
+
+    if not config.CHAPTER_STORE or not chapter_store.chapters:
+        return None
+    last = llm_request.contents[-1] if llm_request.contents else None
+    # Only a plain text question; an attached image or audio may change what
+    # is asked. This runs before resolve_media_references, so an upload is
+    # still the text part that references it.
+    if last is None or last.role != "user" or any(not p.text or parse_media_reference(p) for p in last.parts or []):
+        return None
+    answer = chapter_store.answer(" ".join(p.text for p in last.parts))
+    if answer is None:
+        return None
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=answer)]))
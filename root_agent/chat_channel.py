@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import config
+from serialization import dumps_str
+
+FRAME_FORMATS = ("json", "msgpack")
+
+
+class FrameCodec:
+    """Encodes and decodes chat channel frames.
+
+    JSON frames travel as WebSocket text messages; MessagePack frames as
+    binary messages and can carry raw bytes (e.g. an image) without base64.
+    """
+
+    def __init__(self, frame_format: str = "json"):
+        if frame_format not in FRAME_FORMATS:
+            raise ValueError(f"Unknown frame format '{frame_format}', use one of {FRAME_FORMATS}")
+        self.format = frame_format
+        self._msgpack = None
+        if frame_format == "msgpack":
+            try:
+                import msgpack
+            except ImportError:
+                raise ValueError("MessagePack frames need the 'msgpack' package on the server")
+            self._msgpack = msgpack
+
+    def encode(self, message: dict) -> dict:
+        """Returns the ASGI send message for `message`."""
+        if self._msgpack is not None:
+            return {"type": "websocket.send", "bytes": self._msgpack.packb(message, use_bin_type=True)}
+        return {"type": "websocket.send", "text": dumps_str(message)}
+
+    def decode(self, received: dict) -> dict:
+        """Parses an ASGI receive message; raises ValueError on malformed frames."""
+        try:
+            if self._msgpack is not None:
+                if received.get("bytes") is None:
+                    raise ValueError("expected a binary MessagePack frame")
+                message = self._msgpack.unpackb(received["bytes"], raw=False)
+            else:
+                if received.get("text") is None:
+                    raise ValueError("expected a text JSON frame")
+                message = json.loads(received["text"])
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"malformed frame: {e}")
+        if not isinstance(message, dict):
+            raise ValueError("a frame must be an object")
+        return message
+
+
+class Outbox:
+    """Bounded per-connection send queue drained by a single writer task.
+
+    Producers await `put`, so when a client reads slowly the agent runs that
+    feed it are paused instead of buffering without limit.
+    """
+
+    def __init__(self, send, codec: FrameCodec, max_size: int = config.WS_CHAT_SEND_QUEUE_SIZE):
+        self._send = send
+        self.codec = codec
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.stalls = 0
+        self._writer = None
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._write())
+
+    async def put(self, message: dict):
+        if self.queue.full():
+            self.stalls += 1
+        await self.queue.put(message)
+
+    async def _write(self):
+        while True:
+            message = await self.queue.get()
+            await self._send(self.codec.encode(message))
+
+    async def close(self):
+        if self._writer is None:
+            return
+        # Let queued frames go out before stopping the writer.
+        try:
+            await asyncio.wait_for(self._drain(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+        self._writer.cancel()
+
+    async def _drain(self):
+        while not self.queue.empty() and not self._writer.done():
+            await asyncio.sleep(0.01)
+
+
+def progress_events(event) -> list:
+    """Translates an ADK event into the progress frames pushed to the client."""
+    frames = []
+    parts = event.content.parts if event.content and event.content.parts else []
+    for part in parts:
+        if part.function_call:
+            frames.append({"type": "progress", "stage": "tool_call", "name": part.function_call.name})
+        elif part.function_response:
+            frames.append({"type": "progress", "stage": "tool_result", "name": part.function_response.name})
+        elif part.text and event.partial:
+            frames.append({"type": "delta", "text": part.text})
+    return frames
+
+
+class ChannelStats:
+    def __init__(self):
+        self.connections = 0
+        self.open_connections = 0
+        self.requests = 0
+        self.rejected = 0
+        self.send_stalls = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+channel_stats = ChannelStats()
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import re
+from typing import Awaitable, Callable, Optional
+
+from image_jobs import IMAGE_VARIANTS_KEY, IMAGE_ASPECT_RATIOS_KEY
+from model_registry import MODEL_TIER_KEY
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    return WHITESPACE.sub(" ", (query or "").strip().lower()).rstrip(" ?.!")
+
+
+def coalescing_key(route: str, query: str, audio_bytes: Optional[bytes], image_bytes: Optional[bytes], state_delta: dict) -> str:
+    """Requests with the same key get the same answer: same question, media, model tier and image options."""
+    digest = hashlib.sha256()
+    for value in (
+        route,
+        normalize_query(query),
+        state_delta.get(MODEL_TIER_KEY),
+        state_delta.get(IMAGE_VARIANTS_KEY),
+        state_delta.get(IMAGE_ASPECT_RATIOS_KEY),
+    ):
+        digest.update(repr(value).encode() + b"\0")
+    for media in (audio_bytes, image_bytes):
+        digest.update(hashlib.sha256(media).digest() if media else b"\0")
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """Runs one agent call per key at a time; identical concurrent requests share it.
+
+    The shared run is a task of its own, so the request that started it can
+    go away without failing the others. Its exception, if any, reaches every
+    waiting request. A session takes part in one flight at a time: a second
+    request on a session that is already in one (e.g. a double submit) runs
+    on its own, or both would record the same turn in that session.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.sessions = set()
+        self.stats = {"leaders": 0, "followers": 0, "saved_model_calls": 0, "max_waiters": 0, "session_busy": 0}
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[dict]], session: Optional[tuple] = None):
+        """Returns (result, shared); `shared` is True when another request's run answered this one.
+
+        `session` is the (user id, session id) the request belongs to.
+        """
+        if session is not None and session in self.sessions:
+            self.stats["session_busy"] += 1
+            return await fn(), False
+
+        flight = self.flights.get(key)
+        if flight is not None:
+            flight["waiters"] += 1
+            self.stats["followers"] += 1
+            self.stats["max_waiters"] = max(self.stats["max_waiters"], flight["waiters"])
+            self.sessions.add(session)
+            try:
+                result = await asyncio.shield(flight["task"])
+            finally:
+                self.sessions.discard(session)
+            self.stats["saved_model_calls"] += (result.get("usage") or {}).get("calls", 0)
+            return result, True
+
+        task = asyncio.ensure_future(fn())
+        self.flights[key] = {"task": task, "waiters": 0}
+        self.sessions.add(session)
+
+        def land(_):
+            self.flights.pop(key, None)
+            self.sessions.discard(session)
+
+        task.add_done_callback(land)
+        self.stats["leaders"] += 1
+        return await asyncio.shield(task), False
+
+    def get_stats(self) -> dict:
+        # Every follower is an agent run (and its model, search and RAG calls) not made.
+        return {**self.stats, "saved_agent_runs": self.stats["followers"], "in_flight": len(self.flights)}
+
+
+single_flight = SingleFlight()
+
+
+async def is_first_turn(runner, user_id: str, session_id: str) -> bool:
+    session = await runner.session_service.get_session(app_name=runner.app_name, user_id=user_id, session_id=session_id)
+    return session is not None and not session.events
+
+
+async def record_shared_turn(runner, user_id: str, session_id: str, content, answer: str, state_delta: dict):
+    """Adds a coalesced request's question and the shared answer to its own session.
+
+    `content` is the request's own user message, with media references to
+    uploads stored under `user_id`: the shared run's point at its own user's.
+    """
+    from google.adk.agents.invocation_context import new_invocation_context_id
+    from google.adk.events import Event, EventActions
+    from google.genai import types
+
+    session = await runner.session_service.get_session(app_name=runner.app_name, user_id=user_id, session_id=session_id)
+    invocation_id = new_invocation_context_id()
+    await runner.session_service.append_event(session, Event(
+        invocation_id=invocation_id,
+        author="user",
+        content=content,
+        actions=EventActions(state_delta=dict(state_delta)),
+    ))
+    await runner.session_service.append_event(session, Event(
+        invocation_id=invocation_id,
+        author=runner.agent.name,
+        content=types.Content(role="model", parts=[types.Part(text=answer)]),
+    ))
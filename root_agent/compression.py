@@ -0,0 +1,196 @@
+import zlib
+from typing import Optional
+
+import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Payloads in these formats are already compressed; compressing them again
+# costs CPU and saves next to nothing.
+INCOMPRESSIBLE_PREFIXES = ("image/", "audio/", "video/")
+INCOMPRESSIBLE_TYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zstd",
+    "application/octet-stream",
+    "application/pdf",
+}
+INCOMPRESSIBLE_EXCEPTIONS = {"image/svg+xml"}
+
+
+def available_encodings() -> list:
+    """Configured encodings in server preference order, minus those whose library is missing."""
+    installed = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+    return [encoding for encoding in config.COMPRESSION_ENCODINGS if installed.get(encoding)]
+
+
+def negotiate(accept_encoding: Optional[str], encodings: list) -> Optional[str]:
+    """Picks the first server-preferred encoding the client accepts (q > 0)."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type in INCOMPRESSIBLE_EXCEPTIONS:
+        return True
+    if content_type in INCOMPRESSIBLE_TYPES:
+        return False
+    return not content_type.startswith(INCOMPRESSIBLE_PREFIXES)
+
+
+class StreamCompressor:
+    """Incremental compressor; `compress(chunk)` flushes so every chunk is decodable on arrival."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._gzip = zlib.compressobj(config.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._brotli = brotli.Compressor(quality=config.COMPRESSION_BROTLI_QUALITY)
+        elif encoding == "zstd":
+            self._zstd = zstandard.ZstdCompressor(level=config.COMPRESSION_ZSTD_LEVEL).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding '{encoding}'")
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        if self.encoding == "gzip":
+            return self._gzip.compress(data) + self._gzip.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zstd.compress(data)
+        return out + self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return StreamCompressor(encoding).compress(data, final=True)
+
+
+class CompressionStats:
+    def __init__(self):
+        self.responses = 0
+        self.compressed = {}
+        self.skipped = {"small": 0, "incompressible": 0, "not_accepted": 0}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "responses": self.responses,
+            "compressed": dict(self.compressed),
+            "skipped": dict(self.skipped),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+        }
+
+
+compression_stats = CompressionStats()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing HTTP responses with the best encoding the client accepts.
+
+    Bodies smaller than `minimum_size`, already encoded bodies, partial (206)
+    responses and binary media types are sent as they are. Streaming bodies
+    are compressed chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size: int = config.COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = available_encodings()
+        self.stats = compression_stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        encoding = negotiate(headers.get("accept-encoding"), self.encodings)
+        stats = self.stats
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                stats.responses += 1
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            start = state["start"]
+            if start is not None:
+                state["start"] = None
+                response_headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in start.get("headers", [])}
+                reason = self._skip_reason(encoding, start["status"], response_headers, body, more_body)
+                if reason is not None:
+                    if reason in stats.skipped:
+                        stats.skipped[reason] += 1
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                state["compressor"] = StreamCompressor(encoding)
+                stats.compressed[encoding] = stats.compressed.get(encoding, 0) + 1
+                new_headers = [(k, v) for k, v in start.get("headers", []) if k.lower() not in (b"content-length", b"vary")]
+                vary = response_headers.get("vary")
+                new_headers.append((b"vary", f"{vary}, Accept-Encoding".encode() if vary else b"Accept-Encoding"))
+                new_headers.append((b"content-encoding", encoding.encode()))
+                compressed = state["compressor"].compress(body, final=not more_body)
+                if not more_body:
+                    new_headers.append((b"content-length", str(len(compressed)).encode()))
+                stats.bytes_in += len(body)
+                stats.bytes_out += len(compressed)
+                await send({**start, "headers": new_headers})
+                await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+                return
+            if state["passthrough"]:
+                await send(message)
+                return
+            compressed = state["compressor"].compress(body, final=not more_body)
+            stats.bytes_in += len(body)
+            stats.bytes_out += len(compressed)
+            await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _skip_reason(self, encoding, status, response_headers, body, more_body) -> Optional[str]:
+        if status in (204, 206, 304) or "content-encoding" in response_headers:
+            return "already_encoded"
+        if not is_compressible(response_headers.get("content-type", "")):
+            return "incompressible"
+        if encoding is None:
+            return "not_accepted"
+        # Streaming bodies are compressed whatever the size of their first chunk.
+        if not more_body and len(body) < self.minimum_size:
+            return "small"
+        return None
@@ -0,0 +1,223 @@
+import os
+
+# --- Session history compaction ---
+# Number of most recent turns (a user message plus everything the agents did
+# in response) that are kept verbatim in the session history.
+HISTORY_WINDOW_TURNS = int(os.getenv("HISTORY_WINDOW_TURNS", 6))
+# Maximum length of the rolling summary that replaces evicted turns.
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", 2000))
+# Tool results larger than this (serialized) are replaced by a short reference.
+HISTORY_TOOL_RESULT_MAX_CHARS = int(os.getenv("HISTORY_TOOL_RESULT_MAX_CHARS", 1500))
+# Replace inline images/audio of already answered turns with short references.
+HISTORY_COMPACT_MEDIA = os.getenv("HISTORY_COMPACT_MEDIA", "true").lower() == "true"
+
+# --- Models ---
+# JSON file with the model for every role and tier, per-route overrides and
+# the thresholds that switch requests to the fast tier (see model_registry.py).
+MODEL_REGISTRY_PATH = os.getenv(
+    "MODEL_REGISTRY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models.json")
+)
+
+# --- Textbook corpora ---
+# JSON file with the RAG corpora (one sub-agent each), their retrieval
+# settings and the class/subject/chapter metadata of their files (see corpus_registry.py).
+CORPUS_REGISTRY_PATH = os.getenv(
+    "CORPUS_REGISTRY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpora.json")
+)
+# Search only the files matching the class, subject and chapter a question names.
+RAG_METADATA_FILTERS = os.getenv("RAG_METADATA_FILTERS", "true").lower() == "true"
+# After a failed listing of a corpus' files, retrieve from the whole corpus this long before trying again.
+CORPUS_FILE_LIST_RETRY_SECONDS = float(os.getenv("CORPUS_FILE_LIST_RETRY_SECONDS", 300))
+
+# --- Request deadlines ---
+# Time budget per route in seconds (0 disables it). Clients can ask for less
+# with the X-Latency-Budget-Ms header, never for more.
+DEFAULT_TIMEOUT_SECONDS = float(os.getenv("DEFAULT_TIMEOUT_SECONDS", 60))
+ROUTE_TIMEOUTS_SECONDS = {
+    "/chat": float(os.getenv("CHAT_TIMEOUT_SECONDS", 60)),
+    "/ws/chat": float(os.getenv("CHAT_TIMEOUT_SECONDS", 60)),
+    "/synthesize_speech": float(os.getenv("TTS_TIMEOUT_SECONDS", 20)),
+    "/ws/voice": float(os.getenv("VOICE_TIMEOUT_SECONDS", 30)),
+}
+
+# --- Admission control for model-backed endpoints ---
+# Token buckets: sustained requests per second and burst size, globally and per user_id.
+ADMISSION_GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", 5))
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", 20))
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", 0.5))
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", 3))
+# Requests waiting for a global token; beyond this new requests get a 429.
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 50))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 10))
+# Retry-After sent when the upstream model quota itself is exhausted.
+UPSTREAM_RETRY_AFTER_SECONDS = int(os.getenv("UPSTREAM_RETRY_AFTER_SECONDS", 10))
+
+# --- Retries and hedging for tool and model calls ---
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 3))
+# Extra calls allowed per primary call, e.g. 0.1 = at most ~10% more load.
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", 0.1))
+HEDGE_SEARCH = os.getenv("HEDGE_SEARCH", "true").lower() == "true"
+HEDGE_RAG = os.getenv("HEDGE_RAG", "true").lower() == "true"
+HEDGE_MODEL = os.getenv("HEDGE_MODEL", "false").lower() == "true"
+
+# --- Image generation ---
+IMAGE_MAX_CONCURRENCY = int(os.getenv("IMAGE_MAX_CONCURRENCY", 4))
+IMAGE_MAX_VARIANTS = int(os.getenv("IMAGE_MAX_VARIANTS", 4))
+# Upper bound on variants x aspect ratios for a single request.
+IMAGE_MAX_IMAGES = int(os.getenv("IMAGE_MAX_IMAGES", 8))
+IMAGE_MAX_JOBS = int(os.getenv("IMAGE_MAX_JOBS", 200))
+IMAGE_DEFAULT_ASPECT_RATIO = os.getenv("IMAGE_DEFAULT_ASPECT_RATIO", "9:16")
+IMAGE_ASPECT_RATIOS = ("1:1", "3:4", "4:3", "9:16", "16:9")
+
+# --- Artifact serving ---
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Artifact URLs are content-addressed, so responses never change; artifacts
+# evicted from the cache are read back from their upload (UPLOAD_BACKEND).
+ARTIFACT_MAX_AGE_SECONDS = int(os.getenv("ARTIFACT_MAX_AGE_SECONDS", 31536000))
+ARTIFACT_MAX_WIDTH = int(os.getenv("ARTIFACT_MAX_WIDTH", 2048))
+ARTIFACT_IMAGE_QUALITY = int(os.getenv("ARTIFACT_IMAGE_QUALITY", 80))
+# Artifacts whose uploaded copy is remembered, most recent first.
+ARTIFACT_MAX_SOURCES = int(os.getenv("ARTIFACT_MAX_SOURCES", 100000))
+
+# --- Background uploads ---
+# "local" writes objects under UPLOAD_LOCAL_ROOT; "gcs" uploads to GCS_BUCKET_NAME.
+UPLOAD_BACKEND = os.getenv("UPLOAD_BACKEND", "local")
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
+UPLOAD_LOCAL_ROOT = os.getenv("UPLOAD_LOCAL_ROOT", "object_store")
+UPLOAD_QUEUE_DIR = os.getenv("UPLOAD_QUEUE_DIR", "upload_queue")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 2))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", 5))
+
+# --- Shared genai client pool ---
+GENAI_POOL_MAX_CONNECTIONS = int(os.getenv("GENAI_POOL_MAX_CONNECTIONS", 100))
+GENAI_POOL_MAX_KEEPALIVE = int(os.getenv("GENAI_POOL_MAX_KEEPALIVE", 20))
+GENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("GENAI_KEEPALIVE_EXPIRY_SECONDS", 60))
+# Needs the 'h2' package (pip install httpx[http2]); falls back to HTTP/1.1 without it.
+GENAI_HTTP2 = os.getenv("GENAI_HTTP2", "true").lower() == "true"
+GENAI_CONNECT_RETRIES = int(os.getenv("GENAI_CONNECT_RETRIES", 1))
+
+# --- Voice conversation over WebSocket ---
+# MP3, OGG_OPUS or LINEAR16 for the speech chunks streamed back.
+VOICE_AUDIO_ENCODING = os.getenv("VOICE_AUDIO_ENCODING", "MP3")
+# The first spoken chunk is cut at a clause boundary once it has this many
+# characters, so speech starts before the first full sentence is written.
+VOICE_FIRST_CHUNK_MIN_CHARS = int(os.getenv("VOICE_FIRST_CHUNK_MIN_CHARS", 40))
+VOICE_CHUNK_MAX_CHARS = int(os.getenv("VOICE_CHUNK_MAX_CHARS", 300))
+# Speech chunks synthesized ahead of the one being sent.
+VOICE_TTS_CONCURRENCY = int(os.getenv("VOICE_TTS_CONCURRENCY", 3))
+VOICE_MAX_UTTERANCE_BYTES = int(os.getenv("VOICE_MAX_UTTERANCE_BYTES", 10 * 1024 * 1024))
+
+# --- WebSocket chat channel ---
+# Frames buffered per connection before agent runs feeding it are paused.
+WS_CHAT_SEND_QUEUE_SIZE = int(os.getenv("WS_CHAT_SEND_QUEUE_SIZE", 64))
+# Concurrent requests one connection may have in flight (across its sessions).
+WS_CHAT_MAX_IN_FLIGHT = int(os.getenv("WS_CHAT_MAX_IN_FLIGHT", 8))
+
+# --- Response serialization and compression ---
+# Encodings offered in order of preference; br and zstd need the brotli and
+# zstandard packages and are skipped when those are not installed.
+COMPRESSION_ENCODINGS = [e.strip() for e in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if e.strip()]
+# Bodies smaller than this are sent uncompressed.
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3))
+
+# --- Context caching of static prompts ---
+# "genai" caches the agents' instructions and tools on the model side,
+# "local" is an in-memory stand-in for tests, "off" disables caching.
+CONTEXT_CACHE_BACKEND = os.getenv("CONTEXT_CACHE_BACKEND", "genai")
+# Agent roles (see model_registry.AGENT_ROLES) whose prefix is cached.
+CONTEXT_CACHE_ROLES = [r.strip() for r in os.getenv("CONTEXT_CACHE_ROLES", "root,imagen_dispatch").split(",") if r.strip()]
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", 3600))
+# Caches are extended once they have less than this left.
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = int(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN_SECONDS", 300))
+# After a failed create (e.g. prefix below the model's minimum cache size).
+CONTEXT_CACHE_RETRY_SECONDS = int(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", 600))
+
+# --- Token and cost accounting ---
+# Users and sessions with their own usage totals (least recently active are dropped).
+USAGE_MAX_TRACKED_KEYS = int(os.getenv("USAGE_MAX_TRACKED_KEYS", 1000))
+# Per-request records kept until the request finishes.
+USAGE_MAX_OPEN_REQUESTS = int(os.getenv("USAGE_MAX_OPEN_REQUESTS", 1000))
+
+# --- Record/replay cassettes ---
+# "record" saves every model call, RAG retrieval, corpus file listing and
+# Imagen response to CASSETTE_DIR; "replay" serves them from there without any
+# network access.
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes/default")
+# 0 replays instantly, 1 at the recorded latency, 0.5 twice as fast.
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", 0))
+# Fail on requests without an exact recording instead of using the next one in order.
+CASSETTE_STRICT = os.getenv("CASSETTE_STRICT", "false").lower() == "true"
+
+# --- Speculative retrieval prefetch ---
+# Starts the textbook retrievals a local keyword scorer predicts while
+# RootAgent is still routing; off by default (it costs retrievals that the
+# routing may not use).
+RAG_PREFETCH = os.getenv("RAG_PREFETCH", "false").lower() == "true"
+# Minimum scorer score to prefetch a corpus, and at most this many corpora.
+RAG_PREFETCH_MIN_SCORE = float(os.getenv("RAG_PREFETCH_MIN_SCORE", 2.0))
+RAG_PREFETCH_MAX_CORPORA = int(os.getenv("RAG_PREFETCH_MAX_CORPORA", 2))
+RAG_PREFETCH_TTL_SECONDS = float(os.getenv("RAG_PREFETCH_TTL_SECONDS", 30))
+# Word overlap needed between the user's question and the sub-agent's query
+# for a prefetched result to be used.
+RAG_PREFETCH_MIN_SIMILARITY = float(os.getenv("RAG_PREFETCH_MIN_SIMILARITY", 0.3))
+
+# --- Precomputed chapter store ---
+# MCQ banks, summaries and titles per chapter, built by precompute_chapters.py.
+# Matching requests are answered from it before any model call.
+CHAPTER_STORE = os.getenv("CHAPTER_STORE", "true").lower() == "true"
+CHAPTER_STORE_PATH = os.getenv(
+    "CHAPTER_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chapter_store.json.gz")
+)
+# MCQs served when the request gives no number, and the most served at once.
+CHAPTER_STORE_DEFAULT_MCQS = int(os.getenv("CHAPTER_STORE_DEFAULT_MCQS", 5))
+CHAPTER_STORE_MAX_MCQS = int(os.getenv("CHAPTER_STORE_MAX_MCQS", 10))
+
+# --- Reranking and compression of retrieved passages ---
+# Reranks, de-duplicates and trims RAG passages on CPU before the RAG
+# sub-agent's model sees them. With Gemini 2 models this retrieves on the
+# client instead of using the built-in retrieval tool.
+# "auto" compresses only once benchmarks/rag_compression.py has measured it:
+# its --output report at RAG_COMPRESSION_REPORT, run with --answer-model, must
+# show label recall of the answers dropping by at most
+# RAG_COMPRESSION_MAX_QUALITY_DROP (a report with only label retention of the
+# passages counts as unmeasured). "true"/"false" force it.
+RAG_COMPRESSION = os.getenv("RAG_COMPRESSION", "auto").lower()
+RAG_COMPRESSION_REPORT = os.getenv(
+    "RAG_COMPRESSION_REPORT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag_compression_report.json")
+)
+RAG_COMPRESSION_MAX_QUALITY_DROP = float(os.getenv("RAG_COMPRESSION_MAX_QUALITY_DROP", 0.02))
+# Estimated tokens of passage text handed to the model per retrieval.
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", 800))
+RAG_RERANK_MAX_PASSAGES = int(os.getenv("RAG_RERANK_MAX_PASSAGES", 5))
+# Share of the BM25 score in the relevance; the rest is embedding similarity.
+RAG_RERANK_LEXICAL_WEIGHT = float(os.getenv("RAG_RERANK_LEXICAL_WEIGHT", 0.4))
+# Passages scoring below this fraction of the best passage are dropped.
+RAG_RERANK_MIN_RELEVANCE = float(os.getenv("RAG_RERANK_MIN_RELEVANCE", 0.2))
+# Word 5-gram overlap (Jaccard) above which a passage is a near-duplicate.
+RAG_DUPLICATE_THRESHOLD = float(os.getenv("RAG_DUPLICATE_THRESHOLD", 0.6))
+# "onnx-minilm" (CPU sentence embeddings via chromadb) or "none" for character trigrams.
+RAG_RERANK_EMBEDDER = os.getenv("RAG_RERANK_EMBEDDER", "onnx-minilm")
+
+# --- Request coalescing ---
+# Identical concurrent first-turn /chat requests (same normalized question,
+# media and options) share one agent run.
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+
+# --- Startup warm-up ---
+# /ready reports ready only after these steps ran (see warmup.py); /health
+# stays a liveness check. With WARMUP=false /ready is ready at once.
+WARMUP = os.getenv("WARMUP", "true").lower() == "true"
+WARMUP_STEPS = os.getenv("WARMUP_STEPS", "agent,credentials,genai,tts,rag,caches,synthetic")
+# Steps retried until they succeed; the others are tried once and only reported.
+WARMUP_REQUIRED_STEPS = os.getenv("WARMUP_REQUIRED_STEPS", "agent,genai")
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", 5))
+WARMUP_STEP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_STEP_TIMEOUT_SECONDS", 60))
+# Concurrent requests per genai client, to open that many pooled connections.
+WARMUP_GENAI_CONNECTIONS = int(os.getenv("WARMUP_GENAI_CONNECTIONS", 2))
+# The synthetic request run through the agent tree.
+WARMUP_SYNTHETIC_QUERY = os.getenv("WARMUP_SYNTHETIC_QUERY", "What is photosynthesis? Answer in one sentence.")
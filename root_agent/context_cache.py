@@ -0,0 +1,341 @@
+import asyncio
+import copy
+import hashlib
+import itertools
+import time
+from typing import Optional
+
+import config
+from model_registry import AGENT_ROLES
+
+
+class CacheHandle:
+    def __init__(self, key: str, name: str, model: str, expire_time: float, prefix_tokens: int):
+        self.key = key
+        self.name = name
+        self.model = model
+        self.expire_time = expire_time
+        self.prefix_tokens = prefix_tokens
+
+    def seconds_left(self) -> float:
+        return self.expire_time - time.time()
+
+
+class GenaiCacheBackend:
+    """Creates model-side cached contents through the shared genai client."""
+
+    async def create(self, model: str, system_instruction, tools, tool_config, ttl_seconds: int, display_name: str):
+        from google.genai import types
+        from genai_clients import get_client
+
+        cached = await get_client().aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                tools=tools,
+                tool_config=tool_config,
+                ttl=f"{ttl_seconds}s",
+                display_name=display_name,
+            ),
+        )
+        return cached.name, cached.expire_time.timestamp()
+
+    async def refresh(self, name: str, ttl_seconds: int) -> float:
+        from google.genai import types
+        from genai_clients import get_client
+
+        cached = await get_client().aio.caches.update(
+            name=name, config=types.UpdateCachedContentConfig(ttl=f"{ttl_seconds}s")
+        )
+        return cached.expire_time.timestamp()
+
+    async def delete(self, name: str):
+        from genai_clients import get_client
+
+        await get_client().aio.caches.delete(name=name)
+
+
+class LocalCacheBackend:
+    """In-memory stand-in for tests and benchmarks; no model is ever told about these caches."""
+
+    def __init__(self):
+        self.caches = {}
+        self._ids = itertools.count(1)
+
+    async def create(self, model, system_instruction, tools, tool_config, ttl_seconds, display_name):
+        name = f"cachedContents/local-{next(self._ids)}"
+        self.caches[name] = {"model": model, "system_instruction": system_instruction, "tools": tools, "display_name": display_name}
+        return name, time.time() + ttl_seconds
+
+    async def refresh(self, name, ttl_seconds):
+        if name not in self.caches:
+            raise KeyError(name)
+        return time.time() + ttl_seconds
+
+    async def delete(self, name):
+        self.caches.pop(name, None)
+
+
+def default_backend():
+    if config.CASSETTE_MODE == "replay":
+        # Replayed runs never reach the model, so there is nothing to cache.
+        return None
+    if config.CONTEXT_CACHE_BACKEND == "genai":
+        return GenaiCacheBackend()
+    if config.CONTEXT_CACHE_BACKEND == "local":
+        return LocalCacheBackend()
+    return None
+
+
+def prefix_key(model: str, llm_request) -> Optional[str]:
+    """Content hash of the static request prefix: model, system instruction and tools."""
+    request_config = llm_request.config
+    if request_config is None or not request_config.system_instruction:
+        return None
+    digest = hashlib.sha256(model.encode())
+    for part in (request_config.system_instruction, request_config.tools, request_config.tool_config):
+        if part is None:
+            digest.update(b"\0")
+        elif isinstance(part, str):
+            digest.update(part.encode())
+        elif isinstance(part, list):
+            for item in part:
+                digest.update(item.model_dump_json(exclude_none=True).encode())
+        else:
+            digest.update(part.model_dump_json(exclude_none=True).encode())
+    return digest.hexdigest()
+
+
+def request_prefix(llm_request):
+    """Copy of the static prefix of a request: its system instruction, tools and tool config."""
+    from google.genai import types
+
+    request_config = llm_request.config
+    return types.GenerateContentConfig(
+        system_instruction=copy.deepcopy(request_config.system_instruction),
+        tools=copy.deepcopy(request_config.tools),
+        tool_config=copy.deepcopy(request_config.tool_config),
+    )
+
+
+def prefix_key_for(llm_request) -> Optional[str]:
+    """The prefix key of a request, also when its prefix was already swapped for a cache."""
+    cached_content = llm_request.config.cached_content if llm_request.config else None
+    if cached_content:
+        for handle in list(context_cache.handles.values()):
+            if handle.name == cached_content:
+                return handle.key
+    return prefix_key(llm_request.model, llm_request)
+
+
+class ContextCache:
+    """Keeps model-side caches of the agents' static instructions and attaches them to requests.
+
+    A cache is keyed by the hash of its model, system instruction and tools,
+    so a changed prompt or another model tier simply gets its own cache. The
+    first request for an unknown prefix goes out uncached while the cache is
+    created in the background; caches are refreshed before they expire.
+    Prefixes the backend refuses (e.g. below the model's minimum cacheable
+    size) are retried only after `retry_seconds`.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        roles=config.CONTEXT_CACHE_ROLES,
+        ttl_seconds: int = config.CONTEXT_CACHE_TTL_SECONDS,
+        refresh_margin_seconds: int = config.CONTEXT_CACHE_REFRESH_MARGIN_SECONDS,
+        retry_seconds: int = config.CONTEXT_CACHE_RETRY_SECONDS,
+    ):
+        self.backend = backend
+        self.roles = set(roles)
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.retry_seconds = retry_seconds
+        self.handles = {}
+        self._failed_until = {}
+        self._creating = {}
+        self._refresher = None
+        self.stats = {
+            "requests_cached": 0,
+            "requests_uncached": 0,
+            "creates": 0,
+            "create_failures": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "estimated_prefix_tokens_attached": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def ensure(self, key: str, model: str, prefix) -> Optional[CacheHandle]:
+        """Returns the cache for this prefix, creating it if needed (concurrent callers share one create).
+
+        `prefix` is the config holding the prefix's system instruction and
+        tools, as returned by `request_prefix`.
+        """
+        handle = self.handles.get(key)
+        if handle is not None:
+            return handle
+        if self._failed_until.get(key, 0) > time.time():
+            return None
+        task = self._creating.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._create(key, model, prefix))
+            self._creating[key] = task
+            task.add_done_callback(lambda _: self._creating.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _create(self, key: str, model: str, prefix) -> Optional[CacheHandle]:
+        try:
+            name, expire_time = await self.backend.create(
+                model,
+                prefix.system_instruction,
+                prefix.tools,
+                prefix.tool_config,
+                self.ttl_seconds,
+                f"prefix-{key[:12]}",
+            )
+        except Exception as e:
+            self.stats["create_failures"] += 1
+            self._failed_until[key] = time.time() + self.retry_seconds
+            print(f"Context cache not created for {model} (requests stay uncached): {e}")
+            return None
+        self.stats["creates"] += 1
+        prefix_text = str(prefix.system_instruction) + "".join(
+            tool.model_dump_json(exclude_none=True) for tool in prefix.tools or []
+        )
+        # Same rough 4 characters per token as session_compaction.estimate_tokens.
+        handle = CacheHandle(key, name, model, expire_time, len(prefix_text) // 4)
+        self.handles[key] = handle
+        self._ensure_refresher()
+        return handle
+
+    def _ensure_refresher(self):
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while self.handles:
+            await asyncio.sleep(max(1.0, self.refresh_margin_seconds / 2))
+            for handle in list(self.handles.values()):
+                if handle.seconds_left() > self.refresh_margin_seconds:
+                    continue
+                try:
+                    handle.expire_time = await self.backend.refresh(handle.name, self.ttl_seconds)
+                    self.stats["refreshes"] += 1
+                except Exception as e:
+                    # Drop it; the next request for this prefix creates a new one.
+                    self.stats["refresh_failures"] += 1
+                    self.handles.pop(handle.key, None)
+                    print(f"Context cache {handle.name} could not be refreshed: {e}")
+
+    def attach(self, callback_context, llm_request):
+        """before_model_callback: swaps the static prefix of the request for its cache handle."""
+        if not self.enabled or AGENT_ROLES.get(callback_context.agent_name) not in self.roles:
+            return None
+        key = prefix_key(llm_request.model, llm_request)
+        if key is None:
+            return None
+        handle = self.handles.get(key)
+        # Leave a little slack so the cache cannot expire while the request is in flight.
+        if handle is None or handle.seconds_left() < 30:
+            self.stats["requests_uncached"] += 1
+            if key not in self._creating and self._failed_until.get(key, 0) <= time.time():
+                # Only the prefix goes to the background create, not the request
+                # (its contents, or the tools and agents in its tools_dict).
+                asyncio.ensure_future(self.ensure(key, llm_request.model, request_prefix(llm_request)))
+            return None
+        # The cached content carries the instruction and tools; a request that
+        # references it must not send them again.
+        llm_request.config.cached_content = handle.name
+        llm_request.config.system_instruction = None
+        llm_request.config.tools = None
+        llm_request.config.tool_config = None
+        self.stats["requests_cached"] += 1
+        self.stats["estimated_prefix_tokens_attached"] += handle.prefix_tokens
+        return None
+
+    def record_usage(self, callback_context, llm_response):
+        """after_model_callback: tallies prompt tokens served from cache versus sent in full."""
+        usage = llm_response.usage_metadata
+        if usage is None or llm_response.partial:
+            return None
+        self.stats["prompt_tokens"] += usage.prompt_token_count or 0
+        self.stats["cached_tokens"] += usage.cached_content_token_count or 0
+        return None
+
+    async def warm(self, agents, tier: Optional[str] = None):
+        """Creates the caches for the given agents' prefixes, e.g. at startup."""
+        if not self.enabled:
+            return
+        from model_registry import registry, DEFAULT_TIER
+
+        for agent in agents:
+            role = AGENT_ROLES.get(agent.name)
+            if role not in self.roles:
+                continue
+            model = registry.model_for(role, tier or DEFAULT_TIER)
+            try:
+                llm_request = await build_prefix_request(agent, model)
+            except Exception as e:
+                print(f"Could not build the request prefix of {agent.name} for warm-up: {e}")
+                continue
+            key = prefix_key(model, llm_request)
+            if key is not None:
+                await self.ensure(key, model, request_prefix(llm_request))
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["backend"] = config.CONTEXT_CACHE_BACKEND
+        stats["active_caches"] = len(self.handles)
+        stats["uncached_tokens"] = stats["prompt_tokens"] - stats["cached_tokens"]
+        return stats
+
+
+async def build_prefix_request(agent, model: str):
+    """The agent's system instruction and tools on an empty session, as its request processors add them.
+
+    Runs ADK's own instruction and identity request processors, then adds
+    each tool's declaration; the conversation is left empty.
+    """
+    from google.adk.agents.invocation_context import InvocationContext
+    from google.adk.agents.readonly_context import ReadonlyContext
+    from google.adk.agents.run_config import RunConfig
+    from google.adk.flows.llm_flows import identity, instructions
+    from google.adk.models import LlmRequest
+    from google.adk.sessions import InMemorySessionService
+    from google.adk.tools.tool_context import ToolContext
+    from google.genai import types
+
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(app_name="context_cache_warmup", user_id="warmup")
+    invocation_context = InvocationContext(
+        invocation_id="context-cache-warmup",
+        agent=agent,
+        session=session,
+        session_service=session_service,
+        run_config=RunConfig(),
+    )
+    request_config = agent.generate_content_config.model_copy(deep=True) if agent.generate_content_config else None
+    llm_request = LlmRequest(model=model, config=request_config or types.GenerateContentConfig())
+    for processor in (instructions.request_processor, identity.request_processor):
+        async for _ in processor.run_async(invocation_context, llm_request):
+            pass
+    for tool in await agent.canonical_tools(ReadonlyContext(invocation_context)):
+        await tool.process_llm_request(tool_context=ToolContext(invocation_context), llm_request=llm_request)
+    return llm_request
+
+context_cache = ContextCache(default_backend())
+
+
+def apply_context_cache(callback_context, llm_request):
+    return context_cache.attach(callback_context, llm_request)
+
+
+def record_cache_usage(callback_context, llm_response):
+    return context_cache.record_usage(callback_context, llm_response)
@@ -0,0 +1,221 @@
+import json
+import re
+import threading
+import time
+from typing import Optional
+
+import config
+from model_registry import AGENT_ROLES
+
+TOKEN = re.compile(r"[a-z0-9]+")
+CLASS_PATTERNS = [
+    re.compile(r"\b(?:class|grade|std|standard)\s*-?\s*(\d{1,2})\b"),
+    re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)\s*(?:class|grade|std|standard)\b"),
+    re.compile(r"\b(?:class|grade|std|standard)\s+(xii|xi|x|ix|viii|vii|vi)\b"),
+]
+ROMAN = {"vi": 6, "vii": 7, "viii": 8, "ix": 9, "x": 10, "xi": 11, "xii": 12}
+CHAPTER_PATTERN = re.compile(r"\b(?:chapter|ch|lesson)\s*-?\s*(\d{1,3})\b")
+
+# Metadata a retrieval can be narrowed by, dropped from the end when no file matches all of it.
+FILTER_KEYS = ("class", "subject", "chapter")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(TOKEN.findall((text or "").lower()))
+
+
+class Corpus:
+    """A textbook corpus of the registry, searched by a RAG sub-agent of its own.
+
+    Files carry class, subject and chapter metadata, either listed in the
+    registry (`files`, with their RAG file ids) or parsed from the display
+    names of the corpus' files with `file_pattern` the first time they are needed.
+    """
+
+    def __init__(self, spec: dict, defaults: dict, registry: "CorpusRegistry"):
+        self.name = spec["name"]
+        self.agent_name = spec.get("agent", f"rag_agent_{self.name}")
+        self.board = spec.get("board", self.name.upper())
+        self.resource = spec["corpus"]
+        self.description = spec.get("description", f"{self.board} Textbooks")
+        self.examples = spec.get("examples", [])
+        # Words that point a question at this corpus, for the retrieval prefetch.
+        self.keywords = spec.get("keywords", {self.name.lower(): 3.0})
+        self.similarity_top_k = spec.get("similarity_top_k", defaults.get("similarity_top_k"))
+        self.vector_distance_threshold = spec.get("vector_distance_threshold", defaults.get("vector_distance_threshold"))
+        self.file_pattern = re.compile(spec["file_pattern"]) if spec.get("file_pattern") else None
+        self._registry = registry
+        # Class and subject set on the corpus apply to all of its files.
+        self.metadata = registry.normalize_metadata({k: spec[k] for k in FILTER_KEYS if k in spec})
+        self.chapters = [
+            {**self.metadata, **registry.normalize_metadata(chapter), "title": chapter["title"], "title_key": normalize_text(chapter["title"])}
+            for chapter in spec.get("chapters", [])
+        ]
+        self._files = [self._file(f["id"], f) for f in spec["files"]] if "files" in spec else None
+        self._list_failed_at = None
+        self._lock = threading.Lock()
+
+    def _file(self, file_id: str, metadata: dict) -> dict:
+        return {**self.metadata, **self._registry.normalize_metadata(metadata), "id": str(file_id)}
+
+    def file_from_name(self, file_id: str, display_name: str) -> Optional[dict]:
+        """Metadata of a file parsed from its name with `file_pattern`, or None when it does not match."""
+        match = self.file_pattern.search(display_name or "") if self.file_pattern else None
+        return self._file(file_id, match.groupdict()) if match else None
+
+    def files(self) -> list:
+        """Metadata of the corpus' files; may list them from Vertex AI RAG (blocking)."""
+        if self._files is not None:
+            return self._files
+        if self.file_pattern is None:
+            return []
+        with self._lock:
+            if self._files is None and (
+                self._list_failed_at is None
+                or time.monotonic() - self._list_failed_at > config.CORPUS_FILE_LIST_RETRY_SECONDS
+            ):
+                self._files = self._list_files()
+        return self._files or []
+
+    def _list_files(self) -> Optional[list]:
+        from cassette import cassette
+
+        try:
+            if cassette is not None:
+                # Recorded too, so a replayed retrieval is scoped without Vertex AI.
+                listed = cassette.call_sync("rag_files", {"corpus": self.resource}, self._list_rag_files)
+            else:
+                listed = self._list_rag_files()
+        except Exception as e:
+            self._list_failed_at = time.monotonic()
+            print(f"Could not list the files of corpus '{self.name}', searching it whole: {e}")
+            return None
+        files = []
+        for name, display_name in listed:
+            file = self.file_from_name(name.rsplit("/", 1)[-1], display_name)
+            if file:
+                files.append(file)
+        print(f"Corpus '{self.name}': {len(files)} of {len(listed)} files have class/subject/chapter metadata")
+        return files
+
+    def _list_rag_files(self) -> list:
+        """(resource name, display name) of each of the corpus' files in Vertex AI RAG."""
+        from vertexai.preview import rag
+
+        return [[rag_file.name, rag_file.display_name] for rag_file in rag.list_files(corpus_name=self.resource)]
+
+    def scope(self, filters: dict, files: Optional[list] = None) -> tuple:
+        """(ids of the files matching `filters`, filters applied); ids are None for the whole corpus.
+
+        When no file matches every filter, the most specific ones (chapter,
+        then subject) are dropped until some do. `files` defaults to the
+        corpus' own files.
+        """
+        files = self.files() if files is None else files
+        keys = [k for k in FILTER_KEYS if k in filters]
+        while keys and files:
+            matched = [f["id"] for f in files if all(f.get(k) == filters[k] for k in keys)]
+            if matched:
+                return matched, keys
+            keys.pop()
+        return None, []
+
+
+class CorpusRegistry:
+    """The textbook corpora the agents search, loaded from a JSON file.
+
+    Each corpus becomes a RAG sub-agent of RootAgent. Retrievals are narrowed
+    to the files matching the class, subject and chapter the question names,
+    so a new textbook is added by editing the file, not the code.
+    """
+
+    def __init__(self, spec: dict):
+        # Canonical subject -> words that name it in a question or a file name.
+        self.subjects = {subject: set(aliases) | {subject} for subject, aliases in spec.get("subjects", {}).items()}
+        defaults = spec.get("defaults", {})
+        self.corpora = [Corpus(corpus, defaults, self) for corpus in spec.get("corpora", [])]
+        self.by_agent = {corpus.agent_name: corpus for corpus in self.corpora}
+        self.stats = {"scoped": 0, "relaxed": 0, "unscoped": 0, "files_searched": 0, "files_total": 0}
+        for corpus in self.corpora:
+            AGENT_ROLES.setdefault(corpus.agent_name, "rag")
+
+    @classmethod
+    def from_file(cls, path: str) -> "CorpusRegistry":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def canonical_subject(self, word: str) -> str:
+        word = normalize_text(word).replace(" ", "_")
+        for subject, aliases in self.subjects.items():
+            if word in aliases:
+                return subject
+        return word
+
+    def normalize_metadata(self, metadata: dict) -> dict:
+        normalized = {}
+        for key in FILTER_KEYS:
+            value = metadata.get(key)
+            if value is None or value == "":
+                continue
+            if key == "subject":
+                normalized[key] = self.canonical_subject(str(value))
+            else:
+                normalized[key] = str(int(value))
+        return normalized
+
+    def extract_filters(self, query: str, corpus: Optional[Corpus] = None) -> dict:
+        """Class, subject and chapter named in a question ("class 10", "english", "chapter 3", a chapter title)."""
+        text = normalize_text(query)
+        filters = {}
+        for pattern in CLASS_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                value = match.group(1)
+                filters["class"] = str(ROMAN[value] if value in ROMAN else int(value))
+                break
+        words = set(text.split())
+        for subject, aliases in self.subjects.items():
+            if words & aliases:
+                filters["subject"] = subject
+                break
+        match = CHAPTER_PATTERN.search(text)
+        if match:
+            filters["chapter"] = str(int(match.group(1)))
+        elif corpus is not None:
+            padded = f" {text} "
+            for chapter in corpus.chapters:
+                if f" {chapter['title_key']} " in padded:
+                    for key in FILTER_KEYS:
+                        if key in chapter:
+                            filters.setdefault(key, chapter[key])
+                    break
+        return filters
+
+    def scope_for(self, corpus: Corpus, query: str) -> Optional[list]:
+        """RAG file ids a retrieval for `query` should search, or None for the whole corpus."""
+        filters = self.extract_filters(query, corpus)
+        file_ids, applied = corpus.scope(filters) if filters else (None, [])
+        if file_ids is None:
+            self.stats["unscoped"] += 1
+            return None
+        self.stats["scoped"] += 1
+        if len(applied) < len(filters):
+            self.stats["relaxed"] += 1
+        self.stats["files_searched"] += len(file_ids)
+        self.stats["files_total"] += len(corpus.files())
+        return file_ids
+
+    def hints(self) -> dict:
+        return {corpus.agent_name: corpus.keywords for corpus in self.corpora}
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": config.RAG_METADATA_FILTERS,
+            "corpora": {corpus.name: len(corpus._files or []) for corpus in self.corpora},
+            **self.stats,
+            # Share of a corpus' files a narrowed retrieval searched, on average.
+            "searched_fraction": round(self.stats["files_searched"] / self.stats["files_total"], 4) if self.stats["files_total"] else None,
+        }
+
+
+corpora = CorpusRegistry.from_file(config.CORPUS_REGISTRY_PATH)
@@ -0,0 +1,66 @@
+import asyncio
+import inspect
+import time
+from typing import AsyncIterator, Callable, Optional
+
+import config
+
+# Session state key holding the wall-clock time (time.time()) the current
+# request must finish by. Tools can read it to size their own timeouts.
+DEADLINE_KEY = "request_deadline"
+
+
+def resolve_timeout(route: str, latency_budget_ms: Optional[float] = None) -> Optional[float]:
+    """Seconds the request may take: the client's budget if given, else the route default.
+
+    Client budgets are capped at the route default so a header cannot hold a
+    server slot longer than the operator allows.
+    """
+    route_timeout = config.ROUTE_TIMEOUTS_SECONDS.get(route, config.DEFAULT_TIMEOUT_SECONDS)
+    if latency_budget_ms is None:
+        return route_timeout or None
+    budget = max(latency_budget_ms / 1000.0, 0.001)
+    return min(budget, route_timeout) if route_timeout else budget
+
+
+def deadline_from_timeout(timeout: Optional[float]) -> Optional[float]:
+    return time.time() + timeout if timeout else None
+
+
+def remaining_seconds(state) -> Optional[float]:
+    """Time left before the request deadline stored in session state, if any."""
+    deadline = state.get(DEADLINE_KEY)
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0.0)
+
+
+async def consume_with_deadline(
+    events: AsyncIterator,
+    timeout: Optional[float],
+    handle_event: Callable[[object], bool],
+) -> bool:
+    """Feeds events to `handle_event` until it returns True, the stream ends or the deadline passes.
+
+    `handle_event` may be a coroutine function; it is awaited before the next
+    event is read, so a slow consumer slows the run down instead of buffering.
+
+    On timeout the pending await inside the runner is cancelled, which
+    propagates through nested agents and in-flight tool/model calls, and the
+    generator is closed. Returns True if the deadline was hit.
+    """
+    try:
+        async with asyncio.timeout(timeout):
+            async for event in events:
+                done = handle_event(event)
+                if inspect.isawaitable(done):
+                    done = await done
+                if done:
+                    break
+    except TimeoutError:
+        return True
+    finally:
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    return False
@@ -1,36 +1,50 @@
 import io
 import base64
-from typing import Tuple, Optional
+import json
 from fastapi.middleware.cors import CORSMiddleware
-import os
 import asyncio
 import uuid
 import warnings
-from typing import Optional
+from typing import Awaitable, Callable, Optional, TYPE_CHECKING
 from PIL import Image
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
+import config
+from admission import AdmissionController, AdmissionRejected, classify_priority, PRIORITY_TEXT
+from resilience import caller as resilient_caller
+from serialization import FastJSONResponse, dumps, dumps_str
+from compression import CompressionMiddleware, compression_stats
+from artifact_store import artifact_store, parse_range, etag_matches, IMAGE_FORMATS
+from voice_stream import run_voice_turn, pcm_to_wav, voice_stats
+from upload_queue import upload_queue, UPLOAD_TARGET_KEY
+from usage_accounting import usage_ledger, new_request_id, REQUEST_ID_KEY, DIMENSIONS as USAGE_DIMENSIONS
+from coalescing import single_flight, coalescing_key, is_first_turn, record_shared_turn
+from image_jobs import jobs as image_jobs, IMAGE_JOB_KEY, IMAGE_VARIANTS_KEY, IMAGE_ASPECT_RATIOS_KEY
+from warmup import warmup
+
 # Suppress all warnings
 warnings.filterwarnings("ignore")
 
-# Import necessary ADK components
+# The ADK, genai and TTS libraries take seconds to import, so they are loaded
+# on first use (see SessionManager.ensure_loaded) and the server can answer
+# /health right after the process starts. /ready waits for the startup
+# warm-up (warmup.py), which loads them before the first request.
 # Make sure 'agent.py' containing 'root_agent' is in the same directory
-from google.adk.sessions import InMemorySessionService
-from google.adk.runners import Runner
-from google.genai import types # For creating message Content/Parts
-
-# Assuming 'tts.py' contains the synthesize_text function
-from tts import synthesize_text
-from agent import root_agent
+if TYPE_CHECKING:
+    from google.adk.runners import Runner
 
 app = FastAPI(
     title="ADK Agent FastAPI",
     description="A FastAPI application for interacting with an ADK Agent, supporting text, audio, and image inputs.",
     version="1.0.0",
+    default_response_class=FastJSONResponse,
 )
 
+# Compresses JSON and event-stream responses for clients that accept it.
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins
@@ -45,9 +59,40 @@ app.add_middleware(
 class SessionManager:
     def __init__(self):
         self.sessions = {} # user_id -> {session_id: runner}
-        self.session_service = InMemorySessionService()
+        self.session_service = None
+        self.artifact_service = None
+        self.root_agent = None
+        self._load_lock = asyncio.Lock()
+
+    def _load(self):
+        from google.adk.artifacts import InMemoryArtifactService
+        from session_compaction import CompactingSessionService
+        from agent import get_root_agent
+
+        # Keeps the history replayed to the model bounded on long sessions.
+        self.session_service = CompactingSessionService()
+        self.artifact_service = InMemoryArtifactService()
+        self.root_agent = get_root_agent()
+        # Finished background uploads record their URI in the session state.
+        upload_queue.session_service = self.session_service
+
+    async def ensure_loaded(self):
+        """Imports the ADK stack and builds the agent tree once, off the event loop."""
+        if self.root_agent is not None:
+            return
+        async with self._load_lock:
+            if self.root_agent is None:
+                await asyncio.to_thread(self._load)
+                # Create the instruction caches in the background; requests go
+                # out uncached until they exist.
+                from context_cache import context_cache
+                from imagen_agent import get_imagen_agent_tool
+                asyncio.create_task(context_cache.warm([self.root_agent, get_imagen_agent_tool()]))
+
+    async def get_or_create_runner(self, user_id: str, session_id: str) -> "Runner":
+        await self.ensure_loaded()
+        from google.adk.runners import Runner
 
-    async def get_or_create_runner(self, user_id: str, session_id: str) -> Runner:
         if user_id not in self.sessions:
             self.sessions[user_id] = {}
 
@@ -61,9 +106,10 @@ class SessionManager:
             )
             
             runner = Runner(
-                agent=root_agent,
+                agent=self.root_agent,
                 app_name=app_name,
-                session_service=self.session_service
+                session_service=self.session_service,
+                artifact_service=self.artifact_service
             )
             self.sessions[user_id][session_id] = runner
             print(f"Created new session and runner for user: {user_id}, session: {session_id}")
@@ -71,56 +117,94 @@ class SessionManager:
 
 session_manager = SessionManager()
 
-async def get_agent_response_async(runner: Runner, user_id: str, session_id: str, query: str, audio_bytes: Optional[bytes] = None, image_bytes: Optional[bytes] = None):
+# Number of /chat requests currently being processed; together with the
+# admission queue it is the load signal for picking the fast model tier.
+in_flight_requests = 0
+
+# Rate limits and the wait queue in front of the agent.
+admission = AdmissionController()
+
+async def build_user_content(runner: "Runner", user_id: str, session_id: str, query: str, audio_bytes: Optional[bytes] = None, image_bytes: Optional[bytes] = None):
     """
-    Sends a query to the ADK agent and retrieves its final response.
+    Builds the user message for a turn.
     """
+    from google.genai import types # For creating message Content/Parts
+    from media_store import save_upload
+
+    # Uploads are stored once as artifacts; the session only keeps a reference
+    # that the root agent resolves back to bytes for the turn that needs them.
     if audio_bytes:
-        audio_content = types.Blob(
-            mime_type='audio/wav',
-            data=audio_bytes,
-        )
-        content = types.Content(role='user', parts=[types.Part(inline_data=audio_content)])
-    elif image_bytes:
-        print(type(image_bytes))
-        image_content = types.Blob(
-            mime_type='image/png',
-            data=image_bytes
-        )
-        content = types.Content(role='user', parts=[types.Part(text=query), types.Part(inline_data=image_content)])
-    else:
-        content = types.Content(role='user', parts=[types.Part(text=query)])
+        audio_ref = await save_upload(runner.artifact_service, runner.app_name, user_id, session_id, audio_bytes, 'audio/wav')
+        return types.Content(role='user', parts=[audio_ref])
+    if image_bytes:
+        image_ref = await save_upload(runner.artifact_service, runner.app_name, user_id, session_id, image_bytes, 'image/png')
+        return types.Content(role='user', parts=[types.Part(text=query), image_ref])
+    return types.Content(role='user', parts=[types.Part(text=query)])
+
+def request_state_delta(route: str, runner: "Runner", user_id: str, session_id: str, latency_budget_ms: Optional[float] = None):
+    """
+    Returns the per-request session state (model tier, route, deadline, upload target, request id) and the request timeout.
+    The request's model usage is collected until usage_ledger.finish(state_delta[REQUEST_ID_KEY]).
+    """
+    from model_registry import registry, MODEL_TIER_KEY, MODEL_ROUTE_KEY
+    from deadlines import resolve_timeout, deadline_from_timeout, DEADLINE_KEY
+
+    tier = registry.select_tier(latency_budget_ms, in_flight_requests + admission.queue_depth)
+    timeout = resolve_timeout(route, latency_budget_ms)
+    state_delta = {
+        MODEL_TIER_KEY: tier,
+        MODEL_ROUTE_KEY: route,
+        DEADLINE_KEY: deadline_from_timeout(timeout),
+        UPLOAD_TARGET_KEY: {"app_name": runner.app_name, "user_id": user_id, "session_id": session_id},
+        REQUEST_ID_KEY: new_request_id(),
+    }
+    usage_ledger.begin(state_delta[REQUEST_ID_KEY], route, user_id, session_id)
+    return state_delta, timeout
+
+async def get_agent_response_async(runner: "Runner", user_id: str, session_id: str, query: str, audio_bytes: Optional[bytes] = None, image_bytes: Optional[bytes] = None, state_delta: Optional[dict] = None, timeout: Optional[float] = None, on_event: Optional[Callable[[object], Awaitable]] = None, run_config=None):
+    """
+    Sends a query to the ADK agent and retrieves its final response.
+    If `timeout` seconds pass first, the run is cancelled and the partial answer is returned.
+    `on_event` is awaited with every ADK event, e.g. to push progress to a client.
+    The result's "usage" has the tokens and cost of every model call the request made.
+    """
+    from deadlines import consume_with_deadline
 
     final_response_text = "Agent did not produce a final response."
+    partial_texts = []
 
-    async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
+    async def handle_event(event):
+        nonlocal final_response_text
         print(f"ADK Event: {event}")
+        if on_event is not None:
+            await on_event(event)
         if event.is_final_response():
             if event.content and event.content.parts:
                 final_response_text = event.content.parts[0].text
             elif event.actions and event.actions.escalate:
                 final_response_text = f"Agent escalated: {event.error_message or 'No specific message.'}"
-            break
+            return True
+        if event.content and event.content.parts and not event.partial:
+            partial_texts.extend(p.text for p in event.content.parts if p.text)
+        return False
 
-    # Check for generated image and clean up
-    target_image = "generated_image_0.png"
-    if os.path.exists(target_image):
-        try:
-            with open(target_image, "rb") as image_file:
-                image_bytes = image_file.read()
-            encoded_bytes = base64.b64encode(image_bytes).decode()
-            print(f"Found generated image: {target_image}. Deleting...")
-            os.remove(target_image)
-        except Exception as e:
-            print(f"Error removing generated image {target_image}: {e}")
+    run_kwargs = {"run_config": run_config} if run_config is not None else {}
+    try:
+        content = await build_user_content(runner, user_id, session_id, query, audio_bytes, image_bytes)
+        events = runner.run_async(user_id=user_id, session_id=session_id, new_message=content, state_delta=state_delta, **run_kwargs)
+        timed_out = await consume_with_deadline(events, timeout, handle_event)
+    finally:
+        usage = usage_ledger.finish((state_delta or {}).get(REQUEST_ID_KEY))
+    status = "ok"
+    if timed_out:
+        status = "timeout"
+        final_response_text = "\n".join(partial_texts) or "The request timed out before the agent produced an answer."
+        print(f"Request for session {session_id} timed out after {timeout}s; agent run cancelled.")
 
-    print("type of generated image_bytes: ", type(image_bytes))
-    print("type of encoded image_bytes: ", type(encoded_bytes))
-    print("type of text is: ", type(final_response_text))
-    # return final_response_text, encoded_bytes
     return {
         "text": final_response_text,
-        "bytes_base64": encoded_bytes
+        "status": status,
+        "usage": usage,
     }
 
 # --- FastAPI Endpoints ---
@@ -133,6 +217,49 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     session_id: str
+    status: str = "ok" # "timeout" when the request deadline cut the agent run short
+    image_urls: list[str] = [] # generated images, served by /artifacts/{id}
+    image_job_id: Optional[str] = None # set when image variants are still arriving, see /image_jobs/{id}
+    usage: Optional[dict] = None # tokens, cost and model time per agent, when requested with include_usage
+    coalesced: bool = False # answered by an identical request's agent run
+
+def to_png(image_data: bytes) -> bytes:
+    # Attempt to open as PIL Image to ensure it's a valid image and convert to PNG
+    img = Image.open(io.BytesIO(image_data))
+    png_buffer = io.BytesIO()
+    img.save(png_buffer, format='PNG')
+    return png_buffer.getvalue()
+
+def add_image_options(state_delta: dict, image_variants: Optional[int] = None, aspect_ratios=None) -> str:
+    """
+    Adds the image job and variant preferences to the request state and returns the job id.
+    """
+    # Image variants for this turn are collected under this job id so the ones
+    # still rendering after the answer can be polled or streamed.
+    image_job_id = str(uuid.uuid4())
+    state_delta[IMAGE_JOB_KEY] = image_job_id
+    if image_variants:
+        state_delta[IMAGE_VARIANTS_KEY] = image_variants
+    if isinstance(aspect_ratios, str):
+        aspect_ratios = aspect_ratios.split(",")
+    if aspect_ratios:
+        state_delta[IMAGE_ASPECT_RATIOS_KEY] = [r.strip() for r in aspect_ratios if r.strip()]
+    return image_job_id
+
+def build_chat_response(result: dict, session_id: str, image_job_id: str, include_usage: bool = False) -> ChatResponse:
+    job = image_jobs.get(image_job_id)
+    # Generated images are served from /artifacts: the job lists the URLs of
+    # this request's ready variants.
+    image_urls = job.urls if job else []
+    return ChatResponse(
+        response=result["text"],
+        session_id=session_id,
+        status=result["status"],
+        image_urls=image_urls,
+        image_job_id=image_job_id if job and job.variants else None,
+        usage=result.get("usage") if include_usage else None,
+        coalesced=result.get("coalesced", False),
+    )
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_agent(
@@ -140,7 +267,11 @@ async def chat_with_agent(
     user_id: str = Form("default_user"),
     session_id: Optional[str] = Form(None),
     audio_file: Optional[UploadFile] = File(None),
-    image_file: Optional[UploadFile] = File(None)
+    image_file: Optional[UploadFile] = File(None),
+    image_variants: Optional[int] = Form(None),
+    aspect_ratios: Optional[str] = Form(None), # comma-separated, e.g. "1:1,16:9"
+    include_usage: bool = Form(False),
+    latency_budget_ms: Optional[float] = Header(None, alias="X-Latency-Budget-Ms")
 ):
     """
     Endpoint for chatting with the ADK Agent using text, audio, or image input.
@@ -148,6 +279,11 @@ async def chat_with_agent(
     if not query and not audio_file and not image_file:
         raise HTTPException(status_code=400, detail="Either 'query', 'audio_file', or 'image_file' must be provided.")
 
+    try:
+        await admission.acquire(user_id, classify_priority(query))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": e.retry_after_header})
+
     if session_id is None:
         session_id = str(uuid.uuid4())
     
@@ -162,45 +298,407 @@ async def chat_with_agent(
         # FastAPI handles file uploads in memory or as temporary files.
         # We need to read the bytes and potentially convert to PNG if not already.
         try:
-            image_data = await image_file.read()
-            # Attempt to open as PIL Image to ensure it's a valid image and convert to PNG
-            img = Image.open(io.BytesIO(image_data))
-            png_buffer = io.BytesIO()
-            img.save(png_buffer, format='PNG')
-            image_bytes = png_buffer.getvalue()
+            image_bytes = to_png(await image_file.read())
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid image file: {e}")
 
-    response_text, image_bytes = await get_agent_response_async(
-        runner,
-        user_id,
-        session_id,
-        query or "", # Pass empty string if query is None for audio/image inputs
-        audio_bytes,
-        image_bytes
-    )
-    return ChatResponse(response=response_text, session_id=session_id)
+    from google.genai import errors as genai_errors
+
+    global in_flight_requests
+    state_delta, timeout = request_state_delta("/chat", runner, user_id, session_id, latency_budget_ms)
+    image_job_id = add_image_options(state_delta, image_variants, aspect_ratios)
+
+    async def run_agent():
+        result = await get_agent_response_async(
+            runner,
+            user_id,
+            session_id,
+            query or "", # Pass empty string if query is None for audio/image inputs
+            audio_bytes,
+            image_bytes,
+            state_delta=state_delta,
+            timeout=timeout,
+        )
+        return {**result, "image_job_id": image_job_id}
+
+    in_flight_requests += 1
+    try:
+        # Identical first-turn questions arriving together (a whole class asking
+        # the projected question) share one agent run; with history the answer
+        # depends on the session, so those always run on their own.
+        if config.COALESCE_REQUESTS and await is_first_turn(runner, user_id, session_id):
+            flight_key = coalescing_key("/chat", query, audio_bytes, image_bytes, state_delta)
+            result, shared = await single_flight.run(flight_key, run_agent, session=(user_id, session_id))
+            if shared:
+                usage_ledger.finish(state_delta[REQUEST_ID_KEY])
+                # Uploads live in each user's namespace, so the follower's message
+                # references its own copy; a follower of the same user finds it already stored.
+                content = await build_user_content(runner, user_id, session_id, query or "", audio_bytes, image_bytes)
+                await record_shared_turn(runner, user_id, session_id, content, result["text"], state_delta)
+                result = {**result, "usage": None, "coalesced": True}
+        else:
+            result = await run_agent()
+        image_job_id = result["image_job_id"]
+    except genai_errors.APIError as e:
+        if e.code == 429:
+            # Upstream quota exhausted: tell the client when to come back instead of a generic error.
+            raise HTTPException(
+                status_code=429,
+                detail="Model quota exhausted, please retry later.",
+                headers={"Retry-After": str(config.UPSTREAM_RETRY_AFTER_SECONDS)},
+            )
+        raise
+    finally:
+        in_flight_requests -= 1
+    # Rendered directly: skips FastAPI's generic encoding pass over the response model.
+    return FastJSONResponse(build_chat_response(result, session_id, image_job_id, include_usage).model_dump())
+
+def _get_image_job(job_id: str):
+    job = image_jobs.get(job_id)
+    if job is None or not job.variants:
+        raise HTTPException(status_code=404, detail="Image job not found.")
+    return job
+
+@app.get("/image_jobs/{job_id}")
+async def get_image_job(job_id: str):
+    """
+    Returns the variants of an image job rendered so far.
+    """
+    return _get_image_job(job_id).as_dict()
+
+@app.get("/image_jobs/{job_id}/stream")
+async def stream_image_job(job_id: str):
+    """
+    Streams each variant of an image job as newline-delimited JSON as soon as it is rendered.
+    """
+    job = _get_image_job(job_id)
+
+    async def events():
+        async for variant in job.stream():
+            yield dumps({"event": "variant", **variant}) + b"\n"
+        yield dumps({"event": "done", "job_id": job.id}) + b"\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/artifacts/{artifact_id}")
+async def get_artifact(
+    artifact_id: str,
+    format: Optional[str] = None,
+    w: Optional[int] = None,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """
+    Serves an artifact's raw bytes, optionally converted (`format=webp|avif|jpeg|png`) or resized (`w=<pixels>`).
+    """
+    if format is None and w is None:
+        entry = await artifact_store.load(artifact_id)
+        etag = f'"{artifact_id}"'
+    else:
+        if format is not None and format not in IMAGE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported format. Use one of: {', '.join(IMAGE_FORMATS)}.")
+        if w is not None and not 0 < w <= config.ARTIFACT_MAX_WIDTH:
+            raise HTTPException(status_code=400, detail=f"Width must be between 1 and {config.ARTIFACT_MAX_WIDTH}.")
+        original = await artifact_store.load(artifact_id)
+        if original is not None and not original[1].startswith("image/"):
+            raise HTTPException(status_code=400, detail="Only image artifacts can be converted.")
+        entry = original and await artifact_store.get_variant(artifact_id, format or "png", w)
+        etag = f'"{artifact_id}-{format or "png"}-{w or 0}"'
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Artifact not found.")
+
+    data, mime_type = entry
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={config.ARTIFACT_MAX_AGE_SECONDS}, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    try:
+        byte_range = parse_range(range_header, len(data))
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{len(data)}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        return Response(content=data, media_type=mime_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(content=data[start:end + 1], status_code=206, media_type=mime_type, headers=headers)
 
 @app.post("/synthesize_speech")
 async def synthesize_speech(text: str = Form(...)):
     """
     Synthesizes speech from the given text and returns an audio file.
     """
-    audio_file_path = "synthesized_speech.mp3"
+    from tts import synthesize_bytes
+    from deadlines import resolve_timeout
+
     try:
-        synthesize_text(text, audio_file_path)
-        if os.path.exists(audio_file_path):
-            def iterfile():
-                with open(audio_file_path, "rb") as f:
-                    yield from f
-                os.remove(audio_file_path) # Clean up the file after streaming
-
-            return StreamingResponse(iterfile(), media_type="audio/mpeg")
+        # Run the blocking TTS call off the event loop so the deadline can fire.
+        # The audio is returned from memory: a shared temp file was overwritten
+        # and deleted by concurrent requests.
+        audio = await asyncio.wait_for(
+            asyncio.to_thread(synthesize_bytes, text),
+            timeout=resolve_timeout("/synthesize_speech"),
+        )
+        if audio:
+            return Response(content=audio, media_type="audio/mpeg")
         else:
             raise HTTPException(status_code=500, detail="Failed to synthesize speech.")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Speech synthesis timed out.")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Speech synthesis error: {e}")
 
+@app.websocket("/ws/voice")
+async def voice_conversation(
+    websocket: WebSocket,
+    user_id: str = "default_user",
+    session_id: Optional[str] = None,
+    mime_type: str = "audio/wav",
+    sample_rate: int = 16000,
+):
+    """
+    Voice conversation: stream microphone audio in, get the transcript and speech back chunk by chunk.
+
+    Client -> server: binary frames with audio (`mime_type` audio/wav, or audio/pcm as
+    16-bit mono at `sample_rate`), then {"type": "end_of_utterance"}. {"type": "text", "text": ...}
+    sends a typed turn and {"type": "cancel"} stops the current answer. Audio sent while an
+    answer is playing interrupts it.
+    Server -> client: {"type": "session"}, {"type": "transcript"} deltas, {"type": "audio"} each
+    followed by one binary frame, {"type": "turn_complete"} and {"type": "error"}.
+    """
+    await websocket.accept()
+
+    async def send_event(message: dict):
+        await websocket.send_text(dumps_str(message))
+
+    if session_id is None:
+        session_id = str(uuid.uuid4())
+    runner = await session_manager.get_or_create_runner(user_id, session_id)
+    await send_event({"type": "session", "session_id": session_id})
+
+    utterance = bytearray()
+    turn = None
+
+    async def cancel_turn():
+        nonlocal turn
+        if turn is not None and not turn.done():
+            turn.cancel()
+            try:
+                await turn
+            except asyncio.CancelledError:
+                pass
+        turn = None
+
+    async def run_turn(query: str, audio_bytes: Optional[bytes]):
+        global in_flight_requests
+        try:
+            await admission.acquire(user_id, PRIORITY_TEXT)
+        except AdmissionRejected as e:
+            await send_event({"type": "error", "detail": e.reason, "retry_after": float(e.retry_after_header)})
+            return
+        # Begins the turn's usage record, which the finally below ends.
+        state_delta, timeout = request_state_delta("/ws/voice", runner, user_id, session_id)
+        in_flight_requests += 1
+        try:
+            content = await build_user_content(runner, user_id, session_id, query, audio_bytes)
+            result = await run_voice_turn(
+                runner, user_id, session_id, content,
+                send_event=send_event,
+                send_audio=websocket.send_bytes,
+                state_delta=state_delta,
+                timeout=timeout,
+            )
+            await send_event({"type": "turn_complete", **result})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Voice turn failed for session {session_id}: {e}")
+            await send_event({"type": "error", "detail": f"Voice turn failed: {e}"})
+        finally:
+            in_flight_requests -= 1
+            usage_ledger.finish(state_delta[REQUEST_ID_KEY])
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                if turn is not None and not turn.done():
+                    # The user started talking over the answer.
+                    await cancel_turn()
+                utterance.extend(message["bytes"])
+                if len(utterance) > config.VOICE_MAX_UTTERANCE_BYTES:
+                    utterance.clear()
+                    await send_event({"type": "error", "detail": "Utterance too long."})
+                continue
+            try:
+                control = json.loads(message.get("text") or "{}")
+            except json.JSONDecodeError:
+                await send_event({"type": "error", "detail": "Expected a JSON control message."})
+                continue
+            kind = control.get("type")
+            if kind == "cancel":
+                await cancel_turn()
+            elif kind == "end_of_utterance" and utterance:
+                audio_bytes = bytes(utterance)
+                utterance.clear()
+                if mime_type.startswith("audio/pcm"):
+                    audio_bytes = pcm_to_wav(audio_bytes, sample_rate)
+                await cancel_turn()
+                turn = asyncio.create_task(run_turn("", audio_bytes))
+            elif kind == "text" and control.get("text"):
+                await cancel_turn()
+                turn = asyncio.create_task(run_turn(control["text"], None))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await cancel_turn()
+
+@app.websocket("/ws/chat")
+async def chat_channel(websocket: WebSocket, user_id: str = "default_user", format: str = "json"):
+    """
+    Persistent chat channel; one connection can run requests for several sessions at once.
+
+    Frames are JSON text messages, or MessagePack binary messages with `format=msgpack`.
+    Client -> server: {"type": "chat", "id", "query", "session_id"?, "image"? (bytes, or base64
+    in JSON), "stream"?, "latency_budget_ms"?, "image_variants"?, "aspect_ratios"?, "include_usage"?},
+    {"type": "cancel", "id"} and {"type": "ping"}.
+    Server -> client, tagged with the request id: "accepted", "progress" (tool calls and
+    results), "delta" (streamed text when "stream" is set), "response" (the /chat payload),
+    "cancelled" and "error".
+    Requests for the same session run one after another; the send queue is bounded so a
+    slow reader pauses its agent runs.
+    """
+    from chat_channel import FrameCodec, Outbox, progress_events, channel_stats
+
+    try:
+        codec = FrameCodec(format)
+    except ValueError as e:
+        await websocket.close(code=1003, reason=str(e))
+        return
+    await websocket.accept()
+    outbox = Outbox(websocket.send, codec)
+    outbox.start()
+    channel_stats.connections += 1
+    channel_stats.open_connections += 1
+    requests = {} # request id -> task
+    session_locks = {}
+
+    async def handle_chat(frame: dict):
+        global in_flight_requests
+        from google.genai import errors as genai_errors
+        from google.adk.agents.run_config import RunConfig, StreamingMode
+
+        request_id = frame["id"]
+        query = frame.get("query") or ""
+        session_id = frame.get("session_id") or str(uuid.uuid4())
+        await outbox.put({"type": "accepted", "id": request_id, "session_id": session_id})
+        try:
+            await admission.acquire(user_id, classify_priority(query))
+        except AdmissionRejected as e:
+            channel_stats.rejected += 1
+            await outbox.put({"type": "error", "id": request_id, "detail": e.reason, "retry_after": float(e.retry_after_header)})
+            return
+
+        image_bytes = None
+        if frame.get("image"):
+            image = frame["image"]
+            try:
+                image_bytes = to_png(image if isinstance(image, bytes) else base64.b64decode(image))
+            except Exception as e:
+                await outbox.put({"type": "error", "id": request_id, "detail": f"Invalid image: {e}"})
+                return
+
+        async def on_event(event):
+            for progress in progress_events(event):
+                await outbox.put({**progress, "id": request_id, "session_id": session_id})
+
+        runner = await session_manager.get_or_create_runner(user_id, session_id)
+        lock = session_locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            state_delta, timeout = request_state_delta("/ws/chat", runner, user_id, session_id, frame.get("latency_budget_ms"))
+            image_job_id = add_image_options(state_delta, frame.get("image_variants"), frame.get("aspect_ratios"))
+            in_flight_requests += 1
+            try:
+                result = await get_agent_response_async(
+                    runner, user_id, session_id, query, image_bytes=image_bytes,
+                    state_delta=state_delta, timeout=timeout, on_event=on_event,
+                    run_config=RunConfig(streaming_mode=StreamingMode.SSE) if frame.get("stream") else None,
+                )
+            except genai_errors.APIError as e:
+                if e.code != 429:
+                    raise
+                await outbox.put({
+                    "type": "error", "id": request_id,
+                    "detail": "Model quota exhausted, please retry later.",
+                    "retry_after": config.UPSTREAM_RETRY_AFTER_SECONDS,
+                })
+                return
+            finally:
+                in_flight_requests -= 1
+        response = build_chat_response(result, session_id, image_job_id, bool(frame.get("include_usage")))
+        await outbox.put({"type": "response", "id": request_id, **response.model_dump()})
+
+    async def run_request(frame: dict):
+        try:
+            await handle_chat(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Chat channel request {frame['id']} failed: {e}")
+            await outbox.put({"type": "error", "id": frame["id"], "detail": f"Failed to get agent response: {e}"})
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                frame = codec.decode(message)
+            except ValueError as e:
+                await outbox.put({"type": "error", "detail": str(e)})
+                continue
+            kind = frame.get("type")
+            request_id = frame.get("id")
+            if request_id is not None and (isinstance(request_id, bool) or not isinstance(request_id, (str, int))):
+                # Ids key the in-flight requests, so they must be hashable.
+                await outbox.put({"type": "error", "detail": "A frame's 'id' must be a string or an integer."})
+            elif kind == "ping":
+                await outbox.put({"type": "pong"})
+            elif kind == "cancel":
+                task = requests.get(request_id)
+                if task is not None:
+                    task.cancel()
+                    await outbox.put({"type": "cancelled", "id": request_id})
+            elif kind == "chat":
+                if request_id is None or request_id in requests:
+                    await outbox.put({"type": "error", "id": request_id, "detail": "Each chat frame needs a unique 'id'."})
+                elif not frame.get("query") and not frame.get("image"):
+                    await outbox.put({"type": "error", "id": request_id, "detail": "Either 'query' or 'image' must be provided."})
+                elif len(requests) >= config.WS_CHAT_MAX_IN_FLIGHT:
+                    channel_stats.rejected += 1
+                    await outbox.put({"type": "error", "id": request_id, "detail": "Too many requests in flight on this connection."})
+                else:
+                    channel_stats.requests += 1
+                    requests[request_id] = asyncio.create_task(run_request(frame))
+                    requests[request_id].add_done_callback(lambda _, rid=request_id: requests.pop(rid, None))
+            else:
+                await outbox.put({"type": "error", "id": request_id, "detail": f"Unknown frame type '{kind}'."})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in list(requests.values()):
+            task.cancel()
+        await outbox.close()
+        channel_stats.open_connections -= 1
+        channel_stats.send_stalls += outbox.stalls
+
 @app.get("/health")
 async def health_check():
     """
@@ -208,6 +706,63 @@ async def health_check():
     """
     return {"status": "ok"}
 
+@app.on_event("startup")
+async def start_warmup():
+    warmup.start(session_manager)
+    # Uploads a previous process queued but did not finish resume right away,
+    # not only once a new one is queued.
+    upload_queue.start()
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness check: 503 until the startup warm-up is done, then 200; both report the time spent per step.
+    """
+    return JSONResponse(status_code=200 if warmup.ready else 503, content=warmup.get_stats())
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Reports counters that show how much work the serving layer saves.
+    """
+    import genai_clients
+    from chat_channel import channel_stats
+    from context_cache import context_cache
+    from corpus_registry import corpora
+    from chapter_store import chapter_store
+    from rag_compression import rag_compressor
+    from rag_prefetch import prefetcher
+
+    return {
+        "in_flight_requests": in_flight_requests,
+        "admission": admission.get_stats(),
+        "resilience": resilient_caller.get_stats(),
+        "artifacts": artifact_store.get_stats(),
+        "uploads": upload_queue.get_stats(),
+        "voice": voice_stats.get_stats(),
+        "chat_channel": channel_stats.as_dict(),
+        "compression": compression_stats.as_dict(),
+        "context_cache": context_cache.get_stats(),
+        "usage": usage_ledger.get_stats(),
+        "rag_prefetch": prefetcher.get_stats(),
+        "rag_filters": corpora.get_stats(),
+        "rag_compression": rag_compressor.get_stats(),
+        "chapter_store": chapter_store.get_stats(),
+        "coalescing": single_flight.get_stats(),
+        "warmup": warmup.get_stats(),
+        "genai_connections": genai_clients.get_stats(),
+        "history_compaction": session_manager.session_service.get_stats() if session_manager.session_service else {},
+    }
+
+@app.get("/usage")
+async def usage_report(by: str = "path", limit: int = 10):
+    """
+    Model usage totals grouped by route, agent, path (route > agent), model, user or session, costliest first.
+    """
+    if by not in USAGE_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown grouping. Use one of: {', '.join(USAGE_DIMENSIONS)}.")
+    return {"by": by, "rows": usage_ledger.top(by, limit)}
+
 if __name__ == "__main__":
     import uvicorn
     # You might want to adjust the host and port for deployment
@@ -0,0 +1,132 @@
+import os
+import threading
+import weakref
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+
+import config
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ConnectionStats:
+    """Counts requests and whether each one went out on a new or a reused connection.
+
+    httpx reports the network stream a response was read from; a stream seen
+    before means the request reused a pooled connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = weakref.WeakSet()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.http2_responses = 0
+
+    def record(self, response: httpx.Response):
+        stream = response.extensions.get("network_stream")
+        with self._lock:
+            self.requests += 1
+            if response.extensions.get("http_version") == b"HTTP/2":
+                self.http2_responses += 1
+            if stream is None:
+                return
+            if stream in self._streams:
+                self.reused_connections += 1
+            else:
+                self._streams.add(stream)
+                self.new_connections += 1
+
+    def as_dict(self) -> dict:
+        tracked = self.new_connections + self.reused_connections
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "reuse_ratio": round(self.reused_connections / tracked, 4) if tracked else 0.0,
+            "http2_responses": self.http2_responses,
+        }
+
+
+connection_stats = ConnectionStats()
+
+
+class CountingAsyncTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request):
+        response = await super().handle_async_request(request)
+        connection_stats.record(response)
+        return response
+
+
+class CountingTransport(httpx.HTTPTransport):
+    def handle_request(self, request):
+        response = super().handle_request(request)
+        connection_stats.record(response)
+        return response
+
+
+@lru_cache(maxsize=None)
+def http2_enabled() -> bool:
+    if config.GENAI_HTTP2 and not http2_available():
+        print("GENAI_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1.")
+        return False
+    return config.GENAI_HTTP2
+
+
+def _transport_args() -> dict:
+    return {
+        "http2": http2_enabled(),
+        "limits": httpx.Limits(
+            max_connections=config.GENAI_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=config.GENAI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=config.GENAI_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        "retries": config.GENAI_CONNECT_RETRIES,
+    }
+
+
+def _use_vertexai(vertexai: Optional[bool]) -> bool:
+    if vertexai is not None:
+        return vertexai
+    return os.getenv("GOOGLE_GENAI_USE_VERTEXAI", "").lower() in ("true", "1")
+
+
+@lru_cache(maxsize=None)
+def _client(vertexai: bool, api_version: Optional[str]):
+    from google import genai
+    from google.genai import types
+
+    # Passing our own transports makes genai use httpx (not aiohttp) for both
+    # the sync and async clients, so every call goes through the tuned pool.
+    http_options = types.HttpOptions(
+        api_version=api_version,
+        client_args={"transport": CountingTransport(**_transport_args())},
+        async_client_args={"transport": CountingAsyncTransport(**_transport_args())},
+    )
+    return genai.Client(vertexai=vertexai, http_options=http_options)
+
+
+def get_client(vertexai: Optional[bool] = None, api_version: Optional[str] = None):
+    """Returns the process-wide genai client for the given backend and API version.
+
+    `vertexai=None` follows GOOGLE_GENAI_USE_VERTEXAI, like `genai.Client()`.
+    Clients are created on first use so importing the agent tree does not
+    resolve credentials or open connections.
+    """
+    return _client(_use_vertexai(vertexai), api_version)
+
+
+def get_stats() -> dict:
+    stats = connection_stats.as_dict()
+    stats["clients"] = _client.cache_info().currsize
+    stats["http2_enabled"] = http2_enabled()
+    return stats
@@ -0,0 +1,112 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import config
+from artifact_store import artifact_store, artifact_url
+
+# Session state keys the endpoint uses to hand the job id and the client's
+# variant preferences to the image generation tool.
+IMAGE_JOB_KEY = "image_job_id"
+IMAGE_VARIANTS_KEY = "image_variants"
+IMAGE_ASPECT_RATIOS_KEY = "image_aspect_ratios"
+
+# Bounds how many Imagen renders run at once across all requests.
+image_semaphore = asyncio.Semaphore(config.IMAGE_MAX_CONCURRENCY)
+
+
+class ImageJob:
+    """Tracks the variants of one image request as they finish, for polling or streaming."""
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.created = time.time()
+        self.variants = []
+        self.tasks = []
+        # Set and replaced on every change; notifying needs no await, so a
+        # cancelled render can still report itself on its way out.
+        self._changed = asyncio.Event()
+
+    def add_variant(self, aspect_ratio: str) -> dict:
+        variant = {"index": len(self.variants), "aspect_ratio": aspect_ratio, "status": "pending"}
+        self.variants.append(variant)
+        return variant
+
+    @property
+    def done(self) -> bool:
+        return bool(self.variants) and all(v["status"] != "pending" for v in self.variants)
+
+    async def finish_variant(self, variant: dict, image_bytes: Optional[bytes] = None, artifact_name: Optional[str] = None, error: Optional[str] = None):
+        if error is not None:
+            variant.update(status="error", error=error)
+        else:
+            artifact_id = artifact_store.put(image_bytes, "image/png")
+            variant.update(status="ready", artifact_name=artifact_name, artifact_id=artifact_id, url=artifact_url(artifact_id))
+        self._notify()
+
+    def cancel_variant(self, variant: dict):
+        """Marks a variant whose render was cancelled as finished, so streams of the job end."""
+        if variant["status"] == "pending":
+            variant.update(status="cancelled")
+            self._notify()
+
+    def cancel(self):
+        """Cancels the renders still running, e.g. when the request that started them expires."""
+        for task in self.tasks:
+            task.cancel()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def variant_dict(self, variant: dict) -> dict:
+        return dict(variant)
+
+    @property
+    def urls(self) -> list:
+        return [v["url"] for v in self.variants if v["status"] == "ready"]
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "done": self.done,
+            "variants": [self.variant_dict(v) for v in self.variants],
+        }
+
+    async def stream(self):
+        """Yields every variant once, as soon as it is finished, until the job is done."""
+        sent = set()
+        while True:
+            for variant in self.variants:
+                if variant["status"] != "pending" and variant["index"] not in sent:
+                    sent.add(variant["index"])
+                    yield self.variant_dict(variant)
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class ImageJobStore:
+    """In-memory store of recent image jobs; the oldest are dropped past `max_jobs`."""
+
+    def __init__(self, max_jobs: int = config.IMAGE_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+
+    def get_or_create(self, job_id: Optional[str] = None) -> ImageJob:
+        job_id = job_id or str(uuid.uuid4())
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = ImageJob(job_id)
+            self.jobs[job_id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Optional[ImageJob]:
+        return self.jobs.get(job_id)
+
+
+jobs = ImageJobStore()
@@ -1,13 +1,29 @@
+from functools import lru_cache
 from tools.imagen_prompt import IMAGEGEN_PROMPT
-from google.adk.agents import Agent
-from tools.image_generation_tool import generate_images
-
-imagen_agent_tool = Agent(
-    name="imagen_agent_tool",
-    model="gemini-2.5-flash",
-    description=("You are an expert in creating images with imagen 3"),
-    instruction=(IMAGEGEN_PROMPT),
-    tools=[generate_images],
-    # output_key="output_image",
-)
 
+
+@lru_cache(maxsize=None)
+def get_imagen_agent_tool():
+    from google.adk.agents import Agent
+    from tools.image_generation_tool import generate_images
+    from model_registry import registry, select_model
+    from resilient_adk import ResilientGemini
+    from context_cache import apply_context_cache, record_cache_usage
+    from usage_accounting import start_model_call, record_model_usage
+
+    return Agent(
+        name="imagen_agent_tool",
+        model=ResilientGemini(model=registry.model_for("imagen_dispatch")),
+        description=("You are an expert in creating images with imagen 3"),
+        instruction=(IMAGEGEN_PROMPT),
+        tools=[generate_images],
+        before_model_callback=[select_model, apply_context_cache, start_model_call],
+        after_model_callback=[record_cache_usage, record_model_usage],
+        # output_key="output_image",
+    )
+
+
+def __getattr__(name):
+    if name == "imagen_agent_tool":
+        return get_imagen_agent_tool()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
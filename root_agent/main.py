@@ -1,12 +1,19 @@
 # main.py
 import os
 import asyncio
-from fastapi import FastAPI, HTTPException
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from google.adk.agents import Agent
 from google.adk.models.lite_llm import LiteLlm # For multi-model support
 from google.adk.sessions import InMemorySessionService
+from session_compaction import CompactingSessionService
+from model_registry import registry, MODEL_TIER_KEY, MODEL_ROUTE_KEY
+from deadlines import consume_with_deadline, resolve_timeout, deadline_from_timeout, DEADLINE_KEY
+from admission import AdmissionController, AdmissionRejected, classify_priority
+from upload_queue import upload_queue, UPLOAD_TARGET_KEY
+from usage_accounting import usage_ledger, new_request_id, REQUEST_ID_KEY
 from google.adk.runners import Runner
 from google.genai import types # For creating message Content/Parts
 import warnings
@@ -42,6 +49,7 @@ except ImportError:
 session_service: InMemorySessionService = None
 runner: Runner = None
 APP_NAME = "adk_fastapi_agent" # A unique name for your application
+admission = AdmissionController()
 
 app = FastAPI(
     title="ADK Agent FastAPI",
@@ -64,6 +72,7 @@ class ChatRequest(BaseModel):
     query: str
     user_id: str = "default_user" # Provide a default or make it optional
     session_id: str = "default_session" # Provide a default or make it optional
+    include_usage: bool = False # adds the request's token counts and cost to the response
 
 # --- Agent Initialization on Startup ---
 @app.on_event("startup")
@@ -71,24 +80,34 @@ async def startup_event():
     """Initializes the ADK session service and runner when the FastAPI app starts."""
     global session_service, runner
     print("Initializing ADK Agent components...")
-    session_service = InMemorySessionService()
+    session_service = CompactingSessionService()
+    upload_queue.session_service = session_service
+    # Resume the uploads a previous process queued but did not finish.
+    upload_queue.start()
     runner = Runner(
         agent=root_agent,
         app_name=APP_NAME,
         session_service=session_service
     )
     print(f"ADK Agent Runner initialized for agent '{runner.agent.name}'.")
+    from context_cache import context_cache
+    from imagen_agent import get_imagen_agent_tool
+    await context_cache.warm([root_agent, get_imagen_agent_tool()])
 
 # --- Modified call_agent_async to return response ---
-async def call_agent_async_for_api(query: str, runner: Runner, user_id: str, session_id: str) -> str:
+async def call_agent_async_for_api(query: str, runner: Runner, user_id: str, session_id: str, state_delta: Optional[dict] = None, timeout: Optional[float] = None) -> tuple:
     """
-    Sends a query to the agent and returns the final response text.
+    Sends a query to the agent and returns (final response text, timed out).
     This version is adapted to return the response instead of printing it.
+    When the deadline passes first, the text is what the agent produced so far.
     """
     print(f"\n>>> User Query: {query} (User: {user_id}, Session: {session_id})")
 
     content = types.Content(role='user', parts=[types.Part(text=query)])
     final_response_text = "Agent did not produce a final response."
+    timed_out = False
+    # Text the agent produced before the final response, returned if the deadline cuts the run short.
+    partial_texts = []
 
     # Ensure a session exists for the given user_id and session_id
     # The runner's run_async will create one if it doesn't exist, but explicitly
@@ -99,24 +118,33 @@ async def call_agent_async_for_api(query: str, runner: Runner, user_id: str, ses
         session_id=session_id
     )
 
+    def handle_event(event):
+        nonlocal final_response_text
+        if event.is_final_response():
+            if event.content and event.content.parts:
+                final_response_text = event.content.parts[0].text
+            elif event.actions and event.actions.escalate:
+                final_response_text = f"Agent escalated: {event.error_message or 'No specific message.'}"
+            return True
+        if event.content and event.content.parts and not event.partial:
+            partial_texts.extend(p.text for p in event.content.parts if p.text)
+        return False
+
     try:
-        async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
-            if event.is_final_response():
-                if event.content and event.content.parts:
-                    final_response_text = event.content.parts[0].text
-                elif event.actions and event.actions.escalate:
-                    final_response_text = f"Agent escalated: {event.error_message or 'No specific message.'}"
-                break
+        events = runner.run_async(user_id=user_id, session_id=session_id, new_message=content, state_delta=state_delta)
+        timed_out = await consume_with_deadline(events, timeout, handle_event)
+        if timed_out:
+            final_response_text = "\n".join(partial_texts) or f"The request timed out after {timeout}s before the agent produced an answer."
     except Exception as e:
         print(f"Error during agent run: {e}")
         final_response_text = f"An internal error occurred while processing your request: {e}"
 
     print(f"<<< Agent Response: {final_response_text}")
-    return final_response_text
+    return final_response_text, timed_out
 
 # --- FastAPI Endpoint ---
 @app.post("/chat")
-async def chat_with_agent(request: ChatRequest):
+async def chat_with_agent(request: ChatRequest, latency_budget_ms: Optional[float] = Header(None, alias="X-Latency-Budget-Ms")):
     """
     API endpoint to send a message to the ADK agent and get a response.
     """
@@ -124,15 +152,37 @@ async def chat_with_agent(request: ChatRequest):
         raise HTTPException(status_code=503, detail="Agent runner not initialized. Please try again later.")
 
     try:
-        response_text = await call_agent_async_for_api(
+        await admission.acquire(request.user_id, classify_priority(request.query))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": e.retry_after_header})
+
+    timeout = resolve_timeout("/chat", latency_budget_ms)
+    request_id = new_request_id()
+    usage_ledger.begin(request_id, "/chat", request.user_id, request.session_id)
+    try:
+        response_text, timed_out = await call_agent_async_for_api(
             query=request.query,
             runner=runner,
             user_id=request.user_id,
-            session_id=request.session_id
+            session_id=request.session_id,
+            state_delta={
+                MODEL_TIER_KEY: registry.select_tier(latency_budget_ms, admission.queue_depth),
+                MODEL_ROUTE_KEY: "/chat",
+                DEADLINE_KEY: deadline_from_timeout(timeout),
+                UPLOAD_TARGET_KEY: {"app_name": APP_NAME, "user_id": request.user_id, "session_id": request.session_id},
+                REQUEST_ID_KEY: request_id,
+            },
+            timeout=timeout,
         )
-        return {"response": response_text}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get agent response: {e}")
+    finally:
+        usage = usage_ledger.finish(request_id)
+    # "timeout" when the request deadline cut the agent run short.
+    status = "timeout" if timed_out else "ok"
+    if request.include_usage:
+        return {"response": response_text, "status": status, "usage": usage}
+    return {"response": response_text, "status": status}
 
 # --- Root Endpoint (Optional, for health check) ---
 @app.get("/")
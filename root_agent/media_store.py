@@ -0,0 +1,105 @@
+import hashlib
+import re
+from typing import Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.artifacts import BaseArtifactService
+from google.adk.models import LlmRequest
+from google.genai import types
+
+# Uploads live in the user namespace so the same file sent in another session
+# of the same user is stored only once.
+UPLOAD_PREFIX = "user:upload_"
+MEDIA_REF_PATTERN = re.compile(r"^\[uploaded (?P<mime_type>[\w.+-]+/[\w.+-]+) artifact: (?P<filename>\S+)\]$")
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "audio/wav": "wav",
+    "audio/mpeg": "mp3",
+}
+
+
+def upload_filename(data: bytes, mime_type: str) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    return f"{UPLOAD_PREFIX}{digest}.{EXTENSIONS.get(mime_type, 'bin')}"
+
+
+def media_reference(filename: str, mime_type: str) -> types.Part:
+    """The text part that stands in for an uploaded file in the conversation history."""
+    return types.Part(text=f"[uploaded {mime_type} artifact: {filename}]")
+
+
+def parse_media_reference(part: types.Part) -> Optional[tuple[str, str]]:
+    if not part.text:
+        return None
+    match = MEDIA_REF_PATTERN.match(part.text)
+    if not match:
+        return None
+    return match.group("filename"), match.group("mime_type")
+
+
+async def save_upload(
+    artifact_service: BaseArtifactService,
+    app_name: str,
+    user_id: str,
+    session_id: str,
+    data: bytes,
+    mime_type: str,
+) -> types.Part:
+    """Stores an uploaded file once, keyed by its content hash, and returns its reference part."""
+    filename = upload_filename(data, mime_type)
+    versions = await artifact_service.list_versions(
+        app_name=app_name, user_id=user_id, session_id=session_id, filename=filename
+    )
+    if not versions:
+        await artifact_service.save_artifact(
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=filename,
+            artifact=types.Part(inline_data=types.Blob(mime_type=mime_type, data=data)),
+        )
+        print(f"Stored upload as artifact: {filename} ({len(data)} bytes)")
+    else:
+        print(f"Upload already stored as artifact: {filename}")
+    return media_reference(filename, mime_type)
+
+
+async def resolve_media_references(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> None:
+    """before_model_callback that swaps the current turn's media references for the actual bytes.
+
+    References from earlier turns stay as text, so the bytes are only sent to
+    the model on the turn the user uploaded them.
+    """
+    user_content = callback_context.user_content
+    if not user_content or not user_content.parts:
+        return None
+    pending = {}
+    for part in user_content.parts:
+        reference = parse_media_reference(part)
+        if reference:
+            pending[part.text] = reference
+    if not pending:
+        return None
+
+    # The current user message is the latest occurrence of each reference.
+    for content in reversed(llm_request.contents):
+        if not pending:
+            break
+        if content.role != "user" or not content.parts:
+            continue
+        for i, part in enumerate(content.parts):
+            if part.text not in pending:
+                continue
+            filename, mime_type = pending.pop(part.text)
+            artifact = await callback_context.load_artifact(filename)
+            if artifact is None or artifact.inline_data is None:
+                print(f"Uploaded artifact {filename} not found, sending the reference only.")
+                continue
+            content.parts[i] = types.Part(
+                inline_data=types.Blob(mime_type=mime_type, data=artifact.inline_data.data)
+            )
+    return None
@@ -0,0 +1,93 @@
+import json
+import os
+from typing import Optional
+
+import config
+
+# Session state keys the endpoints set for every request. AgentTool copies the
+# parent state into sub-agent sessions, so nested agents and tools see them too.
+MODEL_TIER_KEY = "model_tier"
+MODEL_ROUTE_KEY = "model_route"
+
+DEFAULT_TIER = "default"
+FAST_TIER = "fast"
+
+# Which registry role each agent of the tree uses. The RAG sub-agents of the
+# textbook corpora are added with role "rag" by corpus_registry.py.
+AGENT_ROLES = {
+    "RootAgent": "root",
+    "google_search_agent": "search",
+    "imagen_agent_tool": "imagen_dispatch",
+}
+
+
+class ModelRegistry:
+    """Single source of truth for the models used by every agent and tool.
+
+    The spec maps each role to a model per tier, optionally overridden per
+    route. A role can also be pinned with a `MODEL_<ROLE>` environment variable.
+    A role without a model for a tier uses its default one; "search" has no
+    fast tier because its model must support Google Search grounding.
+    """
+
+    def __init__(self, spec: dict):
+        self.roles = spec.get("roles", {})
+        self.routes = spec.get("routes", {})
+        self.fast_tier = spec.get("fast_tier", {})
+        # USD per million tokens: {"input", "cached_input", "output"} per model.
+        self.prices = spec.get("prices", {})
+
+    @classmethod
+    def from_file(cls, path: str) -> "ModelRegistry":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def model_for(self, role: str, tier: str = DEFAULT_TIER, route: Optional[str] = None) -> str:
+        env_override = os.getenv(f"MODEL_{role.upper()}")
+        if env_override:
+            return env_override
+
+        route_override = self.routes.get(route, {}).get(role) if route else None
+        if isinstance(route_override, str):
+            return route_override
+        tiers = route_override or self.roles.get(role)
+        if not tiers:
+            raise KeyError(f"No model configured for role '{role}'")
+        return tiers.get(tier) or tiers[DEFAULT_TIER]
+
+    def price_for(self, model: str) -> Optional[dict]:
+        # Vertex resource names end in the plain model id.
+        return self.prices.get(model) or self.prices.get(model.rsplit("/", 1)[-1])
+
+    def select_tier(self, latency_budget_ms: Optional[float] = None, queue_depth: int = 0) -> str:
+        """Picks the fast tier for tight latency budgets or when requests are piling up."""
+        budget_threshold = self.fast_tier.get("latency_budget_ms")
+        if latency_budget_ms is not None and budget_threshold is not None and latency_budget_ms <= budget_threshold:
+            return FAST_TIER
+        depth_threshold = self.fast_tier.get("queue_depth")
+        if depth_threshold is not None and queue_depth >= depth_threshold:
+            return FAST_TIER
+        return DEFAULT_TIER
+
+
+registry = ModelRegistry.from_file(config.MODEL_REGISTRY_PATH)
+
+
+def model_for_state(role: str, state) -> str:
+    """Resolves the model for `role` using the tier and route stored in session state."""
+    return registry.model_for(
+        role,
+        tier=state.get(MODEL_TIER_KEY, DEFAULT_TIER),
+        route=state.get(MODEL_ROUTE_KEY),
+    )
+
+
+def select_model(callback_context, llm_request):
+    """before_model_callback that applies the request's tier and route to the model call."""
+    role = AGENT_ROLES.get(callback_context.agent_name)
+    if role is None:
+        return None
+    model = model_for_state(role, callback_context.state)
+    if llm_request.model != model:
+        llm_request.model = model
+    return None
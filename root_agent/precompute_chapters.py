@@ -0,0 +1,169 @@
+"""Builds the chapter store: an MCQ bank, a summary and the title of every textbook chapter.
+
+The chapters of each corpus in corpora.json are its files with class,
+subject and chapter metadata (see corpus_registry.py). Their text comes from
+the RAG corpus (--source rag: the file's chunks, retrieved with that file as
+the only resource) or from <text-dir>/<corpus>/<file name>.txt (--source
+local). One model call per chapter writes the title, summary and MCQs as
+JSON. Chapters already in the store are skipped unless --refresh is given,
+and the store is saved after every chapter, so an interrupted run resumes.
+
+Run from the root_agent directory:
+    python precompute_chapters.py --source rag --mcqs 20
+    python precompute_chapters.py --source local --text-dir ~/textbooks --corpora ncert
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+import config
+from chapter_store import ChapterStore, chapter_key
+from corpus_registry import corpora, normalize_text
+
+PROMPT = """You are preparing study material for a {book}.
+From the chapter text below, write:
+- "title": the chapter's title as printed in the textbook,
+- "summary": a summary of the chapter in {summary_words} words or fewer, for students,
+- "mcqs": {mcqs} multiple choice questions that the text answers, each with exactly 4 options
+  and "answer" the 0-based index of the correct option. Cover the whole chapter, not just its start.
+
+Chapter text:
+{text}"""
+
+
+class Mcq(BaseModel):
+    question: str
+    options: list[str]
+    answer: int
+
+
+class ChapterMaterial(BaseModel):
+    title: str
+    summary: str
+    mcqs: list[Mcq]
+
+
+def local_chapters(corpus, text_dir: str) -> list:
+    """(file metadata, text) of the corpus' chapters under <text_dir>/<corpus name>."""
+    corpus_dir = os.path.join(os.path.expanduser(text_dir), corpus.name)
+    chapters = []
+    for filename in sorted(os.listdir(corpus_dir)) if os.path.isdir(corpus_dir) else []:
+        metadata = corpus.file_from_name(filename.rsplit(".", 1)[0], filename)
+        if metadata and "chapter" in metadata and filename.endswith(".txt"):
+            with open(os.path.join(corpus_dir, filename), encoding="utf-8") as f:
+                chapters.append((metadata, f.read()))
+    return chapters
+
+
+async def rag_chapter_text(corpus, file: dict, chunks: int) -> str:
+    """The file's chunks, fetched by retrieving from that file alone."""
+    from vertexai.preview import rag
+
+    response = await asyncio.to_thread(
+        rag.retrieval_query,
+        text=f"chapter {file['chapter']} story characters events main ideas",
+        rag_resources=[rag.RagResource(rag_corpus=corpus.resource, rag_file_ids=[file["id"]])],
+        rag_retrieval_config=rag.RagRetrievalConfig(top_k=chunks),
+    )
+    return "\n\n".join(context.text for context in response.contexts.contexts)
+
+
+async def generate(model: str, corpus, file: dict, text: str, mcqs: int, summary_words: int) -> ChapterMaterial:
+    from google.genai import types
+    from genai_clients import get_client
+
+    book = f"class {file.get('class')} {corpus.board} {file.get('subject', '').replace('_', ' ')} textbook"
+    response = await get_client().aio.models.generate_content(
+        model=model,
+        contents=PROMPT.format(book=book, summary_words=summary_words, mcqs=mcqs, text=text),
+        config=types.GenerateContentConfig(response_mime_type="application/json", response_schema=ChapterMaterial),
+    )
+    return response.parsed if isinstance(response.parsed, ChapterMaterial) else ChapterMaterial.model_validate_json(response.text)
+
+
+def registry_title(corpus, file: dict):
+    for chapter in corpus.chapters:
+        if all(chapter.get(k) == file.get(k) for k in ("class", "subject", "chapter")):
+            return chapter["title"]
+    return None
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", choices=["rag", "local"], default="rag")
+    parser.add_argument("--text-dir", default="textbooks", help="local source: <dir>/<corpus name>/<file name>.txt")
+    parser.add_argument("--corpora", default="", help="comma separated corpus names, default all")
+    parser.add_argument("--mcqs", type=int, default=20, help="MCQs in each chapter's bank")
+    parser.add_argument("--summary-words", type=int, default=200)
+    parser.add_argument("--rag-chunks", type=int, default=40, help="rag source: chunks fetched per chapter")
+    parser.add_argument("--max-chars", type=int, default=60000, help="chapter text sent to the model")
+    parser.add_argument("--model", help="default: the 'precompute' role of models.json")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--refresh", action="store_true", help="regenerate chapters already in the store")
+    parser.add_argument("--output", default=config.CHAPTER_STORE_PATH)
+    args = parser.parse_args()
+
+    load_dotenv()
+    from model_registry import registry
+
+    model = args.model or registry.model_for("precompute")
+    store = ChapterStore.load(args.output)
+    wanted = {name.strip() for name in args.corpora.split(",") if name.strip()}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    done, failed, skipped = 0, 0, 0
+
+    async def build(corpus, file: dict, text=None):
+        nonlocal done, failed, skipped
+        chapter = {"corpus": corpus.name, **{k: file[k] for k in ("class", "subject", "chapter") if k in file}}
+        existing = store.chapters.get(chapter_key(chapter))
+        if existing and not args.refresh and len(existing.get("mcqs", [])) >= args.mcqs:
+            skipped += 1
+            return
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if text is None:
+                    text = await rag_chapter_text(corpus, file, args.rag_chunks)
+                if not text.strip():
+                    raise ValueError("no chapter text")
+                material = await generate(model, corpus, file, text[:args.max_chars], args.mcqs, args.summary_words)
+            except Exception as e:
+                failed += 1
+                print(f"{corpus.name} {chapter}: failed ({type(e).__name__}: {e})")
+                return
+        mcqs = [
+            mcq.model_dump() for mcq in material.mcqs
+            if len(mcq.options) >= 2 and 0 <= mcq.answer < len(mcq.options) and len(set(map(normalize_text, mcq.options))) == len(mcq.options)
+        ]
+        store.put({
+            **chapter,
+            "title": registry_title(corpus, file) or material.title.strip(),
+            "summary": material.summary.strip(),
+            "mcqs": mcqs,
+            "source": file.get("id"),
+            "model": model,
+        })
+        store.save(args.output)
+        done += 1
+        print(f"{corpus.name} class {file.get('class')} {file.get('subject')} chapter {file.get('chapter')}: "
+              f"\"{material.title}\", {len(mcqs)} MCQs ({time.perf_counter() - started:.1f}s)")
+
+    tasks = []
+    for corpus in corpora.corpora:
+        if wanted and corpus.name not in wanted:
+            continue
+        if args.source == "local":
+            tasks += [build(corpus, file, text) for file, text in local_chapters(corpus, args.text_dir)]
+        else:
+            files = await asyncio.to_thread(corpus.files)
+            tasks += [build(corpus, file) for file in files if "chapter" in file]
+    await asyncio.gather(*tasks)
+    print(f"{done} chapters built, {skipped} already in the store, {failed} failed; {len(store.chapters)} chapters in {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,62 +1,188 @@
-from google.adk.agents import Agent
-from google.adk.tools import google_search, VertexAiSearchTool 
-from google.adk.tools.retrieval.vertex_ai_rag_retrieval import VertexAiRagRetrieval
-from vertexai.preview import rag
+from functools import lru_cache
 
-from dotenv import load_dotenv
 # from .prompts import return_instructions_root
 import os
 
-load_dotenv()
-
-ncert_retrieval = VertexAiRagRetrieval(
-    name='retrieve ncert textbook',
-    description=(
-        'Use this tool to retrieve documentation and reference materials for the question from the NCERT Textbook corpus,'
-    ),
-    rag_resources=[
-        #NCERT Textbooks
-        rag.RagResource(
-            rag_corpus="projects/265110558107/locations/us-central1/ragCorpora/576460752303423488"
-        ),
-    ],
-    similarity_top_k=10,
-    vector_distance_threshold=0.6,
-)
-
-kts_retrieval = VertexAiRagRetrieval(
-    name='retrieve kts textbook',
-    description=(
-        'Use this tool to retrieve documentation and reference materials for the question from the KTS Textbook corpus,'
-    ),
-    rag_resources=[
-        # KTS Textbooks
-        rag.RagResource(
-            rag_corpus="projects/265110558107/locations/us-central1/ragCorpora/5764607523034234880"
+# The retrieval tools pull in `vertexai.preview.rag` (and with it the whole
+# aiplatform SDK), so everything below is built on first use instead of at
+# import time. Each corpus in corpora.json gets a sub-agent, importable by its
+# agent name (`rag_agent_ncert`, `rag_agent_kts`, ...).
+
+
+@lru_cache(maxsize=None)
+def _load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+@lru_cache(maxsize=None)
+def _retrieval_tool_class():
+    import asyncio
+    from google.adk.tools.retrieval.vertex_ai_rag_retrieval import VertexAiRagRetrieval
+    from google.genai import types
+    from vertexai.preview import rag
+    from resilience import caller
+    import config
+
+    class ThreadedVertexAiRagRetrieval(VertexAiRagRetrieval):
+        """Runs the blocking `rag.retrieval_query` in a worker thread.
+
+        This keeps the event loop serving other requests, and a request
+        deadline can cancel the wait instead of being stuck behind the call.
+        Gemini 2 models use the built-in retrieval tool and never reach this,
+        unless a speculative prefetch (see rag_prefetch.py) already has the
+        passages or RAG compression is enabled: the passages are then handed to
+        the model with the request. Passages retrieved here are reranked and
+        trimmed to a token budget (see rag_compression.py). Either way only
+        the files matching the class, subject and chapter named in the query
+        are searched (see corpus_registry.py).
+        """
+
+        corpus = None  # Registry corpus the tool searches (corpus_registry.py).
+
+        async def process_llm_request(self, *, tool_context, llm_request):
+            from google.adk.utils.model_name_utils import is_gemini_2_model
+            from rag_compression import rag_compressor
+            from rag_prefetch import prefetcher, last_user_text
+            from usage_accounting import REQUEST_ID_KEY
+
+            query = last_user_text(llm_request)
+            if not (query and is_gemini_2_model(llm_request.model)):
+                await super().process_llm_request(tool_context=tool_context, llm_request=llm_request)
+                return
+            passages = None
+            if config.RAG_PREFETCH:
+                passages = await prefetcher.take(tool_context.state.get(REQUEST_ID_KEY), tool_context.agent_name, query)
+            if passages is None and rag_compressor.enabled:
+                # Retrieved here so the passages can be reranked and trimmed first.
+                passages = await self.retrieve(query)
+            if passages is not None:
+                llm_request.append_instructions([self.passages_instruction(passages)])
+                return
+            # The built-in retrieval tool, narrowed to the files the question is about.
+            llm_request.config = llm_request.config or types.GenerateContentConfig()
+            llm_request.config.tools = llm_request.config.tools or []
+            llm_request.config.tools.append(
+                types.Tool(retrieval=types.Retrieval(vertex_rag_store=await self.scoped_store(query)))
+            )
+
+        async def scoped_store(self, query: str):
+            """The tool's RAG store, restricted to the files matching the query's class, subject and chapter."""
+            from corpus_registry import corpora
+
+            if not config.RAG_METADATA_FILTERS or self.corpus is None:
+                return self.vertex_rag_store
+            # Listing the corpus' files the first time is a blocking call.
+            file_ids = await asyncio.to_thread(corpora.scope_for, self.corpus, query)
+            if not file_ids:
+                return self.vertex_rag_store
+            return self.vertex_rag_store.model_copy(
+                update={"rag_resources": [rag.RagResource(rag_corpus=self.corpus.resource, rag_file_ids=file_ids)]}
+            )
+
+        def passages_instruction(self, passages) -> str:
+            if isinstance(passages, str):
+                return passages
+            joined = "\n\n".join(f"[{i + 1}] {passage}" for i, passage in enumerate(passages))
+            return f"Answer using these passages retrieved with '{self.name}':\n\n{joined}"
+
+        async def run_async(self, *, args, tool_context):
+            from rag_prefetch import prefetcher
+            from usage_accounting import REQUEST_ID_KEY
+
+            if config.RAG_PREFETCH:
+                prefetched = await prefetcher.take(tool_context.state.get(REQUEST_ID_KEY), tool_context.agent_name, args['query'])
+                if prefetched is not None:
+                    return prefetched
+            return await self.retrieve(args['query'])
+
+        async def retrieve(self, query: str):
+            from cassette import cassette
+
+            from rag_compression import rag_compressor
+
+            store = await self.scoped_store(query)
+            if cassette is not None:
+                payload = {"query": query, "store": store}
+                passages = await cassette.call("rag_retrieval", payload, lambda: self._retrieve(query, store))
+            else:
+                passages = await self._retrieve(query, store)
+            return await rag_compressor.compress_async(query, passages)
+
+        async def _retrieve(self, query: str, store):
+            response = await caller.call("rag_retrieval", lambda: asyncio.to_thread(
+                rag.retrieval_query,
+                text=query,
+                rag_resources=store.rag_resources,
+                rag_corpora=store.rag_corpora,
+                similarity_top_k=store.similarity_top_k,
+                vector_distance_threshold=store.vector_distance_threshold,
+            ))
+            if not response.contexts.contexts:
+                return f'No matching result found with the config: {store}'
+            return [context.text for context in response.contexts.contexts]
+
+    return ThreadedVertexAiRagRetrieval
+
+
+@lru_cache(maxsize=None)
+def get_retrieval(agent_name: str):
+    """Retrieval tool over the registry corpus searched by `agent_name`."""
+    from vertexai.preview import rag
+    from corpus_registry import corpora
+
+    _load_env()
+    corpus = corpora.by_agent[agent_name]
+    tool = _retrieval_tool_class()(
+        name=f'retrieve {corpus.name} textbook',
+        description=(
+            f'Use this tool to retrieve documentation and reference materials for the question from the {corpus.description} corpus,'
         ),
-    ],
-    similarity_top_k=10,
-    vector_distance_threshold=0.6,
-)
+        rag_resources=[rag.RagResource(rag_corpus=corpus.resource)],
+        similarity_top_k=corpus.similarity_top_k,
+        vector_distance_threshold=corpus.vector_distance_threshold,
+    )
+    tool.corpus = corpus
+    return tool
 
 # vertexai_search_tool = VertexAiSearchTool(
 #    data_store_id="projects/tough-nature-466516-r4/locations/global/collections/default_collection/dataStores/YOUR_DATA_STORE_ID"
 # )
 
-rag_agent_ncert = Agent(
-    name="rag_agent_ncert",
-    model="gemini-2.5-flash",  
-    # model="gemini-2.0-flash",  
-    description="Agent to answer questions using RAG on diffferent Textbooks.",
-    instruction="You are an expert researcher. You always stick to the facts.",
-    tools=[ncert_retrieval]
-)
-
-rag_agent_kts = Agent(
-    name="rag_agent_kts",
-    model="gemini-2.5-flash",  
-    # model="gemini-2.5-flash",  
-    description="Agent to answer questions using RAG on diffferent Textbooks.",
-    instruction="You are an expert researcher. You always stick to the facts.",
-    tools=[kts_retrieval]
-)
+
+@lru_cache(maxsize=None)
+def get_rag_agent(agent_name: str):
+    from google.adk.agents import Agent
+    from corpus_registry import corpora
+    from model_registry import registry, select_model
+    from resilient_adk import ResilientGemini
+    from usage_accounting import start_model_call, record_model_usage
+
+    return Agent(
+        name=agent_name,
+        model=ResilientGemini(model=registry.model_for("rag")),
+        description=f"Agent to answer questions using RAG on {corpora.by_agent[agent_name].description}.",
+        instruction="You are an expert researcher. You always stick to the facts.",
+        tools=[get_retrieval(agent_name)],
+        before_model_callback=[select_model, start_model_call],
+        after_model_callback=record_model_usage,
+    )
+
+
+def get_rag_agents() -> list:
+    """One RAG sub-agent per corpus of the registry, in registry order."""
+    from corpus_registry import corpora
+
+    return [get_rag_agent(corpus.agent_name) for corpus in corpora.corpora]
+
+
+def __getattr__(name):
+    # Keeps `from rag_agent import rag_agent_ncert` (and `ncert_retrieval`) working for every corpus.
+    from corpus_registry import corpora
+
+    if name in corpora.by_agent:
+        return get_rag_agent(name)
+    for corpus in corpora.corpora:
+        if name == f"{corpus.name}_retrieval":
+            return get_retrieval(corpus.agent_name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
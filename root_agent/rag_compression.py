@@ -0,0 +1,268 @@
+import asyncio
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import config
+
+TOKEN = re.compile(r"[a-z0-9]+")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "and", "or", "is", "are", "was", "were", "what", "me", "from",
+    "with", "please", "can", "you", "about", "give", "few", "some", "this", "that", "it", "by", "as", "do", "does",
+    "be", "which", "who", "why", "how", "when", "their", "his", "her", "they", "he", "she", "its", "at", "not",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    # Same estimate as session_compaction.estimate_tokens.
+    return len(text) // 4
+
+
+def terms(text: str) -> list:
+    return [t for t in TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def shingles(text: str, size: int = 5) -> set:
+    words = TOKEN.findall(text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def char_ngrams(text: str, size: int = 3) -> Counter:
+    text = " ".join(TOKEN.findall(text.lower()))
+    return Counter(text[i:i + size] for i in range(max(1, len(text) - size + 1)))
+
+
+def cosine(a: Counter, b: Counter) -> float:
+    dot = sum(weight * b.get(key, 0) for key, weight in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def bm25_scores(query: str, documents: list, k1: float = 1.2, b: float = 0.75) -> list:
+    """BM25 of each document for the query, with IDF over the documents themselves."""
+    query_terms = set(terms(query))
+    counts = [Counter(terms(d)) for d in documents]
+    lengths = [sum(c.values()) for c in counts]
+    average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+    scores = []
+    for count, length in zip(counts, lengths):
+        score = 0.0
+        for term in query_terms:
+            tf = count.get(term, 0)
+            if not tf:
+                continue
+            df = sum(1 for c in counts if term in c)
+            idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / (average_length or 1)))
+        scores.append(score)
+    return scores
+
+
+def normalized(scores: list) -> list:
+    top = max(scores, default=0.0)
+    return [s / top if top > 0 else 0.0 for s in scores]
+
+
+def load_quality_report(path: str) -> Optional[dict]:
+    """The "quality" section of a benchmarks/rag_compression.py --output report, or None without one."""
+    try:
+        with open(path) as f:
+            return json.load(f).get("quality")
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"Could not read the RAG compression report {path}: {e}")
+        return None
+
+
+def quality_drop(quality: Optional[dict]) -> Optional[float]:
+    """Answer label recall lost to compression, or None if the report did not answer the questions.
+
+    Label retention of the passages alone does not count as measured: the
+    answers can lose labels the compressed passages still contain.
+    """
+    if quality and quality.get("answer_recall_drop") is not None:
+        return quality["answer_recall_drop"]
+    return None
+
+
+class Embedder:
+    """Sentence embeddings on CPU (MiniLM in ONNX Runtime, from chromadb), loaded on first use.
+
+    Without chromadb/onnxruntime, or when the model cannot be loaded, the
+    semantic score falls back to character trigram similarity.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._model = None
+        self._failed = name == "none"
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is None and not self._failed:
+            with self._lock:
+                if self._model is None and not self._failed:
+                    try:
+                        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+                        model = ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+                        model(["warm up"])  # Downloads the model the first time.
+                        self._model = model
+                    except Exception as e:
+                        self._failed = True
+                        print(f"Reranking without sentence embeddings ({type(e).__name__}: {e})")
+        return self._model
+
+    def similarities(self, query: str, texts: list) -> list:
+        """Cosine similarity of each text to the query."""
+        model = self.load()
+        if model is None:
+            query_grams = char_ngrams(query)
+            return [cosine(query_grams, char_ngrams(text)) for text in texts]
+        embeddings = model([query, *texts])  # Normalized, so the dot product is the cosine.
+        return [max(0.0, float(embeddings[0] @ embedding)) for embedding in embeddings[1:]]
+
+
+class RagCompressor:
+    """Shrinks retrieved passages before they reach a RAG sub-agent's model.
+
+    1. Reranks the passages by a mix of BM25 (lexical) and embedding
+       similarity (semantic) to the query.
+    2. Drops near-duplicates (word 5-gram overlap) of better-ranked passages
+       and keeps at most `max_passages`.
+    3. If that is still over the token budget, keeps the sentences that
+       score best against the query, in their original order, until the
+       budget is spent.
+
+    In "auto" `mode` it is enabled only when the measured `quality` (see
+    load_quality_report) drops by at most `max_quality_drop`.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        token_budget: int = config.RAG_CONTEXT_TOKEN_BUDGET,
+        max_passages: int = config.RAG_RERANK_MAX_PASSAGES,
+        lexical_weight: float = config.RAG_RERANK_LEXICAL_WEIGHT,
+        duplicate_threshold: float = config.RAG_DUPLICATE_THRESHOLD,
+        min_relevance: float = config.RAG_RERANK_MIN_RELEVANCE,
+        mode: str = config.RAG_COMPRESSION,
+        quality: Optional[dict] = None,
+        max_quality_drop: float = config.RAG_COMPRESSION_MAX_QUALITY_DROP,
+    ):
+        self.embedder = embedder
+        self.token_budget = token_budget
+        self.max_passages = max_passages
+        self.lexical_weight = lexical_weight
+        self.duplicate_threshold = duplicate_threshold
+        self.min_relevance = min_relevance
+        self.mode = mode
+        self.quality = quality
+        self.max_quality_drop = max_quality_drop
+        drop = quality_drop(quality)
+        if mode == "auto":
+            self.enabled = drop is not None and drop <= max_quality_drop
+        else:
+            self.enabled = mode == "true"
+        self._lock = threading.Lock()
+        self.stats = {
+            "calls": 0, "passages_in": 0, "passages_out": 0, "duplicates_removed": 0,
+            "tokens_in": 0, "tokens_out": 0, "seconds": 0.0,
+        }
+
+    def relevance(self, query: str, texts: list) -> list:
+        lexical = normalized(bm25_scores(query, texts))
+        semantic = normalized(self.embedder.similarities(query, texts))
+        return [self.lexical_weight * l + (1 - self.lexical_weight) * s for l, s in zip(lexical, semantic)]
+
+    def rerank(self, query: str, passages: list) -> tuple:
+        """([(passage, relevance)] best first, near-duplicates dropped); weak passages are dropped too."""
+        scores = self.relevance(query, passages)
+        ranked = sorted(zip(passages, scores), key=lambda item: -item[1])
+        kept, kept_shingles = [], []
+        for passage, score in ranked:
+            passage_shingles = shingles(passage)
+            if any(len(passage_shingles & other) / len(passage_shingles | other) >= self.duplicate_threshold for other in kept_shingles):
+                continue
+            kept.append((passage, score))
+            kept_shingles.append(passage_shingles)
+        duplicates = len(passages) - len(kept)
+        best = kept[0][1] if kept else 0.0
+        return [(p, s) for p, s in kept if s >= self.min_relevance * best][:self.max_passages], duplicates
+
+    def extract(self, query: str, ranked: list) -> list:
+        """Best sentences of the ranked passages within the token budget, each passage's kept in order."""
+        sentences = []  # (passage index, position, text)
+        for index, (passage, _) in enumerate(ranked):
+            for position, sentence in enumerate(s.strip() for s in SENTENCE_END.split(passage)):
+                if sentence:
+                    sentences.append((index, position, sentence))
+        if not sentences:
+            return [p for p, _ in ranked]
+        scores = self.relevance(query, [s for _, _, s in sentences])
+        # A sentence from a highly ranked passage is worth a little more.
+        weighted = [score + 0.25 * ranked[index][1] for (index, _, _), score in zip(sentences, scores)]
+        chosen, spent = set(), 0
+        for i in sorted(range(len(sentences)), key=lambda i: -weighted[i]):
+            cost = estimate_tokens(sentences[i][2]) + 1
+            if spent + cost > self.token_budget and chosen:
+                continue
+            chosen.add(i)
+            spent += cost
+        passages = []
+        for index in range(len(ranked)):
+            kept = [(position, text) for i, (p_index, position, text) in enumerate(sentences) if p_index == index and i in chosen]
+            if kept:
+                passages.append(" ".join(text for _, text in sorted(kept)))
+        return passages
+
+    def compress(self, query: str, passages: list) -> list:
+        started = time.perf_counter()
+        tokens_in = sum(estimate_tokens(p) for p in passages)
+        ranked, duplicates = self.rerank(query, passages)
+        if sum(estimate_tokens(p) for p, _ in ranked) > self.token_budget:
+            compressed = self.extract(query, ranked)
+        else:
+            compressed = [p for p, _ in ranked]
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["passages_in"] += len(passages)
+            self.stats["passages_out"] += len(compressed)
+            self.stats["duplicates_removed"] += duplicates
+            self.stats["tokens_in"] += tokens_in
+            self.stats["tokens_out"] += sum(estimate_tokens(p) for p in compressed)
+            self.stats["seconds"] += time.perf_counter() - started
+        return compressed
+
+    async def compress_async(self, query: str, passages):
+        """Compresses a retrieval result off the event loop; "no result" strings pass through."""
+        if not self.enabled or not isinstance(passages, list) or not passages:
+            return passages
+        return await asyncio.to_thread(self.compress, query, passages)
+
+    def get_stats(self) -> dict:
+        calls = self.stats["calls"]
+        return {
+            "enabled": self.enabled,
+            "mode": self.mode,
+            # Measured by benchmarks/rag_compression.py: quality with full and
+            # compressed passages, and the drop "auto" compares to the limit.
+            "quality": self.quality,
+            "quality_drop": quality_drop(self.quality),
+            "max_quality_drop": self.max_quality_drop,
+            "semantic": self.embedder.name if self.embedder._model is not None else "char-trigrams",
+            **self.stats,
+            "seconds": round(self.stats["seconds"], 3),
+            # Retrieved tokens per token handed to the model.
+            "compression_ratio": round(self.stats["tokens_in"] / self.stats["tokens_out"], 2) if self.stats["tokens_out"] else None,
+            "avg_ms": round(self.stats["seconds"] / calls * 1000, 2) if calls else None,
+        }
+
+
+rag_compressor = RagCompressor(Embedder(config.RAG_RERANK_EMBEDDER), quality=load_quality_report(config.RAG_COMPRESSION_REPORT))
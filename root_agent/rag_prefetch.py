@@ -0,0 +1,181 @@
+import asyncio
+import re
+import time
+from typing import Awaitable, Callable, Optional
+
+import config
+from corpus_registry import corpora
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "and", "or", "is", "are", "what", "me", "from", "with",
+    "please", "can", "you", "about", "give", "few", "some", "this", "that", "it", "by", "as", "do",
+}
+
+# Cheap routing hints: words that point at a textbook corpus (the `keywords`
+# of each corpus in corpora.json), and words that point away from retrieval
+# altogether (search facts, image generation).
+CORPUS_HINTS = corpora.hints()
+TEXTBOOK_WORDS = {
+    "chapter": 1.0, "textbook": 1.0, "textbooks": 1.0, "class": 0.5, "lesson": 1.0, "poem": 1.0,
+    "mcq": 1.0, "mcqs": 1.0, "questions": 0.5, "exercise": 1.0, "summary": 0.5, "summarize": 0.5,
+    "explain": 0.5, "syllabus": 1.0, "unit": 0.5, "part1": 0.5, "part2": 0.5,
+}
+NON_RETRIEVAL_WORDS = {
+    "image": -2.0, "diagram": -2.0, "picture": -2.0, "photo": -2.0, "draw": -2.0,
+    "ceo": -2.0, "price": -2.0, "stock": -2.0, "latest": -1.0, "news": -2.0, "weather": -2.0,
+}
+
+
+def tokens(text: str) -> set:
+    return {t for t in TOKEN.findall(text.lower()) if t not in STOPWORDS}
+
+
+def similarity(a: str, b: str) -> float:
+    """Word overlap (Jaccard) of two queries."""
+    ta, tb = tokens(a), tokens(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+def predict_corpora(query: str, min_score: float = config.RAG_PREFETCH_MIN_SCORE, limit: int = config.RAG_PREFETCH_MAX_CORPORA) -> list:
+    """Sub-agents whose retrieval the query will likely need, best first."""
+    words = tokens(query)
+    shared = sum(TEXTBOOK_WORDS.get(w, 0.0) + NON_RETRIEVAL_WORDS.get(w, 0.0) for w in words)
+    scores = {
+        agent: shared + sum(hints.get(w, 0.0) for w in words)
+        for agent, hints in CORPUS_HINTS.items()
+    }
+    # A corpus named in the query rules the others out.
+    named = [agent for agent, hints in CORPUS_HINTS.items() if words & set(hints)]
+    ranked = sorted((agent for agent in (named or scores) if scores[agent] >= min_score), key=lambda a: -scores[a])
+    return ranked[:limit]
+
+
+class Prefetch:
+    def __init__(self, query: str, task: asyncio.Task):
+        self.query = query
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished = None
+        self.used = False
+        task.add_done_callback(self._done)
+
+    def _done(self, _):
+        self.finished = time.perf_counter()
+
+
+class RetrievalPrefetcher:
+    """Runs likely retrievals while RootAgent is still deciding where to route.
+
+    Results live in a short-lived cache per request and sub-agent. The
+    sub-agent's retrieval tool reads it before calling Vertex AI RAG; entries
+    the dispatch did not route to are cancelled as soon as its answer is in.
+    """
+
+    def __init__(self, ttl_seconds: float = config.RAG_PREFETCH_TTL_SECONDS, min_similarity: float = config.RAG_PREFETCH_MIN_SIMILARITY):
+        self.ttl_seconds = ttl_seconds
+        self.min_similarity = min_similarity
+        self.entries = {}  # request id -> {agent name: Prefetch}
+        self.stats = {"started": 0, "hits": 0, "misses": 0, "wasted": 0, "saved_seconds": 0.0}
+
+    def start(self, request_id: str, agent_name: str, query: str, fetch: Callable[[str], Awaitable]):
+        self._expire()
+        entries = self.entries.setdefault(request_id, {})
+        if agent_name in entries:
+            return
+        entries[agent_name] = Prefetch(query, asyncio.ensure_future(fetch(query)))
+        self.stats["started"] += 1
+
+    async def take(self, request_id: Optional[str], agent_name: str, query: str):
+        """The prefetched result for this sub-agent's retrieval, or None to retrieve normally."""
+        prefetch = self.entries.get(request_id, {}).get(agent_name) if request_id else None
+        if prefetch is None or prefetch.task.cancelled() or similarity(prefetch.query, query) < self.min_similarity:
+            self.stats["misses"] += 1
+            return None
+        asked = time.perf_counter()
+        try:
+            result = await asyncio.shield(prefetch.task)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Prefetched retrieval for {agent_name} failed, retrieving again: {e}")
+            self.stats["misses"] += 1
+            return None
+        if not prefetch.used:
+            prefetch.used = True
+            self.stats["hits"] += 1
+            # The time the retrieval had already been running when it was needed.
+            self.stats["saved_seconds"] += min(asked, prefetch.finished or asked) - prefetch.started
+        return result
+
+    def settle(self, request_id: Optional[str], routed_to: set):
+        """Cancels the prefetches of sub-agents the dispatch did not call."""
+        for agent_name, prefetch in list(self.entries.get(request_id, {}).items()):
+            if agent_name not in routed_to and not prefetch.used:
+                self._drop(request_id, agent_name)
+
+    def _drop(self, request_id: str, agent_name: str):
+        prefetch = self.entries[request_id].pop(agent_name)
+        if not self.entries[request_id]:
+            del self.entries[request_id]
+        if not prefetch.used:
+            prefetch.task.cancel()
+            self.stats["wasted"] += 1
+
+    def _expire(self):
+        now = time.perf_counter()
+        for request_id, entries in list(self.entries.items()):
+            for agent_name, prefetch in list(entries.items()):
+                if now - prefetch.started > self.ttl_seconds:
+                    self._drop(request_id, agent_name)
+
+    def get_stats(self) -> dict:
+        looked_up = self.stats["hits"] + self.stats["misses"]
+        return {
+            "enabled": config.RAG_PREFETCH,
+            **self.stats,
+            "saved_seconds": round(self.stats["saved_seconds"], 3),
+            "hit_rate": round(self.stats["hits"] / looked_up, 4) if looked_up else None,
+            "open_requests": len(self.entries),
+        }
+
+
+prefetcher = RetrievalPrefetcher()
+
+
+def last_user_text(llm_request) -> Optional[str]:
+    if not llm_request.contents or llm_request.contents[-1].role != "user":
+        return None
+    text = " ".join(p.text for p in llm_request.contents[-1].parts or [] if p.text and not p.function_response)
+    return text or None
+
+
+def start_prefetch(callback_context, llm_request):
+    """before_model_callback of RootAgent: starts the likely retrievals with the user's question."""
+    from usage_accounting import REQUEST_ID_KEY
+
+    if not config.RAG_PREFETCH:
+        return None
+    request_id = callback_context.state.get(REQUEST_ID_KEY)
+    query = last_user_text(llm_request)
+    if request_id is None or query is None:
+        return None
+    from rag_agent import get_retrieval
+
+    for agent_name in predict_corpora(query):
+        prefetcher.start(request_id, agent_name, query, get_retrieval(agent_name).retrieve)
+    return None
+
+
+def settle_prefetch(callback_context, llm_response):
+    """after_model_callback of RootAgent: drops what the routing decision did not use."""
+    from usage_accounting import REQUEST_ID_KEY
+
+    if not config.RAG_PREFETCH or llm_response.partial:
+        return None
+    parts = llm_response.content.parts if llm_response.content and llm_response.content.parts else []
+    routed_to = {p.function_call.name for p in parts if p.function_call}
+    prefetcher.settle(callback_context.state.get(REQUEST_ID_KEY), routed_to)
+    return None
@@ -0,0 +1,189 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import config
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error: BaseException) -> bool:
+    """Errors worth retrying: timeouts, dropped connections and retryable HTTP statuses."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):
+        # grpc errors expose a StatusCode through `.code()`.
+        return getattr(code(), "name", "") in {"UNAVAILABLE", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED"}
+    try:
+        return int(code) in TRANSIENT_STATUS_CODES
+    except (TypeError, ValueError):
+        return False
+
+
+class Policy:
+    """How one kind of call is retried and hedged."""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+        hedge: bool = False,
+        hedge_percentile: float = 0.95,
+        min_samples: int = 20,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class Budget:
+    """Caps extra load: every primary call earns `ratio` tokens, every retry or hedge spends one."""
+
+    def __init__(self, ratio: float, capacity: float = 10.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+
+    def earn(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class ResilientCaller:
+    """Retries transient failures and optionally hedges slow calls, per call key.
+
+    A hedge is a duplicate call started once the first one has run longer than
+    the key's recent p95 latency; whichever finishes first wins and the other
+    is cancelled. Retries and hedges both draw from budgets so a struggling
+    upstream does not receive a multiple of the normal load.
+    """
+
+    def __init__(
+        self,
+        policies: Optional[dict] = None,
+        retry_budget_ratio: float = config.RETRY_BUDGET_RATIO,
+        hedge_budget_ratio: float = config.HEDGE_BUDGET_RATIO,
+    ):
+        self.policies = policies or {}
+        self.retry_budget = Budget(retry_budget_ratio)
+        self.hedge_budget = Budget(hedge_budget_ratio)
+        self.trackers = {}
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+
+    def policy_for(self, key: str) -> Policy:
+        return self.policies.get(key) or self.policies.get("default") or Policy()
+
+    def _tracker(self, key: str) -> LatencyTracker:
+        if key not in self.trackers:
+            self.trackers[key] = LatencyTracker()
+        return self.trackers[key]
+
+    async def call(self, key: str, fn: Callable[[], Awaitable]):
+        """Runs `fn()` under the policy registered for `key`. `fn` must be safe to call more than once."""
+        policy = self.policy_for(key)
+        self.stats["calls"] += 1
+        self.retry_budget.earn()
+        self.hedge_budget.earn()
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(key, fn, policy)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempt += 1
+                if (
+                    attempt >= policy.max_attempts
+                    or not is_transient(e)
+                    or not self.retry_budget.try_spend()
+                ):
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                delay = policy.backoff(attempt)
+                print(f"Transient error on {key} ({e}); retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, key: str, fn: Callable[[], Awaitable], policy: Policy):
+        tracker = self._tracker(key)
+        start = time.perf_counter()
+        hedge_after = None
+        if policy.hedge and len(tracker.samples) >= policy.min_samples:
+            hedge_after = tracker.percentile(policy.hedge_percentile)
+
+        primary = asyncio.ensure_future(fn())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done and self.hedge_budget.try_spend():
+                self.stats["hedges"] += 1
+                tasks.add(asyncio.ensure_future(fn()))
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winner = next(iter(done))
+                tasks.discard(winner)
+                if winner.exception() is None or not tasks:
+                    break
+                # One copy failed while another is still running: wait for that one.
+            if winner is not primary:
+                self.stats["hedge_wins"] += 1
+            result = winner.result()
+            tracker.record(time.perf_counter() - start)
+            return result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["p95_seconds"] = {
+            key: round(tracker.percentile(0.95), 4)
+            for key, tracker in self.trackers.items()
+            if tracker.samples
+        }
+        return stats
+
+
+def default_policies() -> dict:
+    return {
+        "default": Policy(max_attempts=config.RETRY_MAX_ATTEMPTS),
+        # Read-only lookups are cheap to duplicate and have long tails.
+        "search": Policy(max_attempts=config.RETRY_MAX_ATTEMPTS, hedge=config.HEDGE_SEARCH),
+        "rag_retrieval": Policy(max_attempts=config.RETRY_MAX_ATTEMPTS, hedge=config.HEDGE_RAG),
+        # Model calls and image renders are expensive: retry only.
+        "model": Policy(max_attempts=config.RETRY_MAX_ATTEMPTS, hedge=config.HEDGE_MODEL),
+        "image": Policy(max_attempts=config.RETRY_MAX_ATTEMPTS),
+    }
+
+
+caller = ResilientCaller(default_policies())
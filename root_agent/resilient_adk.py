@@ -0,0 +1,62 @@
+import copy
+
+from google.adk.models import Gemini
+
+from cassette import cassette, model_request_payload
+from genai_clients import get_client
+from resilience import caller
+
+
+class ResilientGemini(Gemini):
+    """Gemini model whose non-streaming calls go through the shared retry/hedge policy.
+
+    `policy_key` picks the policy: "model" (retry only) by default, "search"
+    for the grounded search call, which is a read-only lookup worth hedging.
+    Sub-agent runs are not wrapped again, so each call is retried at one level.
+
+    All instances use the process-wide genai client, so every agent shares one
+    connection pool instead of opening its own. The client is looked up on
+    every access rather than cached on the model: the model is part of the
+    agent state that ADK copies, and the client (with its connection pool and
+    SSL context) cannot be copied.
+    """
+
+    policy_key: str = "model"
+
+    @property
+    def api_client(self):
+        return get_client()
+
+    @property
+    def _live_api_client(self):
+        return get_client(api_version=self._live_api_version)
+
+    async def generate_content_async(self, llm_request, stream: bool = False):
+        responses = self._generate(llm_request, stream)
+        if cassette is not None:
+            # Recorded once per logical call, retries and hedges included in its latency.
+            from google.adk.models import LlmResponse
+
+            responses = cassette.stream("model", model_request_payload(llm_request), responses, LlmResponse.model_validate)
+        async for response in responses:
+            yield response
+
+    async def _generate(self, llm_request, stream: bool):
+        if stream:
+            async for response in super().generate_content_async(llm_request, stream=True):
+                yield response
+            return
+
+        async def attempt():
+            # Each attempt sends its own copy of what sending mutates (contents
+            # and config). tools_dict holds the live tools, sub-agents and
+            # their clients, so it is shared, not copied.
+            request = llm_request.model_copy(update={
+                "contents": copy.deepcopy(llm_request.contents),
+                "config": llm_request.config.model_copy(deep=True) if llm_request.config else None,
+            })
+            return [r async for r in Gemini.generate_content_async(self, request, stream=False)]
+
+        for response in await caller.call(self.policy_key, attempt):
+            yield response
+
@@ -1,13 +1,28 @@
-from google.adk.agents import Agent
-from google.adk.tools import google_search, VertexAiSearchTool 
-
-search_agent_tool = Agent(
-    name="google_search_agent",
-    model="gemini-2.0-flash",  
-    # model="gemini-2.5-flash",  
-    description="Agent to answer questions using Google Search.",
-    instruction="You are an expert researcher. You always stick to the facts.",
-    # tools=[google_search, ask_vertex_retrieval]
-    tools=[google_search]
-)
+from functools import lru_cache
 
+
+@lru_cache(maxsize=None)
+def get_search_agent_tool():
+    from google.adk.agents import Agent
+    from google.adk.tools import google_search, VertexAiSearchTool
+    from model_registry import registry, select_model
+    from resilient_adk import ResilientGemini
+    from usage_accounting import start_model_call, record_model_usage
+
+    return Agent(
+        name="google_search_agent",
+        # The grounded model call is the search itself: hedged like a lookup.
+        model=ResilientGemini(model=registry.model_for("search"), policy_key="search"),
+        description="Agent to answer questions using Google Search.",
+        instruction="You are an expert researcher. You always stick to the facts.",
+        # tools=[google_search, ask_vertex_retrieval]
+        tools=[google_search],
+        before_model_callback=[select_model, start_model_call],
+        after_model_callback=record_model_usage,
+    )
+
+
+def __getattr__(name):
+    if name == "search_agent_tool":
+        return get_search_agent_tool()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,35 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library.
+    orjson = None
+
+
+def _default(value):
+    # Pydantic models (e.g. ChatResponse) nested in a payload.
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON as UTF-8 bytes; uses orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def dumps_str(value: Any) -> str:
+    """Like `dumps`, for WebSocket text frames."""
+    return dumps(value).decode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with `dumps` instead of the standard json module."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
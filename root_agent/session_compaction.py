@@ -0,0 +1,250 @@
+import copy
+import hashlib
+import json
+import time
+from typing import Callable, Optional
+
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+from google.genai import types
+
+import config
+
+SUMMARY_MARKER = "[Summary of earlier conversation]"
+
+# Rough token estimates used for reporting only. Gemini bills a fixed 258
+# tokens per image and ~32 tokens per second of audio (16kHz/16bit wav is
+# ~32kB per second, so roughly one token per kB).
+IMAGE_TOKENS = 258
+
+
+def estimate_tokens(events: list[Event]) -> int:
+    """Cheap, offline estimate of the prompt tokens a list of events costs."""
+    tokens = 0
+    for event in events:
+        if not event.content or not event.content.parts:
+            continue
+        for part in event.content.parts:
+            if part.text:
+                tokens += len(part.text) // 4
+            if part.inline_data and part.inline_data.data:
+                if (part.inline_data.mime_type or "").startswith("image/"):
+                    tokens += IMAGE_TOKENS
+                else:
+                    tokens += len(part.inline_data.data) // 1000
+            if part.function_call:
+                tokens += len(json.dumps(part.function_call.args or {}, default=str)) // 4
+            if part.function_response:
+                tokens += len(json.dumps(part.function_response.response or {}, default=str)) // 4
+    return tokens
+
+
+def split_turns(events: list[Event]) -> list[list[Event]]:
+    """Groups events into turns, each starting with a message authored by the user."""
+    turns = []
+    for event in events:
+        if event.author == "user" or not turns:
+            turns.append([])
+        turns[-1].append(event)
+    return turns
+
+
+def is_summary_event(event: Event) -> bool:
+    return bool(
+        event.author == "user"
+        and event.content
+        and event.content.parts
+        and event.content.parts[0].text
+        and event.content.parts[0].text.startswith(SUMMARY_MARKER)
+    )
+
+
+def extractive_summary(previous_summary: str, turns: list[list[Event]], max_chars: int) -> str:
+    """Default summarizer: keeps the user's questions and the final answers of evicted turns.
+
+    It runs locally so compaction never costs an extra model call. Pass a
+    different `summarizer` to CompactingSessionService to use a model instead.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for turn in turns:
+        question = ""
+        answer = ""
+        for event in turn:
+            if not event.content or not event.content.parts:
+                continue
+            text = " ".join(p.text for p in event.content.parts if p.text).strip()
+            if not text:
+                continue
+            if event.author == "user" and not question:
+                question = text
+            elif event.author != "user":
+                answer = text
+        if question or answer:
+            lines.append(f"- User: {question[:300]} | Agent: {answer[:300]}")
+    summary = "\n".join(lines)
+    if len(summary) > max_chars:
+        # Keep the most recent part of the rolling summary.
+        summary = summary[-max_chars:]
+    return summary
+
+
+def _media_reference(blob: types.Blob) -> types.Part:
+    digest = hashlib.sha256(blob.data or b"").hexdigest()[:12]
+    return types.Part(
+        text=f"[{blob.mime_type} attachment {digest}, {len(blob.data or b'')} bytes, omitted from history]"
+    )
+
+
+def _compact_tool_result(response: dict, name: str, max_chars: int) -> Optional[dict]:
+    serialized = json.dumps(response, default=str)
+    if len(serialized) <= max_chars:
+        return None
+    digest = hashlib.sha256(serialized.encode()).hexdigest()[:12]
+    compacted = {
+        "compacted": True,
+        "ref": f"{name}:{digest}",
+        "original_chars": len(serialized),
+        "preview": serialized[:200],
+    }
+    if isinstance(response, dict) and "status" in response:
+        compacted["status"] = response["status"]
+    return compacted
+
+
+class CompactionStats:
+    """Counters describing how much history compaction saved."""
+
+    def __init__(self):
+        self.compactions = 0
+        self.events_before = 0
+        self.events_after = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.media_parts_dropped = 0
+        self.tool_results_compacted = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "compactions": self.compactions,
+            "events_before": self.events_before,
+            "events_after": self.events_after,
+            "estimated_tokens_before": self.tokens_before,
+            "estimated_tokens_after": self.tokens_after,
+            "estimated_tokens_saved": self.tokens_before - self.tokens_after,
+            "media_parts_dropped": self.media_parts_dropped,
+            "tool_results_compacted": self.tool_results_compacted,
+            "compaction_seconds": round(self.seconds, 6),
+        }
+
+
+class CompactingSessionService(InMemorySessionService):
+    """In-memory session service that keeps the history sent to the model bounded.
+
+    Before a new user message is appended, the stored history is compacted:
+    - only the last `window_turns` turns are kept verbatim, older turns are
+      folded into one rolling summary event at the start of the history;
+    - inline images/audio of answered turns become short text references;
+    - tool results larger than `tool_result_max_chars` become compact references.
+    """
+
+    def __init__(
+        self,
+        window_turns: int = config.HISTORY_WINDOW_TURNS,
+        summary_max_chars: int = config.HISTORY_SUMMARY_MAX_CHARS,
+        tool_result_max_chars: int = config.HISTORY_TOOL_RESULT_MAX_CHARS,
+        compact_media: bool = config.HISTORY_COMPACT_MEDIA,
+        summarizer: Optional[Callable[[str, list[list[Event]], int], str]] = None,
+    ):
+        super().__init__()
+        self.window_turns = window_turns
+        self.summary_max_chars = summary_max_chars
+        self.tool_result_max_chars = tool_result_max_chars
+        self.compact_media = compact_media
+        self.summarizer = summarizer or extractive_summary
+        self.stats = CompactionStats()
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.author == "user" and not event.partial:
+            storage_session = self._storage_session(session)
+            if storage_session is not None and storage_session.events:
+                self.compact(storage_session)
+                # The runner builds the model request from its own copy of the session.
+                session.events = copy.deepcopy(storage_session.events)
+        return await super().append_event(session=session, event=event)
+
+    def _storage_session(self, session: Session) -> Optional[Session]:
+        return self.sessions.get(session.app_name, {}).get(session.user_id, {}).get(session.id)
+
+    def compact(self, session: Session) -> None:
+        """Compacts `session.events` in place."""
+        start = time.perf_counter()
+        events_before = len(session.events)
+        first_event = session.events[0] if session.events else None
+        tokens_before = estimate_tokens(session.events)
+
+        previous_summary = ""
+        events = session.events
+        if events and is_summary_event(events[0]):
+            previous_summary = events[0].content.parts[0].text[len(SUMMARY_MARKER):].strip()
+            events = events[1:]
+
+        turns = split_turns(events)
+        evicted, kept = [], turns
+        if self.window_turns > 0 and len(turns) > self.window_turns:
+            evicted, kept = turns[:-self.window_turns], turns[-self.window_turns:]
+
+        new_events = []
+        summary = previous_summary
+        if evicted:
+            summary = self.summarizer(previous_summary, evicted, self.summary_max_chars)
+        if summary:
+            new_events.append(self._summary_event(summary, evicted, first_event))
+
+        # Every kept turn is history now: the incoming message starts the next turn.
+        for turn in kept:
+            for event in turn:
+                self._compact_event(event)
+                new_events.append(event)
+
+        session.events = new_events
+
+        self.stats.compactions += 1
+        self.stats.events_before += events_before
+        self.stats.events_after += len(new_events)
+        self.stats.tokens_before += tokens_before
+        self.stats.tokens_after += estimate_tokens(new_events)
+        self.stats.seconds += time.perf_counter() - start
+
+    def _summary_event(self, summary: str, evicted: list[list[Event]], first_event: Optional[Event]) -> Event:
+        if not evicted and first_event is not None and is_summary_event(first_event):
+            return first_event
+        return Event(
+            author="user",
+            invocation_id=evicted[-1][0].invocation_id if evicted else "",
+            content=types.Content(role="user", parts=[types.Part(text=f"{SUMMARY_MARKER}\n{summary}")]),
+        )
+
+    def _compact_event(self, event: Event) -> None:
+        if not event.content or not event.content.parts:
+            return
+        parts = []
+        for part in event.content.parts:
+            if self.compact_media and part.inline_data is not None:
+                parts.append(_media_reference(part.inline_data))
+                self.stats.media_parts_dropped += 1
+                continue
+            if part.function_response is not None and part.function_response.response:
+                compacted = _compact_tool_result(
+                    part.function_response.response,
+                    part.function_response.name or "tool",
+                    self.tool_result_max_chars,
+                )
+                if compacted is not None:
+                    part.function_response.response = compacted
+                    self.stats.tool_results_compacted += 1
+            parts.append(part)
+        event.content.parts = parts
+
+    def get_stats(self) -> dict:
+        return self.stats.as_dict()
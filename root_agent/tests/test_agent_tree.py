@@ -0,0 +1,138 @@
+"""Runs the real agent tree against the load test's fake genai transport.
+
+Run from the root_agent directory:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import load_test  # noqa: E402  (sets the fake backends' environment first)
+
+QUESTIONS = [
+    "who is the ceo of google",
+    "what is the name of chapter 3 of class 6 NCERT english textbook?",
+    "explain photosynthesis in simple words",
+    "who is the ceo of google",
+]
+
+
+def run_turns(questions: list) -> list:
+    """(tools RootAgent called, final answer) of each turn, all in one session."""
+    from google.adk.artifacts import InMemoryArtifactService
+    from google.adk.runners import Runner
+    from google.adk.sessions import InMemorySessionService
+    from google.genai import types
+    from agent import get_root_agent
+
+    async def run():
+        runner = Runner(
+            agent=get_root_agent(),
+            app_name="test",
+            session_service=InMemorySessionService(),
+            artifact_service=InMemoryArtifactService(),
+        )
+        session = await runner.session_service.create_session(app_name="test", user_id="student")
+        turns = []
+        for question in questions:
+            tools, answer = [], None
+            message = types.Content(role="user", parts=[types.Part(text=question)])
+            async for event in runner.run_async(user_id="student", session_id=session.id, new_message=message):
+                tools += [response.name for response in event.get_function_responses()]
+                if event.is_final_response():
+                    answer = event.content.parts[0].text
+            turns.append((tools, answer))
+        return turns
+
+    return asyncio.run(run())
+
+
+def test_root_calls_sub_agents_and_answers_every_turn(tmp_path, monkeypatch):
+    # Every RootAgent model call after a sub-agent ran used to fail: each
+    # attempt deep-copied the request, tools and sub-agents included.
+    monkeypatch.chdir(tmp_path)
+    load_test.install_fake_backends(SimpleNamespace(seed=1, model_ms=0, image_ms=0, rag_ms=0, tts_ms=0))
+
+    turns = run_turns(QUESTIONS)
+
+    assert [tools for tools, _ in turns] == [["google_search_agent"], ["rag_agent_ncert"], [], ["google_search_agent"]]
+    assert all(answer == load_test.ANSWER for _, answer in turns)
+
+
+def test_model_attempts_copy_contents_and_config_but_share_tools(monkeypatch):
+    from google.adk.models import Gemini, LlmRequest, LlmResponse
+    from google.adk.tools import BaseTool
+    from google.genai import types
+    from resilient_adk import ResilientGemini
+
+    class ToolWithClient(BaseTool):
+        def __init__(self):
+            super().__init__(name="tool", description="holds something that cannot be copied")
+            self.lock = threading.Lock()
+
+    sent = []
+
+    async def generate(self, llm_request, stream=False):
+        sent.append(llm_request)
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text="ok")]))
+
+    monkeypatch.setattr(Gemini, "generate_content_async", generate)
+    tool = ToolWithClient()
+    request = LlmRequest(
+        model="gemini-2.5-flash",
+        contents=[types.Content(role="user", parts=[types.Part(text="hi")])],
+        config=types.GenerateContentConfig(system_instruction="be brief"),
+        tools_dict={"tool": tool},
+    )
+
+    async def collect():
+        return [r async for r in ResilientGemini(model="gemini-2.5-flash").generate_content_async(request)]
+
+    assert asyncio.run(collect())[0].content.parts[0].text == "ok"
+    assert sent[0].tools_dict["tool"] is tool
+    assert sent[0].contents == request.contents and sent[0].contents is not request.contents
+    assert sent[0].config == request.config and sent[0].config is not request.config
+
+
+def test_cache_prefixes_match_the_requests_adk_sends(tmp_path, monkeypatch):
+    # build_prefix_request redoes what ADK's request processors add; a change
+    # in the pinned ADK version would silently stop every cache hit.
+    from context_cache import build_prefix_request, prefix_key
+    from resilient_adk import ResilientGemini
+    from agent import get_root_agent
+
+    monkeypatch.chdir(tmp_path)
+    load_test.install_fake_backends(SimpleNamespace(seed=1, model_ms=0, image_ms=0, rag_ms=0, tts_ms=0))
+    sent = []
+    generate = ResilientGemini.generate_content_async
+
+    async def capture(self, llm_request, stream=False):
+        # RAG agents' requests also carry the passages retrieved for the question.
+        if "Answer using these passages" not in llm_request.config.system_instruction:
+            sent.append((llm_request.model, prefix_key(llm_request.model, llm_request)))
+        async for response in generate(self, llm_request, stream):
+            yield response
+
+    monkeypatch.setattr(ResilientGemini, "generate_content_async", capture)
+    run_turns(QUESTIONS)
+
+    def agents(agent):
+        yield agent
+        for tool in agent.tools:
+            if hasattr(tool, "agent"):
+                yield from agents(tool.agent)
+        for sub_agent in agent.sub_agents:
+            yield from agents(sub_agent)
+
+    async def prefixes():
+        return {
+            (model, prefix_key(model, await build_prefix_request(agent, model)))
+            for agent in agents(get_root_agent())
+            for model in {model for model, _ in sent}
+        }
+
+    assert len(set(sent)) == 2 and set(sent) <= asyncio.run(prefixes())
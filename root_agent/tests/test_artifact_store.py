@@ -0,0 +1,29 @@
+"""Artifact URLs keep working after the in-memory copy is evicted.
+
+Run from the root_agent directory:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_an_evicted_artifact_is_read_back_from_its_upload(tmp_path, monkeypatch):
+    from artifact_store import ArtifactStore
+    from upload_queue import LocalObjectStore, upload_queue
+
+    monkeypatch.setattr(upload_queue, "store", LocalObjectStore(str(tmp_path), "uploads"))
+    upload_queue.store.put("2026-10-19/first.png", b"first image", "image/png")
+    store = ArtifactStore(max_bytes=12)
+
+    first = store.put(b"first image", "image/png")
+    store.add_source(first, "2026-10-19/first.png", "image/png")
+    unsaved = store.put(b"not uploaded", "image/png")
+    store.put(b"third image", "image/png")
+
+    assert store.get(first) is None and store.stats["evictions"] == 2
+    assert asyncio.run(store.load(first)) == (b"first image", "image/png")
+    assert asyncio.run(store.load(unsaved)) is None
+    assert store.stats["source_reads"] == 1
@@ -0,0 +1,47 @@
+"""Cassettes keep calls their consumer closed early, and replay them the same way.
+
+Run from the root_agent directory:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_a_call_closed_early_is_recorded_and_replayed_open(tmp_path):
+    from cassette import Cassette
+    from deadlines import consume_with_deadline
+
+    async def slow_model():
+        yield "first"
+        await asyncio.sleep(3600)
+        yield "never"
+
+    def run(cassette):
+        seen = []
+        timed_out = asyncio.run(consume_with_deadline(
+            cassette.stream("model", {"q": 1}, slow_model(), str), 0.2, seen.append
+        ))
+        return timed_out, seen
+
+    recorder = Cassette(str(tmp_path), "record")
+    assert run(recorder) == (True, ["first"])
+    assert recorder.stats["recorded"] == 1
+
+    player = Cassette(str(tmp_path), "replay", strict=True)
+    assert run(player) == (True, ["first"])
+    assert player.stats["key_matches"] == 1
+
+
+def test_blocking_calls_replay_without_fetching(tmp_path):
+    from cassette import Cassette
+
+    files = [["corpora/1/ragFiles/7", "class10_english_ch7.pdf"]]
+    assert Cassette(str(tmp_path), "record").call_sync("rag_files", {"corpus": "c"}, lambda: files) == files
+
+    def offline():
+        raise AssertionError("replay must not list the files again")
+
+    assert Cassette(str(tmp_path), "replay", strict=True).call_sync("rag_files", {"corpus": "c"}, offline) == files
@@ -0,0 +1,66 @@
+"""Stored MCQ, summary and chapter-name answers, and the requests they must not answer.
+
+Run from the root_agent directory:
+    python -m pytest tests
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHAPTERS = [
+    {
+        "corpus": "ncert", "class": 10, "subject": "english", "chapter": 7, "title": "Glimpses of India",
+        "summary": "Three travel pieces about Goa, Coorg and Assam.",
+        "mcqs": [{"question": "Where is Coorg?", "options": ["Karnataka", "Kerala", "Goa"], "answer": 0}],
+    },
+    {"corpus": "ncert", "class": 6, "subject": "english", "chapter": 7, "title": "Fair Play"},
+]
+
+
+def make_store():
+    from chapter_store import ChapterStore
+
+    return ChapterStore(CHAPTERS)
+
+
+def test_find_and_answer_route_to_one_chapter():
+    store = make_store()
+
+    assert [c["title"] for c in store.find("make mcqs from chapter glimpses of india")] == ["Glimpses of India"]
+    assert store.answer("what is the name of chapter 7 of class 6 ncert english?") == (
+        'Chapter 7 of the class 6 NCERT english textbook is "Fair Play".'
+    )
+    assert store.answer("summarize glimpses of india").endswith("Three travel pieces about Goa, Coorg and Assam.")
+    assert "Where is Coorg?" in store.answer("give me 1 mcq from glimpses of india")
+
+
+def test_ambiguous_or_unknown_chapters_are_left_to_the_agent():
+    store = make_store()
+
+    # Chapter 7 without a class matches both books.
+    assert len(store.find("summary of chapter 7")) == 2
+    assert store.answer("summary of chapter 7") is None
+    assert store.answer("make mcqs from chapter 12 of class 10 english") is None
+    # Not an MCQ, summary or chapter-name request.
+    assert store.answer("who wrote glimpses of india") is None
+    assert store.stats["ambiguous"] == 1 and store.stats["misses"] == 1
+
+
+def test_questions_with_an_upload_go_to_the_agent(monkeypatch):
+    import chapter_store
+    from google.adk.models import LlmRequest
+    from google.genai import types
+    from media_store import media_reference
+
+    monkeypatch.setattr(chapter_store, "chapter_store", make_store())
+    monkeypatch.setattr(chapter_store.config, "CHAPTER_STORE", True)
+
+    def ask(*parts):
+        request = LlmRequest(contents=[types.Content(role="user", parts=list(parts))])
+        return chapter_store.answer_from_chapter_store(SimpleNamespace(), request)
+
+    question = types.Part(text="make mcqs from chapter glimpses of india")
+    assert ask(question) is not None
+    assert ask(question, media_reference("user:upload_0123.png", "image/png")) is None
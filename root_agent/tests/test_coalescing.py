@@ -0,0 +1,82 @@
+"""Identical concurrent requests share one agent run, but never within one session,
+and each request's session keeps its own copy of its upload.
+
+Run from the root_agent directory:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import load_test  # noqa: E402  (sets the fake backends' environment first)
+
+
+def test_a_session_already_in_a_flight_runs_on_its_own():
+    from coalescing import SingleFlight
+
+    flight = SingleFlight()
+    runs = []
+
+    async def answer():
+        number = len(runs) + 1
+        runs.append(number)
+        await asyncio.sleep(0.01)
+        return {"text": f"run {number}"}
+
+    async def run():
+        return await asyncio.gather(
+            flight.run("key", answer, session=("student", "a")),
+            flight.run("key", answer, session=("student", "a")),
+            flight.run("key", answer, session=("other", "b")),
+        )
+
+    (first, first_shared), (double, double_shared), (other, other_shared) = asyncio.run(run())
+
+    assert len(runs) == 2
+    assert not first_shared and not double_shared and other_shared
+    assert other == first and double != first
+    assert flight.stats["session_busy"] == 1 and not flight.sessions
+
+
+def test_a_follower_of_another_user_references_its_own_upload(monkeypatch):
+    import io
+    import httpx
+    from PIL import Image
+    from media_store import parse_media_reference
+
+    monkeypatch.setattr("config.COALESCE_REQUESTS", True)
+    app = load_test.load_app("fastapi_endpoint", SimpleNamespace(seed=1, model_ms=200, image_ms=0, rag_ms=0, tts_ms=0))
+    import fastapi_endpoint
+
+    image = io.BytesIO()
+    Image.new("RGB", (4, 4)).save(image, "PNG")
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            async def ask(user_id, session_id):
+                response = await client.post(
+                    "/chat",
+                    data={"query": "what is in this picture", "user_id": user_id, "session_id": session_id},
+                    files={"image_file": ("photo.png", image.getvalue(), "image/png")},
+                )
+                return response.json()
+
+            answers = await asyncio.gather(ask("teacher", "a"), ask("student", "b"))
+        manager = fastapi_endpoint.session_manager
+        uploads = []
+        for user_id, session_id in (("teacher", "a"), ("student", "b")):
+            runner = await manager.get_or_create_runner(user_id, session_id)
+            session = await manager.session_service.get_session(app_name=runner.app_name, user_id=user_id, session_id=session_id)
+            (filename, _), = [parse_media_reference(p) for p in session.events[0].content.parts if parse_media_reference(p)]
+            uploads.append(await manager.artifact_service.load_artifact(
+                app_name=runner.app_name, user_id=user_id, session_id=session_id, filename=filename
+            ))
+        return answers, uploads
+
+    answers, uploads = asyncio.run(run())
+
+    assert sorted(answer.get("coalesced") for answer in answers) == [False, True]
+    assert all(upload is not None for upload in uploads)
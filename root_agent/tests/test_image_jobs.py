@@ -0,0 +1,71 @@
+"""Image jobs: cancelled renders still finish for their readers, and each call renders only its own variants.
+
+Run from the root_agent directory:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_cancelled_renders_end_the_job_stream(monkeypatch):
+    from image_jobs import ImageJob
+    from tools import image_generation_tool
+
+    async def render_forever(imagen_prompt, tool_context, job, variant, counter):
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(image_generation_tool, "_render", render_forever)
+
+    async def run():
+        job = ImageJob("job")
+        variants = [job.add_variant("1:1"), job.add_variant("16:9")]
+        job.tasks = [
+            asyncio.ensure_future(image_generation_tool._render_variant("a cat", None, job, variant, "0"))
+            for variant in variants
+        ]
+        streamed = asyncio.ensure_future(asyncio.wait_for(_collect(job.stream()), 5))
+        await asyncio.sleep(0)
+        job.cancel()
+        return job, await streamed
+
+    job, streamed = asyncio.run(run())
+
+    assert job.done
+    assert [v["status"] for v in streamed] == ["cancelled", "cancelled"]
+
+
+async def _collect(stream) -> list:
+    return [item async for item in stream]
+
+
+def test_a_second_call_renders_and_answers_with_its_own_variants(monkeypatch):
+    from types import SimpleNamespace
+    from image_jobs import IMAGE_JOB_KEY
+    from tools import image_generation_tool
+
+    rendered, slow = [], asyncio.Event()
+
+    async def render(imagen_prompt, tool_context, job, variant, counter):
+        rendered.append((imagen_prompt, variant["index"]))
+        if variant["index"] == 1:
+            await slow.wait()  # The first call's second variant is still rendering.
+        await job.finish_variant(variant, image_bytes=imagen_prompt.encode(), artifact_name=f"{imagen_prompt}_{variant['index']}.png")
+
+    monkeypatch.setattr(image_generation_tool, "_render", render)
+    tool_context = SimpleNamespace(state={IMAGE_JOB_KEY: "two-calls"})
+
+    async def run():
+        first = await image_generation_tool.generate_images("a cat", tool_context, number_of_variants=2)
+        second = await image_generation_tool.generate_images("a dog", tool_context, number_of_variants=2)
+        slow.set()
+        await asyncio.sleep(0)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first["artifact_name"] == "a cat_0.png"
+    assert second["artifact_name"] == "a dog_2.png"
+    assert sorted(rendered) == [("a cat", 0), ("a cat", 1), ("a dog", 2), ("a dog", 3)]
@@ -0,0 +1,30 @@
+"""RAG compression in "auto" mode is on only when a benchmark report shows it keeps answer quality.
+
+Run from the root_agent directory:
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_auto_mode_follows_the_measured_quality_drop(tmp_path):
+    from rag_compression import Embedder, RagCompressor, load_quality_report
+
+    def compressor(mode, quality):
+        return RagCompressor(Embedder("none"), mode=mode, quality=quality, max_quality_drop=0.02)
+
+    report = tmp_path / "report.json"
+    report.write_text(json.dumps({"quality": {"retention_drop": 0.0, "answer_recall_drop": 0.1}}))
+    quality = load_quality_report(str(report))
+
+    assert not compressor("auto", load_quality_report(str(tmp_path / "missing.json"))).enabled
+    # The answers' drop decides, not the passages' retention.
+    assert not compressor("auto", quality).enabled
+    # Retention alone is not a measurement of the answers.
+    assert not compressor("auto", {"retention_drop": 0.0}).enabled
+    assert compressor("auto", {"retention_drop": 0.5, "answer_recall_drop": 0.01}).enabled
+    assert compressor("true", quality).enabled and not compressor("false", {"retention_drop": 0.0}).enabled
+    assert compressor("auto", quality).get_stats()["quality_drop"] == 0.1
@@ -0,0 +1,36 @@
+"""A streamed model call is recorded once, with its model and time, however many complete responses it ends in.
+
+Run from the root_agent directory:
+    python -m pytest tests
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_a_streamed_call_records_its_running_total_once():
+    from google.adk.models import LlmRequest, LlmResponse
+    from google.genai import types
+    from usage_accounting import REQUEST_ID_KEY, UsageLedger
+
+    ledger = UsageLedger()
+    ledger.begin("request", "/chat", "student", "session")
+    context = SimpleNamespace(invocation_id="invocation", agent_name="RootAgent", state={REQUEST_ID_KEY: "request"})
+
+    def response(output_tokens, partial=None):
+        return LlmResponse(
+            partial=partial,
+            usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=100, candidates_token_count=output_tokens),
+        )
+
+    ledger.start_call(context, LlmRequest(model="gemini-2.5-flash"))
+    # SSE: partial chunks, the merged text, then the last chunk with the function call.
+    for llm_response in (response(5, partial=True), response(20), response(30)):
+        ledger.end_call(context, llm_response)
+    usage = ledger.finish("request")
+
+    assert (usage["calls"], usage["input_tokens"], usage["output_tokens"]) == (1, 100, 30)
+    assert usage["model_seconds"] >= 0 and usage["unpriced_calls"] == 0
+    assert "unknown" not in ledger.aggregates["model"] and ledger.aggregates["model"]["gemini-2.5-flash"].calls == 1
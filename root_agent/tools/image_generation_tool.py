@@ -1,93 +1,179 @@
-from google import genai
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional
 from google.genai import types
 from google.adk.tools import ToolContext
 import os
 from PIL import Image
+from model_registry import model_for_state
+from resilience import caller
+from deadlines import remaining_seconds
+from image_jobs import jobs, image_semaphore, IMAGE_JOB_KEY, IMAGE_VARIANTS_KEY, IMAGE_ASPECT_RATIOS_KEY
+from upload_queue import upload_queue, UPLOAD_TARGET_KEY
+from artifact_store import artifact_store
+import config
+import genai_clients
+from cassette import cassette
 
-client = genai.Client(
-    vertexai=True
-)
 
-async def generate_images(imagen_prompt: str, tool_context: ToolContext):
-    print("************calling imagen model******************")
+def get_client():
+    # Imagen is served from Vertex AI; the client and its connection pool are
+    # shared with the agents' model calls.
+    return genai_clients.get_client(vertexai=True)
+
+async def _render_variant(imagen_prompt: str, tool_context: ToolContext, job, variant: dict, counter: str):
+    """Renders one variant under the shared image semaphore and publishes it to the job."""
     try:
-        response = client.models.generate_images(
-            # model="imagen-4.0-generate-preview-06-06",
-            model="imagen-3.0-generate-002",
-            prompt=imagen_prompt,
-            config=types.GenerateImagesConfig(
-                number_of_images=1,
-                aspect_ratio="9:16",
-                safety_filter_level="block_low_and_above",
-                person_generation="allow_adult",
-            ),
-        )
+        await _render(imagen_prompt, tool_context, job, variant, counter)
+    finally:
+        # Cancelled before it finished: the job must still see it end.
+        job.cancel_variant(variant)
 
-        # print(response)
-        generated_image_paths = []
-        if response.generated_images is not None:
-            for generated_image in response.generated_images:
-                image_bytes = generated_image.image.image_bytes
-                counter = str(tool_context.state.get("loop_iteration", 0))
-                artifact_name = f"generated_image_" + counter + ".png"
-                
-                with open(artifact_name, "wb") as f:
-                    f.write(image_bytes)
-                report_artifact = types.Part.from_bytes(
-                    data=image_bytes, mime_type="image/png"
-                )
-                try:
-                    tool_context.save_artifact(artifact=report_artifact, filename=artifact_name)
-                    artifact_list = tool_context.list_artifacts()
-                    print("Artifacts in context:", artifact_list)
-                    print(f"Image also saved as ADK artifact: {artifact_name}")
-                except Exception as e:
-                    print(f"error occured in saving artifacts:", e)
 
-                return {
-                    "status": "success",
-                    "message": f"Image generated .  ADK artifact: {artifact_name}.",
-                    "artifact_name": artifact_name,
-                }
-        else:
-            # model_dump_json might not exist or be the best way to get error details
-            error_details = str(response)  # Or a more specific error field if available
-            print(f"No images generated. Response: {error_details}")
-            return {
-                "status": "error",
-                "message": f"No images generated. Response: {error_details}",
+async def _render(imagen_prompt: str, tool_context: ToolContext, job, variant: dict, counter: str):
+    try:
+        async with image_semaphore:
+            # The async client keeps the event loop free and lets a request
+            # deadline cancel the render.
+            request = {
+                "model": model_for_state("image", tool_context.state),
+                "prompt": imagen_prompt,
+                "config": types.GenerateImagesConfig(
+                    number_of_images=1,
+                    aspect_ratio=variant["aspect_ratio"],
+                    safety_filter_level="block_low_and_above",
+                    person_generation="allow_adult",
+                ),
             }
+            render = lambda: caller.call("image", lambda: get_client().aio.models.generate_images(**request))
+            if cassette is not None:
+                response = await cassette.call("image", request, render, types.GenerateImagesResponse.model_validate)
+            else:
+                response = await render()
+    except Exception as e:
+        await job.finish_variant(variant, error=str(e))
+        return
 
+    if not response.generated_images:
+        # model_dump_json might not exist or be the best way to get error details
+        error_details = str(response)  # Or a more specific error field if available
+        print(f"No images generated. Response: {error_details}")
+        await job.finish_variant(variant, error=f"No images generated. Response: {error_details}")
+        return
+
+    image_bytes = response.generated_images[0].image.image_bytes
+    artifact_name = f"generated_image_{counter}_{variant['index']}.png"
+    try:
+        await tool_context.save_artifact(
+            filename=artifact_name,
+            artifact=types.Part.from_bytes(data=image_bytes, mime_type="image/png"),
+        )
+        print(f"Image also saved as ADK artifact: {artifact_name}")
     except Exception as e:
+        print(f"error occured in saving artifacts:", e)
+    await job.finish_variant(variant, image_bytes=image_bytes, artifact_name=artifact_name)
+    upload = await save_to_gcs(tool_context, image_bytes, artifact_name, f"{counter}_{variant['index']}")
+    if upload["status"] == "queued":
+        # /artifacts serves the uploaded copy once the in-memory one is evicted.
+        artifact_store.add_source(variant["artifact_id"], upload["blob_name"], "image/png")
 
-        return {"status": "error", "message": "No images generated.  {e}"}
 
-def save_to_gcs(tool_context: ToolContext, image_bytes, filename: str, counter: str):
-    # --- Save to GCS ---
-    storage_client = storage.Client()  # Initialize GCS client
-    bucket_name = config.GCS_BUCKET_NAME
+async def generate_images(
+    imagen_prompt: str,
+    tool_context: ToolContext,
+    number_of_variants: int = 1,
+    aspect_ratios: Optional[list[str]] = None,
+):
+    """Generates illustrative images for the prompt with Imagen.
 
-    unique_id = tool_context.state.get("unique_id", "")
-    current_date_str = datetime.utcnow().strftime("%Y-%m-%d")
-    unique_filename = filename
-    gcs_blob_name = f"{current_date_str}/{unique_id}/{unique_filename}"
+    Args:
+        imagen_prompt: The image generation prompt.
+        number_of_variants: How many alternative images to create per aspect ratio.
+        aspect_ratios: Aspect ratios to render, any of "1:1", "3:4", "4:3", "9:16", "16:9".
+    """
+    print("************calling imagen model******************")
+    state = tool_context.state
+    variants = number_of_variants if number_of_variants and number_of_variants > 1 else state.get(IMAGE_VARIANTS_KEY) or 1
+    variants = max(1, min(int(variants), config.IMAGE_MAX_VARIANTS))
+    ratios = aspect_ratios or state.get(IMAGE_ASPECT_RATIOS_KEY) or [config.IMAGE_DEFAULT_ASPECT_RATIO]
+    ratios = [r for r in dict.fromkeys(ratios) if r in config.IMAGE_ASPECT_RATIOS] or [config.IMAGE_DEFAULT_ASPECT_RATIO]
+    counter = str(state.get("loop_iteration", 0))
 
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(gcs_blob_name)
+    job = jobs.get_or_create(state.get(IMAGE_JOB_KEY))
+    # Only the variants of this call: an earlier call of the same request may
+    # still be rendering its own, which must not be started or waited on again.
+    added = [
+        job.add_variant(ratio)
+        for ratio in ratios
+        for _ in range(variants)
+        if len(job.variants) < config.IMAGE_MAX_IMAGES
+    ]
+    if not added:
+        return {"status": "error", "message": f"No images generated: this request already has {len(job.variants)} images.", "job_id": job.id}
+    pending = [
+        asyncio.ensure_future(_render_variant(imagen_prompt, tool_context, job, variant, counter))
+        for variant in added
+    ]
+    job.tasks.extend(pending)
+    # The renders still running when the request deadline passes are cancelled.
+    remaining = remaining_seconds(state)
+    if remaining is not None:
+        asyncio.get_running_loop().call_later(remaining, job.cancel)
 
+    # Answer as soon as the first image is ready; the rest keep rendering and
+    # reach the client through the job's polling/streaming endpoints.
     try:
-        blob.upload_from_string(image_bytes, content_type="image/png")
-        gcs_uri = f"gs://{bucket_name}/{gcs_blob_name}"
+        while pending and not any(v["status"] == "ready" for v in added):
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending = list(pending)
+    except asyncio.CancelledError:
+        # The agent run was cancelled: nobody is left to deliver the rest to.
+        job.cancel()
+        raise
 
-        # Store GCS URI in session context
-        # Store GCS URI in session context
-        tool_context.state["generated_image_gcs_uri_" + counter] = gcs_uri
+    ready = [v for v in added if v["status"] == "ready"]
+    if not ready:
+        errors = "; ".join(v.get("error", "") for v in added)
+        return {"status": "error", "message": f"No images generated. {errors}", "job_id": job.id}
+    return {
+        "status": "success",
+        "message": (
+            f"Image generated. {len(ready)} of {len(added)} images ready, "
+            f"the rest are delivered through image job {job.id}. ADK artifact: {ready[0]['artifact_name']}."
+        ),
+        "artifact_name": ready[0]["artifact_name"],
+        "job_id": job.id,
+    }
 
-    except Exception as e_gcs:
+async def save_to_gcs(tool_context: ToolContext, image_bytes, filename: str, counter: str):
+    # --- Save to GCS ---
+    # The upload runs on the background queue; the URI lands in session state
+    # under generated_image_gcs_uri_<counter> once it is done.
+    unique_id = tool_context.state.get("unique_id", "")
+    current_date_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    gcs_blob_name = f"{current_date_str}/{unique_id}/{filename}"
 
+    target = tool_context.state.get(UPLOAD_TARGET_KEY)
+    if target is None:
+        invocation_context = tool_context._invocation_context
+        target = {
+            "app_name": invocation_context.app_name,
+            "user_id": invocation_context.user_id,
+            "session_id": invocation_context.session.id,
+        }
+    try:
+        job_id = await upload_queue.enqueue(
+            image_bytes,
+            gcs_blob_name,
+            "image/png",
+            state_key="generated_image_gcs_uri_" + counter,
+            target=target,
+        )
+    except Exception as e_gcs:
         # Decide if this is a fatal error for the tool
         return {
             "status": "error",
-            "message": f"Image generated but failed to upload to GCS: {e_gcs}",
+            "message": f"Image generated but failed to queue the upload: {e_gcs}",
         }
-        # --- End Save to GCS ---
+    return {"status": "queued", "upload_job_id": job_id, "blob_name": gcs_blob_name}
+    # --- End Save to GCS ---
@@ -1,11 +1,14 @@
 from google.cloud import texttospeech
 import os
+from functools import lru_cache
 
-def synthesize_text(text, output_filename="output.mp3"):
-    """Synthesizes speech from the input text and saves it to a file."""
+@lru_cache(maxsize=None)
+def get_client():
+    # One client (and gRPC channel) for the whole process instead of one per call.
+    return texttospeech.TextToSpeechClient()
 
-    # Initialize the client
-    client = texttospeech.TextToSpeechClient()
+def synthesize_bytes(text, audio_encoding="MP3"):
+    """Synthesizes speech from the input text and returns the encoded audio."""
 
     # Set the text input to be synthesized
     synthesis_input = texttospeech.SynthesisInput(text=text)
@@ -21,17 +24,22 @@ def synthesize_text(text, output_filename="output.mp3"):
 
     # Set audio configuration
     audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3  # Or LINEAR16, OGG_OPUS
+        audio_encoding=texttospeech.AudioEncoding[audio_encoding]  # MP3, LINEAR16 or OGG_OPUS
     )
 
     # Perform the text-to-speech request
-    response = client.synthesize_speech(
+    response = get_client().synthesize_speech(
         input=synthesis_input, voice=voice, audio_config=audio_config
     )
+    return response.audio_content
+
+def synthesize_text(text, output_filename="output.mp3"):
+    """Synthesizes speech from the input text and saves it to a file."""
+    audio_content = synthesize_bytes(text)
 
     # Write the binary audio content to a local file
     with open(output_filename, "wb") as out:
-        out.write(response.audio_content)
+        out.write(audio_content)
     print(f"Audio content written to file '{output_filename}'")
 
 if __name__ == "__main__":
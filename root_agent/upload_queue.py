@@ -0,0 +1,264 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Optional
+
+import config
+from resilience import Policy, is_transient
+
+# Session state key the endpoints set with the session an upload's URI should
+# be written back to. Tools called through AgentTool run in a throwaway
+# sub-session, so their own invocation context is not the one to update.
+UPLOAD_TARGET_KEY = "upload_target"
+
+
+class LocalObjectStore:
+    """Object-store stand-in that writes blobs under a local directory."""
+
+    def __init__(self, root: str, bucket: str):
+        self.root = root
+        self.bucket = bucket
+
+    def put(self, blob_name: str, data: bytes, content_type: str) -> str:
+        path = os.path.join(self.root, self.bucket, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return f"file://{os.path.abspath(path)}"
+
+    def get(self, blob_name: str) -> Optional[bytes]:
+        path = os.path.join(self.root, self.bucket, blob_name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class GCSObjectStore:
+    def __init__(self, bucket: str):
+        self.bucket_name = bucket
+        self._bucket = None
+
+    def put(self, blob_name: str, data: bytes, content_type: str) -> str:
+        if self._bucket is None:
+            from google.cloud import storage
+
+            self._bucket = storage.Client().bucket(self.bucket_name)
+        self._bucket.blob(blob_name).upload_from_string(data, content_type=content_type)
+        return f"gs://{self.bucket_name}/{blob_name}"
+
+    def get(self, blob_name: str) -> Optional[bytes]:
+        from google.api_core.exceptions import NotFound
+        from google.cloud import storage
+
+        if self._bucket is None:
+            self._bucket = storage.Client().bucket(self.bucket_name)
+        try:
+            return self._bucket.blob(blob_name).download_as_bytes()
+        except NotFound:
+            return None
+
+
+def default_object_store():
+    if config.UPLOAD_BACKEND == "gcs":
+        if not config.GCS_BUCKET_NAME:
+            raise ValueError("UPLOAD_BACKEND=gcs requires GCS_BUCKET_NAME")
+        return GCSObjectStore(config.GCS_BUCKET_NAME)
+    return LocalObjectStore(config.UPLOAD_LOCAL_ROOT, config.GCS_BUCKET_NAME or "uploads")
+
+
+class UploadQueue:
+    """Durable background uploader.
+
+    Every job is written to `queue_dir` (payload plus a JSON manifest) before
+    `enqueue` returns, so jobs survive a restart and are picked up again when
+    the app's startup hook calls `start`. A pool of workers uploads them off the event
+    loop, retrying transient failures with backoff, and records the resulting
+    URI in the target session's state. Jobs that keep failing are moved to
+    `queue_dir/failed`.
+    """
+
+    def __init__(
+        self,
+        queue_dir: str = config.UPLOAD_QUEUE_DIR,
+        store=None,
+        workers: int = config.UPLOAD_WORKERS,
+        max_attempts: int = config.UPLOAD_MAX_ATTEMPTS,
+    ):
+        self.queue_dir = queue_dir
+        self.failed_dir = os.path.join(queue_dir, "failed")
+        self.store = store
+        self.workers = workers
+        self.policy = Policy(max_attempts=max_attempts, base_delay=0.5, max_delay=30.0)
+        self.session_service = None
+        self._queue = None
+        self._tasks = []
+        self.stats = {"enqueued": 0, "uploaded": 0, "retries": 0, "failed": 0, "recovered": 0}
+
+    def _paths(self, job_id: str):
+        return os.path.join(self.queue_dir, f"{job_id}.bin"), os.path.join(self.queue_dir, f"{job_id}.json")
+
+    def _write_job(self, job_id: str, data: bytes, manifest: dict):
+        os.makedirs(self.queue_dir, exist_ok=True)
+        data_path, manifest_path = self._paths(job_id)
+        with open(data_path, "wb") as f:
+            f.write(data)
+        self._write_manifest(manifest_path, manifest)
+
+    def _write_manifest(self, manifest_path: str, manifest: dict):
+        # The manifest is what marks a job as queued, so it is written last and atomically.
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    def _pending_job_ids(self) -> list:
+        if not os.path.isdir(self.queue_dir):
+            return []
+        manifests = [name for name in os.listdir(self.queue_dir) if name.endswith(".json")]
+        manifests.sort(key=lambda name: os.path.getmtime(os.path.join(self.queue_dir, name)))
+        return [name[: -len(".json")] for name in manifests]
+
+    def start(self):
+        """Starts the workers, queueing the jobs a previous process left first; no-op while they run."""
+        if self._queue is not None and any(not task.done() for task in self._tasks):
+            return
+        if self.store is None:
+            self.store = default_object_store()
+        self._queue = asyncio.Queue()
+        # Jobs left over from a previous process go first.
+        for job_id in self._pending_job_ids():
+            self._queue.put_nowait(job_id)
+            self.stats["recovered"] += 1
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def enqueue(
+        self,
+        data: bytes,
+        blob_name: str,
+        content_type: str,
+        state_key: Optional[str] = None,
+        target: Optional[dict] = None,
+    ) -> str:
+        """Persists an upload job and returns its id; the upload itself happens in the background.
+
+        `target` is {"app_name", "user_id", "session_id"} of the session whose
+        state receives `state_key` = URI once the upload succeeds.
+        """
+        self.start()
+        job_id = uuid.uuid4().hex
+        manifest = {
+            "blob_name": blob_name,
+            "content_type": content_type,
+            "state_key": state_key,
+            "target": target,
+            "attempts": 0,
+            "created": time.time(),
+        }
+        await asyncio.to_thread(self._write_job, job_id, data, manifest)
+        self.stats["enqueued"] += 1
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            except Exception as e:
+                print(f"Upload worker error on job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _read_job(self, job_id: str):
+        data_path, manifest_path = self._paths(job_id)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        with open(data_path, "rb") as f:
+            data = f.read()
+        return data, manifest
+
+    def _remove_job(self, job_id: str, failed: bool = False):
+        for path in self._paths(job_id):
+            if not os.path.exists(path):
+                continue
+            if failed:
+                os.makedirs(self.failed_dir, exist_ok=True)
+                shutil.move(path, os.path.join(self.failed_dir, os.path.basename(path)))
+            else:
+                os.remove(path)
+
+    async def _process(self, job_id: str):
+        try:
+            data, manifest = await asyncio.to_thread(self._read_job, job_id)
+        except FileNotFoundError:
+            return  # Already handled, e.g. recovered twice.
+        while True:
+            try:
+                uri = await asyncio.to_thread(self.store.put, manifest["blob_name"], data, manifest["content_type"])
+                break
+            except Exception as e:
+                manifest["attempts"] += 1
+                if manifest["attempts"] >= self.policy.max_attempts or not self._retryable(e):
+                    self.stats["failed"] += 1
+                    print(f"Upload of {manifest['blob_name']} failed permanently: {e}")
+                    await asyncio.to_thread(self._remove_job, job_id, True)
+                    return
+                self.stats["retries"] += 1
+                await asyncio.to_thread(self._write_manifest, self._paths(job_id)[1], manifest)
+                delay = self.policy.backoff(manifest["attempts"])
+                print(f"Upload of {manifest['blob_name']} failed ({e}); retry {manifest['attempts']} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+        self.stats["uploaded"] += 1
+        print(f"Uploaded {manifest['blob_name']} to {uri}")
+        await self._record_uri(manifest, uri)
+        await asyncio.to_thread(self._remove_job, job_id)
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        # Filesystem hiccups are worth retrying too, not just network errors.
+        return is_transient(error) or isinstance(error, OSError)
+
+    async def _record_uri(self, manifest: dict, uri: str):
+        target = manifest.get("target")
+        if not manifest.get("state_key") or not target or self.session_service is None:
+            return
+        from google.adk.events import Event, EventActions
+
+        session = await self.session_service.get_session(
+            app_name=target["app_name"], user_id=target["user_id"], session_id=target["session_id"]
+        )
+        if session is None:
+            return
+        event = Event(
+            invocation_id=f"upload-{uuid.uuid4().hex[:8]}",
+            author="uploader",
+            actions=EventActions(state_delta={manifest["state_key"]: uri}),
+        )
+        await self.session_service.append_event(session, event)
+
+    async def read(self, blob_name: str) -> Optional[bytes]:
+        """Bytes of an uploaded blob, or None when it is not (yet) in the object store."""
+        if self.store is None:
+            self.store = default_object_store()
+        return await asyncio.to_thread(self.store.get, blob_name)
+
+    async def drain(self):
+        """Waits until every queued job has been processed."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["pending"] = len(self._pending_job_ids())
+        return stats
+
+
+upload_queue = UploadQueue()
@@ -0,0 +1,218 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import config
+from model_registry import MODEL_ROUTE_KEY, registry
+
+# Session state key with the id of the request a model call belongs to.
+# AgentTool copies the parent state into sub-agent sessions, so calls made by
+# nested agents are attributed to the request that triggered them.
+REQUEST_ID_KEY = "request_id"
+
+DIMENSIONS = ("route", "agent", "path", "model", "user", "session")
+
+
+def new_request_id() -> str:
+    return str(uuid.uuid4())
+
+
+class Usage:
+    """Token counts, cost and model time of a group of model calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.thinking_tokens = 0
+        self.cost_usd = 0.0
+        self.unpriced_calls = 0
+        self.model_seconds = 0.0
+
+    def add(self, other: "Usage"):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def since(self, earlier: "Usage") -> "Usage":
+        """What this running total adds to an `earlier` one of the same call."""
+        delta = Usage()
+        for name, value in vars(self).items():
+            setattr(delta, name, value - getattr(earlier, name))
+        return delta
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "thinking_tokens": self.thinking_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "unpriced_calls": self.unpriced_calls,
+            "model_seconds": round(self.model_seconds, 3),
+        }
+
+
+def call_usage(model: str, usage_metadata, seconds: float) -> Usage:
+    """Usage of one model response; cost uses the registry's per-million-token prices."""
+    usage = Usage()
+    usage.calls = 1
+    usage.input_tokens = usage_metadata.prompt_token_count or 0
+    usage.cached_tokens = usage_metadata.cached_content_token_count or 0
+    usage.output_tokens = usage_metadata.candidates_token_count or 0
+    usage.thinking_tokens = usage_metadata.thoughts_token_count or 0
+    usage.model_seconds = seconds
+    price = registry.price_for(model)
+    if price is None:
+        usage.unpriced_calls = 1
+        return usage
+    uncached = usage.input_tokens - usage.cached_tokens
+    # Thinking tokens are billed as output.
+    usage.cost_usd = (
+        uncached * price.get("input", 0.0)
+        + usage.cached_tokens * price.get("cached_input", price.get("input", 0.0))
+        + (usage.output_tokens + usage.thinking_tokens) * price.get("output", 0.0)
+    ) / 1_000_000
+    return usage
+
+
+class RequestUsage:
+    def __init__(self, request_id: str, route: Optional[str], user_id: Optional[str], session_id: Optional[str]):
+        self.request_id = request_id
+        self.route = route
+        self.user_id = user_id
+        self.session_id = session_id
+        self.total = Usage()
+        self.by_agent = {}
+
+    def as_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            **self.total.as_dict(),
+            "by_agent": {agent: usage.as_dict() for agent, usage in self.by_agent.items()},
+        }
+
+
+class UsageLedger:
+    """Attributes the tokens, cost and latency of every model call to its request.
+
+    Calls are recorded from the model callbacks of each agent, which also run
+    for agents nested behind an AgentTool (their events never reach the
+    caller's run_async stream). Totals are kept per route, agent, route and
+    agent ("path"), model, user and session; users and sessions are bounded
+    to the `max_keys` most recently active.
+    """
+
+    def __init__(self, max_keys: int = config.USAGE_MAX_TRACKED_KEYS, max_open_requests: int = config.USAGE_MAX_OPEN_REQUESTS):
+        self.max_keys = max_keys
+        self.max_open_requests = max_open_requests
+        self.total = Usage()
+        self.requests = 0
+        self.aggregates = {dimension: OrderedDict() for dimension in DIMENSIONS}
+        self._open = OrderedDict()
+        self._started = {}
+
+    def begin(self, request_id: str, route: Optional[str], user_id: Optional[str], session_id: Optional[str]):
+        self._open[request_id] = RequestUsage(request_id, route, user_id, session_id)
+        while len(self._open) > self.max_open_requests:
+            # Requests nobody finished (e.g. a crashed handler) must not pile up.
+            self._open.popitem(last=False)
+
+    def finish(self, request_id: Optional[str]) -> Optional[dict]:
+        """Closes a request and returns its usage summary."""
+        record = self._open.pop(request_id, None) if request_id else None
+        if record is None:
+            return None
+        self.requests += 1
+        return record.as_dict()
+
+    def start_call(self, callback_context, llm_request):
+        """before_model_callback: notes when the model call starts and which model it goes to."""
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        self._started.pop(key, None)
+        # Start time, model and the usage recorded for the call so far.
+        self._started[key] = (time.perf_counter(), llm_request.model, Usage())
+        if len(self._started) > self.max_open_requests:
+            # Kept until the agent's next call replaces it, or dropped here.
+            self._started.pop(next(iter(self._started)))
+        return None
+
+    def end_call(self, callback_context, llm_response):
+        """after_model_callback: records the usage of a complete model response.
+
+        A streamed (SSE) call ends in several complete responses whose usage
+        is a running total, so each records only what it adds to the last.
+        """
+        if llm_response.partial or llm_response.usage_metadata is None:
+            return None
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        started, model, recorded = self._started.get(key, (None, None, Usage()))
+        model = model or "unknown"
+        seconds = time.perf_counter() - started if started is not None else 0.0
+        usage = call_usage(model, llm_response.usage_metadata, seconds)
+        if started is not None:
+            self._started[key] = (started, model, usage)
+        self.record(callback_context, model, usage.since(recorded))
+        return None
+
+    def record(self, callback_context, model: str, usage: Usage):
+        state = callback_context.state
+        agent = callback_context.agent_name
+        record = self._open.get(state.get(REQUEST_ID_KEY))
+        if record is not None:
+            route, user_id, session_id = record.route, record.user_id, record.session_id
+            record.total.add(usage)
+            record.by_agent.setdefault(agent, Usage()).add(usage)
+        else:
+            invocation = callback_context._invocation_context
+            route, user_id, session_id = state.get(MODEL_ROUTE_KEY), invocation.user_id, invocation.session.id
+        route = route or "unknown"
+        self.total.add(usage)
+        keys = {
+            "route": route,
+            "agent": agent,
+            "path": f"{route} > {agent}",
+            "model": model,
+            "user": user_id,
+            "session": session_id,
+        }
+        for dimension, key in keys.items():
+            if key is None:
+                continue
+            group = self.aggregates[dimension]
+            group.setdefault(key, Usage()).add(usage)
+            group.move_to_end(key)
+            if dimension in ("user", "session") and len(group) > self.max_keys:
+                group.popitem(last=False)
+
+    def top(self, dimension: str, limit: int = 10, sort_by: str = "cost_usd") -> list:
+        """The costliest keys of a dimension, e.g. top("path") for the most expensive agent paths."""
+        if dimension not in self.aggregates:
+            raise ValueError(f"Unknown dimension '{dimension}', use one of {DIMENSIONS}")
+        rows = [{dimension: key, **usage.as_dict()} for key, usage in self.aggregates[dimension].items()]
+        rows.sort(key=lambda row: (row.get(sort_by) or 0, row["input_tokens"] + row["output_tokens"]), reverse=True)
+        return rows[:limit]
+
+    def get_stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "open_requests": len(self._open),
+            **self.total.as_dict(),
+            "by_route": {key: usage.as_dict() for key, usage in self.aggregates["route"].items()},
+            "by_agent": {key: usage.as_dict() for key, usage in self.aggregates["agent"].items()},
+            "by_model": {key: usage.as_dict() for key, usage in self.aggregates["model"].items()},
+            "top_paths": self.top("path", 5),
+        }
+
+
+usage_ledger = UsageLedger()
+
+
+def start_model_call(callback_context, llm_request):
+    return usage_ledger.start_call(callback_context, llm_request)
+
+
+def record_model_usage(callback_context, llm_response):
+    return usage_ledger.end_call(callback_context, llm_response)
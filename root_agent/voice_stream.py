@@ -0,0 +1,212 @@
+import asyncio
+import io
+import re
+import time
+import wave
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import config
+from deadlines import consume_with_deadline
+
+AUDIO_MIME_TYPES = {"MP3": "audio/mpeg", "OGG_OPUS": "audio/ogg", "LINEAR16": "audio/wav"}
+
+_SENTENCE_END = re.compile(r"[.!?](?:\s|$)|\n")
+_CLAUSE_END = re.compile(r"[,;:](?:\s|$)")
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = 16000, channels: int = 1, sample_width: int = 2) -> bytes:
+    """Wraps raw little-endian PCM from a microphone stream in a WAV header."""
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return out.getvalue()
+
+
+class SpeechChunker:
+    """Cuts streamed answer text into pieces that can be spoken on their own.
+
+    Pieces end at sentence boundaries. The first one may end at a clause
+    boundary once it is long enough, so speech can start early, and no piece
+    grows past `max_chars`.
+    """
+
+    def __init__(self, first_min_chars: int = config.VOICE_FIRST_CHUNK_MIN_CHARS, max_chars: int = config.VOICE_CHUNK_MAX_CHARS):
+        self.first_min_chars = first_min_chars
+        self.max_chars = max_chars
+        self.buffer = ""
+        self.emitted = 0
+
+    def _cut(self) -> Optional[int]:
+        match = _SENTENCE_END.search(self.buffer)
+        if match:
+            return match.end()
+        if self.emitted == 0 and len(self.buffer) >= self.first_min_chars:
+            clauses = list(_CLAUSE_END.finditer(self.buffer))
+            if clauses:
+                return clauses[-1].end()
+        if len(self.buffer) >= self.max_chars:
+            space = self.buffer.rfind(" ", 0, self.max_chars)
+            return space + 1 if space > 0 else self.max_chars
+        return None
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        chunks = []
+        while True:
+            cut = self._cut()
+            if cut is None:
+                return chunks
+            chunk, self.buffer = self.buffer[:cut].strip(), self.buffer[cut:]
+            if chunk:
+                chunks.append(chunk)
+                self.emitted += 1
+
+    def flush(self) -> list:
+        chunk, self.buffer = self.buffer.strip(), ""
+        return [chunk] if chunk else []
+
+
+class VoiceStats:
+    def __init__(self, window: int = 500):
+        self.turns = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.first_audio_ms = deque(maxlen=window)
+
+    def get_stats(self) -> dict:
+        samples = sorted(self.first_audio_ms)
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 1) if samples else None
+
+        return {
+            "turns": self.turns,
+            "cancelled": self.cancelled,
+            "timeouts": self.timeouts,
+            "first_audio_ms_p50": percentile(0.50),
+            "first_audio_ms_p95": percentile(0.95),
+        }
+
+
+voice_stats = VoiceStats()
+
+
+async def run_voice_turn(
+    runner,
+    user_id: str,
+    session_id: str,
+    content,
+    send_event: Callable[[dict], Awaitable],
+    send_audio: Callable[[bytes], Awaitable],
+    state_delta: Optional[dict] = None,
+    timeout: Optional[float] = None,
+    audio_encoding: str = config.VOICE_AUDIO_ENCODING,
+) -> dict:
+    """Runs one agent turn with streamed output and speaks the answer as it is written.
+
+    Text deltas are sent as `transcript` events as soon as the model produces
+    them. Complete sentences are synthesized concurrently (up to
+    VOICE_TTS_CONCURRENCY ahead) and sent as `audio` events followed by the
+    binary chunk, always in order. Cancelling the task (barge-in) stops the
+    agent run and drops pending speech.
+    """
+    from google.adk.agents.run_config import RunConfig, StreamingMode
+    from tts import synthesize_bytes
+
+    start = time.perf_counter()
+    chunker = SpeechChunker()
+    tts_slots = asyncio.Semaphore(config.VOICE_TTS_CONCURRENCY)
+    outbox = asyncio.Queue()  # ("transcript", text) | ("audio", task) | None
+    first_audio_ms = None
+    chunks_sent = 0
+    answer = []
+    streamed_since_final = False
+
+    async def synthesize(text: str) -> bytes:
+        async with tts_slots:
+            return await asyncio.to_thread(synthesize_bytes, text, audio_encoding)
+
+    def speak(chunks):
+        for chunk in chunks:
+            outbox.put_nowait(("audio", asyncio.ensure_future(synthesize(chunk))))
+
+    def add_text(text: str):
+        answer.append(text)
+        outbox.put_nowait(("transcript", text))
+        speak(chunker.feed(text))
+
+    async def sender():
+        nonlocal first_audio_ms, chunks_sent
+        while True:
+            item = await outbox.get()
+            if item is None:
+                return
+            kind, payload = item
+            if kind == "transcript":
+                await send_event({"type": "transcript", "text": payload})
+                continue
+            try:
+                audio = await payload
+            except Exception as e:
+                print(f"Speech synthesis failed for a chunk: {e}")
+                continue
+            if first_audio_ms is None:
+                first_audio_ms = (time.perf_counter() - start) * 1000
+            await send_event({"type": "audio", "seq": chunks_sent, "mime_type": AUDIO_MIME_TYPES[audio_encoding], "bytes": len(audio)})
+            await send_audio(audio)
+            chunks_sent += 1
+
+    def handle_event(event):
+        nonlocal streamed_since_final
+        texts = [p.text for p in (event.content.parts if event.content and event.content.parts else []) if p.text]
+        if event.partial:
+            streamed_since_final = True
+            for text in texts:
+                add_text(text)
+            return False
+        # The aggregated event repeats the streamed deltas; only use it when
+        # the model did not stream.
+        if not streamed_since_final:
+            for text in texts:
+                add_text(text)
+        streamed_since_final = False
+        return event.is_final_response()
+
+    sender_task = asyncio.ensure_future(sender())
+    voice_stats.turns += 1
+    try:
+        events = runner.run_async(
+            user_id=user_id,
+            session_id=session_id,
+            new_message=content,
+            state_delta=state_delta,
+            run_config=RunConfig(streaming_mode=StreamingMode.SSE),
+        )
+        timed_out = await consume_with_deadline(events, timeout, handle_event)
+        speak(chunker.flush())
+        outbox.put_nowait(None)
+        await sender_task
+    except asyncio.CancelledError:
+        voice_stats.cancelled += 1
+        raise
+    finally:
+        sender_task.cancel()
+        while not outbox.empty():
+            item = outbox.get_nowait()
+            if item and item[0] == "audio":
+                item[1].cancel()
+
+    if timed_out:
+        voice_stats.timeouts += 1
+    if first_audio_ms is not None:
+        voice_stats.first_audio_ms.append(first_audio_ms)
+    return {
+        "text": "".join(answer),
+        "status": "timeout" if timed_out else "ok",
+        "first_audio_ms": round(first_audio_ms, 1) if first_audio_ms is not None else None,
+        "audio_chunks": chunks_sent,
+    }
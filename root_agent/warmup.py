@@ -0,0 +1,194 @@
+import asyncio
+import time
+from typing import Optional
+
+import config
+
+STEPS = ("agent", "credentials", "genai", "tts", "rag", "caches", "synthetic")
+WARMUP_APP_NAME = "warmup"
+WARMUP_USER_ID = "warmup"
+
+
+class Warmup:
+    """Primes a new instance before /ready lets the load balancer route to it.
+
+    Each step does work the first request would otherwise pay for, and is
+    timed. Steps run in order (later ones use the agent tree and clients of
+    earlier ones); a required step that fails is retried until it succeeds,
+    any other step is tried once and only reported.
+
+    - agent: imports the ADK stack and builds the agent tree
+    - credentials: resolves and refreshes the Google application credentials
+    - genai: creates the genai clients and opens their pooled connections
+    - tts: creates the Text-to-Speech client and opens its gRPC channel
+    - rag: builds the retrieval tools and lists every corpus' files
+    - caches: creates the instruction caches, loads the reranking embedder and
+      checks the chapter store
+    - synthetic: runs one request through the agent tree in a throwaway session
+    """
+
+    def __init__(self, steps: list, required: set):
+        self.steps = [step for step in steps if step in STEPS]
+        self.required = required
+        self.results = {}  # step -> {"status", "seconds", "attempts", "detail" or "error"}
+        self.status = "pending"  # pending, running, ready
+        self.seconds = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, session_manager):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(session_manager))
+        return self._task
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    async def run(self, session_manager):
+        self.status = "running"
+        started = time.perf_counter()
+        for step in self.steps:
+            self.results[step] = {"status": "running", "seconds": 0.0, "attempts": 0}
+        for step in self.steps:
+            while not await self.run_step(step, session_manager) and step in self.required:
+                await asyncio.sleep(config.WARMUP_RETRY_SECONDS)
+        self.seconds = time.perf_counter() - started
+        self.status = "ready"
+        print(f"Warm-up done in {self.seconds:.1f}s: " + ", ".join(
+            f"{step} {result['seconds']:.2f}s" + ("" if result["status"] == "ok" else f" ({result['status']})")
+            for step, result in self.results.items()
+        ))
+
+    async def run_step(self, step: str, session_manager) -> bool:
+        result = self.results[step]
+        result["attempts"] += 1
+        started = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(STEP_FUNCTIONS[step](session_manager), config.WARMUP_STEP_TIMEOUT_SECONDS)
+            result.update(status="ok", detail=detail)
+            result.pop("error", None)
+            return True
+        except Exception as e:
+            error = "timed out" if isinstance(e, asyncio.TimeoutError) else f"{type(e).__name__}: {e}"
+            result.update(status="failed", error=error)
+            print(f"Warm-up step {step} failed: {error}")
+            return False
+        finally:
+            result["seconds"] = round(result["seconds"] + time.perf_counter() - started, 3)
+
+    def get_stats(self) -> dict:
+        return {
+            "status": self.status,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "required": sorted(self.required & set(self.steps)),
+            "steps": self.results,
+        }
+
+
+async def warm_agent(session_manager):
+    await session_manager.ensure_loaded()
+    return {"agent": session_manager.root_agent.name}
+
+
+async def warm_credentials(session_manager):
+    def refresh():
+        import google.auth
+        from google.auth.transport.requests import Request
+
+        credentials, project = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+        credentials.refresh(Request())
+        return {"project": project, "type": type(credentials).__name__}
+
+    return await asyncio.to_thread(refresh)
+
+
+async def warm_genai(session_manager):
+    import genai_clients
+    from model_registry import registry
+
+    model = registry.model_for("root")
+    clients = {id(c): c for c in (genai_clients.get_client(), genai_clients.get_client(vertexai=True))}
+    # Concurrent requests so the pool holds that many open connections
+    # (with HTTP/2 they share one).
+    await asyncio.gather(*(
+        client.aio.models.get(model=model)
+        for client in clients.values() for _ in range(config.WARMUP_GENAI_CONNECTIONS)
+    ))
+    return {"clients": len(clients), "connections": genai_clients.get_stats()}
+
+
+async def warm_tts(session_manager):
+    import tts
+
+    def connect():
+        # The channel connects on the first call.
+        return len(tts.get_client().list_voices(language_code="en-US").voices)
+
+    return {"voices": await asyncio.to_thread(connect)}
+
+
+async def warm_rag(session_manager):
+    from corpus_registry import corpora
+    from rag_agent import get_retrieval
+
+    for corpus in corpora.corpora:
+        get_retrieval(corpus.agent_name)
+    files = await asyncio.gather(*(asyncio.to_thread(corpus.files) for corpus in corpora.corpora))
+    return {corpus.name: len(listed) for corpus, listed in zip(corpora.corpora, files)}
+
+
+async def warm_caches(session_manager):
+    from chapter_store import chapter_store
+    from context_cache import context_cache
+    from imagen_agent import get_imagen_agent_tool
+    from rag_compression import rag_compressor
+
+    await context_cache.warm([session_manager.root_agent, get_imagen_agent_tool()])
+    if rag_compressor.enabled:
+        await asyncio.to_thread(rag_compressor.embedder.load)
+    return {
+        "context_caches": len(context_cache.handles),
+        "rag_embedder": rag_compressor.get_stats()["semantic"],
+        "chapters": len(chapter_store.chapters),
+    }
+
+
+async def warm_agent_tree(session_manager):
+    from google.adk.runners import Runner
+    from google.genai import types
+
+    runner = Runner(
+        agent=session_manager.root_agent,
+        app_name=WARMUP_APP_NAME,
+        session_service=session_manager.session_service,
+        artifact_service=session_manager.artifact_service,
+    )
+    session = await session_manager.session_service.create_session(app_name=WARMUP_APP_NAME, user_id=WARMUP_USER_ID)
+    message = types.Content(role="user", parts=[types.Part(text=config.WARMUP_SYNTHETIC_QUERY)])
+    events, authors = 0, []
+    try:
+        async for event in runner.run_async(user_id=WARMUP_USER_ID, session_id=session.id, new_message=message):
+            events += 1
+            if event.author not in authors:
+                authors.append(event.author)
+    finally:
+        await session_manager.session_service.delete_session(
+            app_name=WARMUP_APP_NAME, user_id=WARMUP_USER_ID, session_id=session.id
+        )
+    return {"events": events, "authors": authors}
+
+
+STEP_FUNCTIONS = {
+    "agent": warm_agent,
+    "credentials": warm_credentials,
+    "genai": warm_genai,
+    "tts": warm_tts,
+    "rag": warm_rag,
+    "caches": warm_caches,
+    "synthetic": warm_agent_tree,
+}
+
+warmup = Warmup(
+    [step.strip() for step in config.WARMUP_STEPS.split(",") if step.strip()] if config.WARMUP else [],
+    {step.strip() for step in config.WARMUP_REQUIRED_STEPS.split(",") if step.strip()},
+)